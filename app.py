@@ -1,21 +1,43 @@
-import os
 import io
+import os
 import json
+import mimetypes
 import logging
 from datetime import datetime, timezone
 import uuid
-import openpyxl
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_from_directory, Response, g, send_file
-from flask_session import Session
+import hashlib
+import threading
+import time
+from urllib.parse import urlencode
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, session, send_from_directory, Response, g, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFProtect, generate_csrf, CSRFError
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
+import click
 from openai import OpenAI
 from sqlalchemy import func
+from sqlalchemy.orm import validates
 from sqlalchemy.exc import IntegrityError
 from dotenv import load_dotenv
 import secrets
+from job_queue import JobQueue, TaskError, QUEUED
+from extraction import ExtractionEngine, extraction_fields
+from storage import BackgroundWriter, DEFAULT_STORAGE_BACKEND, LocalStorage, create_storage, shard_key
+from upload_gc import DEFAULT_GC_GRACE, DEFAULT_GC_INTERVAL, UploadCollector
+from derivatives import RENDITIONS, derivative_filename, ensure_derivative, write_derivatives
+from ingest import FormIngestor, DEFAULT_INGEST_BATCH_SIZE
+from db_config import configure_sqlite, engine_options, log_sqlite_settings, sqlite_pragmas
+from sessions import DEFAULT_SESSION_BACKEND, configure_sessions
+from response_cache import (DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL, EMPLOYEES, FORMS, add_validators,
+                            create_response_cache, form_tag, form_tags, not_modified, summary_tag)
+from migrations import run_migrations
+from reports import ReportService, normalize_mode
+from ledger_export import (LEDGER_FORMATS, ledger_statement, iter_ledger_batches, csv_chunks, write_parquet,
+                           parquet_available)
+from pagination import CursorError, DIRECTIONS, keyset_page, page_size
+from excel_export import MONEY_FORMAT, HEADER_FONT, new_workbook, cell, header_row, send_workbook
+from search import deferred_reindex, fts_query, matching_form_ids, search_available, search_forms
 
 # Load environment variables from .env file
 load_dotenv()
@@ -26,44 +48,100 @@ app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 
 # Configure application
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.environ.get('DATABASE_PATH', 'database.db')  # relative to instance/
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(os.environ, app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLITE_PRAGMAS'] = sqlite_pragmas(os.environ)  # WAL, synchronous, mmap, cache and busy timeout
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['UPLOAD_MAX_AGE'] = 365 * 24 * 3600  # seconds browsers keep uploaded images (names are never reused)
+# Upload storage: local (sharded under UPLOAD_FOLDER) or s3 (any S3-compatible bucket), see storage.py
+app.config['UPLOAD_BACKEND'] = os.environ.get('UPLOAD_BACKEND', DEFAULT_STORAGE_BACKEND)
+app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', 'uploads/')
+app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')  # e.g. a MinIO server; AWS when unset
+app.config['S3_REGION'] = os.environ.get('S3_REGION')
+# Images no form uses are deleted after UPLOAD_GC_GRACE seconds, checked every UPLOAD_GC_INTERVAL (0 = never)
+app.config['UPLOAD_GC_GRACE'] = int(os.environ.get('UPLOAD_GC_GRACE', DEFAULT_GC_GRACE))
+app.config['UPLOAD_GC_INTERVAL'] = int(os.environ.get('UPLOAD_GC_INTERVAL', DEFAULT_GC_INTERVAL))
 app.config['WTF_CSRF_ENABLED'] = True
 app.config['WTF_CSRF_SECRET_KEY'] = os.environ.get('CSRF_SECRET_KEY') or secrets.token_hex(32)
 app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour CSRF token expiration
 
-# Configure session to use filesystem instead of cookie-based
-app.config['SESSION_TYPE'] = 'filesystem'
+# Session store: sqlite, redis, cookie or filesystem (see sessions.py)
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', DEFAULT_SESSION_BACKEND)
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 app.config['SESSION_FILE_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flask_session')
-app.config['SESSION_FILE_THRESHOLD'] = 100  # Maximum number of sessions stored
+app.config['SESSION_FILE_THRESHOLD'] = 100  # Maximum number of sessions stored (filesystem backend)
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour session lifetime
 
+# Cache for the dashboard, monthly summaries and form APIs: memory, redis (shared by workers) or off
+app.config['RESPONSE_CACHE'] = os.environ.get('RESPONSE_CACHE', 'memory')
+app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', DEFAULT_CACHE_TTL))  # seconds
+app.config['RESPONSE_CACHE_SIZE'] = int(os.environ.get('RESPONSE_CACHE_SIZE', DEFAULT_CACHE_SIZE))  # entries (memory)
+
+# Background processing of uploaded forms
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+app.config['PREPROCESS_WORKERS'] = int(os.environ.get('PREPROCESS_WORKERS', 0))  # 0 = preprocess on the job worker thread
+app.config['ENHANCE_OUTPUT_MODE'] = os.environ.get('ENHANCE_OUTPUT_MODE', 'color')  # color, gray or binary
+app.config['ENHANCE_THRESHOLD'] = os.environ.get('ENHANCE_THRESHOLD', 'mean')  # mean or integral
+app.config['INGEST_BATCH_SIZE'] = int(os.environ.get('INGEST_BATCH_SIZE', DEFAULT_INGEST_BATCH_SIZE))  # forms per write transaction
+app.config['JOB_QUEUE_EAGER'] = os.environ.get('JOB_QUEUE_EAGER', '').lower() in ('1', 'true', 'yes')  # run tasks inline (tests)
+
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Ensure session directory exists
-os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
-
 # Initialize extensions
 db = SQLAlchemy(app)
+with app.app_context():
+    configure_sqlite(db.engine, app.config['SQLITE_PRAGMAS'])
 csrf = CSRFProtect(app)
 
-# Initialize Flask-Session
-Session(app)
+# Preprocessing workers (PREPROCESS_WORKERS > 0) start with forkserver or spawn, and each one
+# re-imports the script that launched the server as __mp_main__: under `python app.py`, this
+# module. Such a copy only needs the definitions, so it skips everything guarded by
+# SERVER_PROCESS: logging setup, database creation and migrations, and background threads.
+SERVER_PROCESS = __name__ != '__mp_main__'
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[logging.StreamHandler(), logging.FileHandler('app.log')])
+if SERVER_PROCESS:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[logging.StreamHandler(), logging.FileHandler('app.log')])
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client with API key from environment variable
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Initialize the session store
+configure_sessions(app, db, app.config['SESSION_BACKEND'], app.config['REDIS_URL'])
+
+# Invalidated by tag after every write that changes what the cached pages show
+response_cache = create_response_cache(app.config['RESPONSE_CACHE'], app.config['REDIS_URL'],
+                                       app.config['RESPONSE_CACHE_TTL'], app.config['RESPONSE_CACHE_SIZE'])
+
+# Initialize OpenAI client with API key from environment variable.
+# Retries are handled by the extraction engine, so the client's own are disabled.
+client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+extraction_engine = ExtractionEngine(
+    client,
+    model=os.environ.get('OPENAI_MODEL', 'gpt-4.1'),
+    max_concurrency=int(os.environ.get('OPENAI_MAX_CONCURRENCY', 4)),
+    requests_per_minute=int(os.environ.get('OPENAI_REQUESTS_PER_MINUTE', 0)),
+    tokens_per_minute=int(os.environ.get('OPENAI_TOKENS_PER_MINUTE', 0)),
+    tokens_per_request=int(os.environ.get('OPENAI_TOKENS_PER_REQUEST', 4000)),
+    max_retries=int(os.environ.get('OPENAI_MAX_RETRIES', 5)),
+    image_mode=os.environ.get('OPENAI_IMAGE_MODE', 'inline'),
+    image_format=os.environ.get('OPENAI_IMAGE_FORMAT', 'jpeg'),
+    image_max_side=int(os.environ.get('OPENAI_IMAGE_MAX_SIDE', 2048)),
+    image_quality=int(os.environ.get('OPENAI_IMAGE_QUALITY', 85))
+)
+
+# Upload storage. Files left flat in the upload folder by older versions aren't served until
+# `flask migrate-uploads` moves them into their shards; only warn here, never move data on import.
+upload_store = create_storage(app.config['UPLOAD_BACKEND'], app.config['UPLOAD_FOLDER'], app.config['S3_BUCKET'],
+                              app.config['S3_PREFIX'], app.config['S3_ENDPOINT_URL'], app.config['S3_REGION'])
+if SERVER_PROCESS and isinstance(upload_store, LocalStorage) and any(True for _ in upload_store.flat_files()):
+    logger.warning(f"Uploads in the old flat layout found in {upload_store.root}; "
+                   f"run `flask migrate-uploads` to move them into shard directories")
 
 # Create all database tables
-with app.app_context():
-    db.create_all()
+if SERVER_PROCESS:
+    with app.app_context():
+        db.create_all()
 
 # Add current datetime to template context
 @app.context_processor
@@ -89,9 +167,23 @@ class ReimbursementForm(db.Model):
     total_amount = db.Column(db.Float)
     image_filename = db.Column(db.String(200))
     raw_data = db.Column(db.Text) # <-- Add this line
+    # Normalized from raw_data at ingest so reads never parse the blob (see extraction_fields)
+    extracted_name = db.Column(db.String(200))  # 'Name of Employee'
+    header_total = db.Column(db.Float)  # 'Total Amount' as written on the form
+    calculated_total = db.Column(db.Float)  # Sum of the extracted expense amounts
+    total_mismatch = db.Column(db.Boolean)
+    extraction_model = db.Column(db.String(100))
+    extraction_ms = db.Column(db.Integer)  # Latency of the model call(s)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
+    # Month filters are half-open ranges on to_date (see reports.month_filter)
+    __table_args__ = (
+        db.Index('ix_reimbursement_form_to_date', 'to_date'),
+        db.Index('ix_reimbursement_form_employee_id_to_date', 'employee_id', 'to_date'),
+        db.Index('ix_reimbursement_form_created_at', 'created_at'),
+    )
+
 class ExpenseEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     form_id = db.Column(db.Integer, db.ForeignKey('reimbursement_form.id'), nullable=False)
@@ -100,21 +192,148 @@ class ExpenseEntry(db.Model):
     to_location = db.Column(db.String(100))
     purpose = db.Column(db.String(200))
     mode_of_travel = db.Column(db.String(50))
+    mode_normalized = db.Column(db.String(50), index=True)  # normalize_mode(mode_of_travel), kept in sync below
     distance_km = db.Column(db.Float)
     amount_rs = db.Column(db.Float)
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+    __table_args__ = (
+        db.Index('ix_expense_entry_form_id_date', 'form_id', 'date'),
+    )
+
+    @validates('mode_of_travel')
+    def _normalize_mode(self, key, value):
+        self.mode_normalized = normalize_mode(value)
+        return value
+
+class ProcessingJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED)
+    total_files = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime)
+    tasks = db.relationship('ProcessingTask', backref='job', lazy=True, order_by='ProcessingTask.id')
+
+class ProcessingTask(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('processing_job.id'), nullable=False, index=True)
+    original_filename = db.Column(db.String(255))
+    stored_filename = db.Column(db.String(200), nullable=False)
+    content_hash = db.Column(db.String(64), index=True)
+    detection_tier = db.Column(db.String(20))  # table detection strategy used by autocrop
+    status = db.Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    message = db.Column(db.Text)
+    form_id = db.Column(db.Integer)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class ExtractionCache(db.Model):
+    """Preprocessed image and parsed extraction result for an upload, keyed by its SHA-256."""
+    content_hash = db.Column(db.String(64), primary_key=True)
+    processed_filename = db.Column(db.String(200))
+    result_json = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+class MonthlyEmployeeRollup(db.Model):
+    """
+    Per-employee totals for forms ending in a month, maintained by ReportService.refresh_rollups()
+    in the same transaction as every form write. group_key is the employee ID, or 'form_<id>' for
+    forms without one (reported on their own row).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    group_key = db.Column(db.String(40), nullable=False)
+    employee_id = db.Column(db.String(20))
+    extracted_name = db.Column(db.String(200))
+    location = db.Column(db.String(100))
+    local_conveyance = db.Column(db.Float, nullable=False, default=0)
+    exp_reimbursement = db.Column(db.Float, nullable=False, default=0)
+    form_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.UniqueConstraint('year', 'month', 'group_key', name='uq_monthly_employee_rollup_key'),
+    )
+
+reports = ReportService(db, ReimbursementForm, ExpenseEntry, Employee, MonthlyEmployeeRollup)
+
+# Create database tables and bring existing databases up to date
+search_enabled = False
+if SERVER_PROCESS:
+    with app.app_context():
+        db.create_all()
+        run_migrations(db.engine)
+        log_sqlite_settings(db.engine)
+        if reports.rollups_missing():
+            logger.info(f"Building monthly rollups: {reports.rebuild_rollups()} row(s)")
+            db.session.commit()
+        # False when SQLite lacks FTS5; searches then report that search is unavailable
+        search_enabled = search_available(db.session)
 
 # Add CSRF token to all templates
 @app.context_processor
 def inject_template_vars():
     return {
         'csrf_token': generate_csrf,
-        'debug': app.debug
+        'debug': app.debug,
+        'upload_url': upload_url
     }
 
+def upload_url(filename, rendition=None):
+    """URL of an uploaded image, or of one of its RENDITIONS (generated on first request if missing)"""
+    name = filename if rendition is None else derivative_filename(filename, rendition)
+    if isinstance(upload_store, LocalStorage):
+        # Local uploads are static files, in shard directories under static/uploads
+        if rendition is None or upload_store.exists(name):
+            return url_for('static', filename='uploads/' + shard_key(name))
+    elif rendition is None:
+        return url_for('upload_file', name=name)
+    # Not checked in a bucket (a request per image per page); upload_rendition makes it if missing
+    return url_for('upload_rendition', rendition=rendition, filename=filename)
+
+def send_upload(name):
+    """Response with a stored upload; raises ValueError for names outside the store"""
+    if isinstance(upload_store, LocalStorage):
+        return send_from_directory(os.path.abspath(upload_store.root), shard_key(name))
+    data = upload_store.get(name)
+    if data is None:
+        return "Image not found", 404
+    return send_file(io.BytesIO(data), mimetype=mimetypes.guess_type(name)[0], etag=name, conditional=True)
+
+@app.route('/uploads/<name>')
+def upload_file(name):
+    """Serve an upload from a store that isn't a static folder (UPLOAD_BACKEND=s3)"""
+    try:
+        return send_upload(name)
+    except ValueError:
+        return "Image not found", 404
+
+@app.route('/uploads/<rendition>/<path:filename>')
+def upload_rendition(rendition, filename):
+    """Serve a rendition of an uploaded image, generating it for images stored before renditions existed"""
+    if rendition not in RENDITIONS:
+        return "Unknown rendition", 404
+    try:
+        name = ensure_derivative(upload_store, filename, rendition)
+    except ValueError:
+        name = None
+    if name is None:
+        return "Image not found", 404
+    return send_upload(name)
+
+# Uploaded images and their renditions never change under a given name (content hashes, or UUIDs for older uploads)
+@app.after_request
+def cache_uploads(response):
+    filename = (request.view_args or {}).get('filename', '') if request.endpoint == 'static' else ''
+    uploaded = filename.startswith('uploads/') or request.endpoint in ('upload_file', 'upload_rendition')
+    if uploaded and response.status_code in (200, 304):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['UPLOAD_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
 # Handle CSRF errors
 @app.errorhandler(CSRFError)
 def handle_csrf_error(e):
@@ -179,156 +398,104 @@ def parse_date(date_str):
     return None
 
 # Extract data using OpenAI API
-def extract_data_with_openai(file_path):
-    try:
-        # Upload the image
-        with open(file_path, 'rb') as f:
-            file = client.files.create(
-                file=f,
-                purpose="user_data"
-            )
-        
-        # Define the prompt with explicit date format and strict JSON response requirement
-        prompt = (
-            """
-            Carefully examine the expense table on this form. Internally determine the layout including the number of rows and columns to ensure no values are skipped during extraction — especially merged cells or multi-line text.
-
-            Then extract:
-
-            1. Header Section (top of the form):
-            - Employee ID, Name of Employee, Designation, Location
-            - From Date and To Date (format: DD.MM.YYYY)
-            - Total Amount (numeric only, no symbols).  
-                It may be labeled as "Total" or "Total Amount" or "Total Amount (in Rs.)"  
-                If this field is **not present anywhere in the image**, return 0.
-            - In addition to the above, always compute and return the sum of all extracted "Amount (in Rs.)" values as a separate field called "Calculated Total".
-            - If both a header total and a calculated total are present, compare them and add a boolean field "total_mismatch": true if they differ, false if they match. Always include both totals and the flag in the output.
-
-            2. Expense Entries (the table):
-            - Merged-cell values (e.g. Purpose, Date, From/To) must be duplicated across the rows they visually span.
-            - For each row, extract:
-                • Date (in DD.MM.YYYY format)
-                • From, To
-                • Purpose (exact text)
-                • Mode of Travel: normalize to one of the following values:
-                - "2-Wheeler"
-                - "4-Wheeler"
-                - "Cab" (for entries mentioning cab, ola, uber, auto, or taxi)
-                - "Food & Misc." (see below)
-                • Distance (in Km): extract numeric only, or zero
-                • Amount (in Rs.): extract numeric only
-
-            Special case:
-            - For any row related to food or miscellaneous expenses:
-                • Set **From**, **To**, and **Mode of Travel** to `"Food & Misc."`
-                • Set **Distance (in Km)** to `"0"`
-                • Purpose should remain as-is
-
-            3. Validation:
-            - Sum all extracted "Amount (in Rs.)" values.
-            - If a Total Amount is present in the header, compare it to the computed sum.
-            - If the header total is missing, simply use the computed sum as the total.
-
-            Return ONLY a single JSON object — no markdown, no explanation, no comments:
-
-            {
-            "header": {
-                "Employee ID": "string",
-                "Name of Employee": "string",
-                "Designation": "string",
-                "Location": "string",
-                "From Date": "DD.MM.YYYY",
-                "To Date": "DD.MM.YYYY",
-                "Total Amount": "string",
-                "Calculated Total": "string",
-                "total_mismatch": true/false
-            },
-            "expenses": [
-                {
-                "Date": "DD.MM.YYYY",
-                "From": "string",
-                "To": "string",
-                "Purpose": "string",
-                "Mode of Travel": "string",
-                "Distance (in Km)": "string",
-                "Amount (in Rs.)": "string"
-                }
-            ]
-            }
-            """
-        )     
-        # Call the model with the required input format
-        response = client.responses.create(
-            model="gpt-4.1",
-            input=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "input_image", "file_id": file.id},
-                        {"type": "input_text", "text": prompt}
-                    ]
-                }
-            ]
-        )
-        
-        # Extract the content from the response
-        content = response.output[0].content[0].text
-        
-        # Clean the response (remove markdown code blocks if present)
-        if content.strip().startswith('```'):
-            # Handle both ```json and ``` cases
-            if content.strip().startswith('```json'):
-                content = content.split('```json')[1].split('```')[0].strip()
-            else:
-                content = content.split('```')[1].strip()
-        
-        if not content:
-            logger.error("Empty response from OpenAI API")
-            return None
-        
-        try:
-            # Try to parse the JSON
-            data = json.loads(content)
-            
-            # Validate the response structure
-            if not isinstance(data, dict) or 'header' not in data or 'expenses' not in data:
-                logger.error(f"Invalid response format. Missing required fields. Content: {content}")
-                return None
-
-            # Postprocess: If Total Amount is '0' or empty, replace with sum of expenses
-            header = data.get('header', {})
-            expenses = data.get('expenses', [])
-            total_amount = header.get('Total Amount', '').strip()
-            # Compute sum of all extracted expense amounts
-            try:
-                sum_expenses = sum(float(e.get('Amount (in Rs.)', '0').replace(',', '').strip()) for e in expenses)
-            except Exception as e:
-                logger.error(f"Error calculating sum of expenses: {e}")
-                sum_expenses = 0
-
-            if not total_amount or total_amount == '0':
-                header['Total Amount'] = str(int(sum_expenses) if sum_expenses == int(sum_expenses) else sum_expenses)
-            # Always update Calculated Total to backend sum for consistency
-            header['Calculated Total'] = str(int(sum_expenses) if sum_expenses == int(sum_expenses) else sum_expenses)
-            # Update mismatch flag
-            try:
-                total_amount_val = float(header['Total Amount'])
-                calculated_total_val = float(header['Calculated Total'])
-                header['total_mismatch'] = abs(total_amount_val - calculated_total_val) > 0.01
-            except Exception as e:
-                logger.warning(f"Could not compare totals for mismatch: {e}")
-                header['total_mismatch'] = False
-
-            logger.info(f"Successfully parsed data from OpenAI: {json.dumps(data, indent=2)}")
-            return data
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse response as JSON: {e}. Raw response: {content}")
+def extract_data_with_openai(image):
+    """Extract form data from a preprocessed image array or file path."""
+    return extraction_engine.extract(image)
+
+def form_list_query():
+    """
+    Forms joined to their employee in one query, projecting only the columns listings
+    need. `name` is the employee's name, falling back to the name extracted from the form.
+    """
+    return db.session.query(
+        ReimbursementForm.id,
+        ReimbursementForm.employee_id,
+        ReimbursementForm.designation,
+        ReimbursementForm.location,
+        ReimbursementForm.from_date,
+        ReimbursementForm.to_date,
+        ReimbursementForm.total_amount,
+        ReimbursementForm.image_filename,
+        ReimbursementForm.created_at,
+        func.coalesce(func.nullif(Employee.name, ''), ReimbursementForm.extracted_name, '').label('name')
+    ).outerjoin(Employee, Employee.employee_id == ReimbursementForm.employee_id)
+
+# Cached pages and API responses (see response_cache.py)
+def page_etag(entry):
+    """
+    ETag for a page rendered from a cached entry, or None if the page can't be revalidated.
+
+    Besides the cached data, pages embed the session's CSRF token (re-signed every half
+    WTF_CSRF_TIME_LIMIT, so a page reused from the browser cache never carries an expired
+    token) and flash messages (a page showing them is never revalidated).
+    """
+    if '_flashes' in session or 'csrf_token' not in session:
+        return None
+    window = int(time.time() // (app.config['WTF_CSRF_TIME_LIMIT'] / 2))
+    return hashlib.sha1(f"{entry.etag}:{session['csrf_token']}:{window}".encode()).hexdigest()
+
+def cached_page(entry, render):
+    """render() as a response with validators for entry, or a 304 if the client's copy is current."""
+    etag = page_etag(entry)
+    if etag is None:
+        return render()
+    return not_modified(etag, entry.last_modified) or add_validators(make_response(render()), etag,
+                                                                     entry.last_modified)
+
+def cached_json(entry):
+    """entry's value as JSON with validators, or a 304 if the client's copy is current."""
+    return not_modified(entry.etag, entry.last_modified) or add_validators(jsonify(entry.value), entry.etag,
+                                                                           entry.last_modified)
+
+def form_validator(form_id):
+    """
+    Cached validator for a form's detail fragments: the form's updated_at plus the employee
+    details they show (editing an employee doesn't touch the form). Returns (entry, Last-Modified);
+    the entry's value is None for a missing form. A hit costs no queries.
+    """
+    def validator():
+        row = db.session.query(
+            ReimbursementForm.updated_at, Employee.name, Employee.bank_name, Employee.account_number, Employee.ifsc_code
+        ).outerjoin(Employee, Employee.employee_id == ReimbursementForm.employee_id
+        ).filter(ReimbursementForm.id == form_id).first()
+        if row is None:
             return None
-            
-    except Exception as e:
-        logger.error(f"OpenAI API error: {str(e)}", exc_info=True)
-        raise
+        updated_at, *employee = row
+        return {'updated_at': updated_at, 'employee': employee}
+    entry = response_cache.get_or_set(f'form_validator:{form_id}', [form_tag(form_id), EMPLOYEES], validator)
+    updated_at = entry.value['updated_at'] if entry.value else None
+    return entry, updated_at.replace(tzinfo=timezone.utc) if updated_at else entry.last_modified
+
+def dashboard_data(year, month):
+    """Everything the dashboard shows, as plain values for the response cache."""
+    # Get recent forms (last 5) with employee name in a single joined query
+    recent_forms = form_list_query().order_by(
+        ReimbursementForm.created_at.desc()
+    ).limit(5).all()
+
+    # Get monthly summary for the month from the rollup table
+    totals = reports.month_totals(year, month)
+
+    # Get recent employees (last 5)
+    recent_employees = Employee.query.order_by(
+        Employee.id.desc()
+    ).limit(5).all()
+
+    return {
+        'total_employees': Employee.query.count(),
+        'total_forms': ReimbursementForm.query.count(),
+        'recent_forms': [{
+            'form': {'id': form.id, 'employee_id': form.employee_id, 'from_date': form.from_date,
+                     'to_date': form.to_date, 'total_amount': form.total_amount},
+            'name': form.name,
+        } for form in recent_forms],
+        'monthly_summary': {'total_amount': totals.total_amount, 'form_count': totals.form_count,
+                            'employee_count': totals.employee_count},
+        'recent_employees': [{
+            'id': employee.id, 'employee_id': employee.employee_id, 'name': employee.name,
+            'bank_name': employee.bank_name, 'account_number': employee.account_number,
+        } for employee in recent_employees],
+    }
 
 # Routes
 @app.route('/')
@@ -337,65 +504,15 @@ def index():
     now = datetime.now()
     current_month = now.month
     current_year = now.year
-    
-    # Get counts for dashboard cards
-    total_employees = Employee.query.count()
-    total_forms = ReimbursementForm.query.count()
-    
-    # Get recent forms (last 5) with employee details
-    recent_forms = ReimbursementForm.query.order_by(
-        ReimbursementForm.created_at.desc()
-    ).limit(5).all()
-    
-    # Build processed_recent_forms with robust employee name fallback
-    processed_recent_forms = []
-    for form in recent_forms:
-        emp = Employee.query.filter_by(employee_id=form.employee_id).first()
-        raw_data = None
-        extracted_name = None
-        if hasattr(form, 'raw_data') and form.raw_data:
-            try:
-                raw_data = form.raw_data if isinstance(form.raw_data, dict) else json.loads(form.raw_data)
-                extracted_name = raw_data.get('header', {}).get('Name of Employee') if raw_data else None
-            except Exception:
-                raw_data = None
-                extracted_name = None
-        processed_recent_forms.append({
-            'form': form,
-            'employee': emp,
-            'extracted_name': extracted_name
-        })
-    recent_forms = processed_recent_forms
-    
-    # Get monthly summary for the current month
-    monthly_summary = db.session.query(
-        func.sum(ExpenseEntry.amount_rs).label('total_amount'),
-        func.count(ReimbursementForm.id.distinct()).label('form_count'),
-        func.count(Employee.id.distinct()).label('employee_count')
-    ).join(
-        ReimbursementForm, ReimbursementForm.id == ExpenseEntry.form_id
-    ).join(
-        Employee, Employee.employee_id == ReimbursementForm.employee_id
-    ).filter(
-        func.strftime('%Y', ReimbursementForm.to_date) == str(current_year),
-        func.strftime('%m', ReimbursementForm.to_date) == f"{current_month:02d}"
-    ).first()
-    
-    # Get recent employees (last 5)
-    recent_employees = Employee.query.order_by(
-        Employee.id.desc()
-    ).limit(5).all()
-    
-    return render_template(
+
+    entry = response_cache.get_or_set(f'dashboard:{current_year}-{current_month:02d}', [FORMS, EMPLOYEES],
+                                      lambda: dashboard_data(current_year, current_month))
+    return cached_page(entry, lambda: render_template(
         'index.html',
-        total_employees=total_employees,
-        total_forms=total_forms,
-        recent_forms=processed_recent_forms,
-        monthly_summary=monthly_summary,
-        recent_employees=recent_employees,
+        **entry.value,
         current_month=now.strftime('%B %Y'),
         now=now
-    )
+    ))
 
 @app.route('/employees')
 def employees():
@@ -416,6 +533,7 @@ def new_employee():
         try:
             db.session.add(employee)
             db.session.commit()
+            response_cache.invalidate(EMPLOYEES)
             flash('Employee added successfully!')
         except IntegrityError:
             db.session.rollback()
@@ -434,134 +552,320 @@ def edit_employee(employee_id):
         employee.account_number = request.form['account_number']
         employee.ifsc_code = request.form['ifsc_code']
         db.session.commit()
+        response_cache.invalidate(EMPLOYEES)
         flash('Employee updated successfully!', 'success')
         return redirect(url_for('employees'))
     return render_template('edit_employee.html', employee=employee)
 
+def store_extraction_cache(content_hash, processed_filename=None, result=None):
+    """Record the preprocessed image and/or extraction result for an upload hash."""
+    for attempt in range(2):
+        entry = db.session.get(ExtractionCache, content_hash)
+        if entry is None:
+            entry = ExtractionCache(content_hash=content_hash)
+            db.session.add(entry)
+        if processed_filename is not None:
+            entry.processed_filename = processed_filename
+        if result is not None:
+            entry.result_json = json.dumps(result)
+        try:
+            db.session.commit()
+            return entry
+        except IntegrityError:
+            # Another worker cached the same content first; update its row instead
+            db.session.rollback()
+    logger.warning(f"Could not store extraction cache for {content_hash}")
+    return None
+
+_preprocess_executor = None
+_preprocess_executor_lock = threading.Lock()
+
+def preprocess_upload(content):
+    """
+    Autocrop an upload's bytes, on the shared process pool when PREPROCESS_WORKERS > 0.
+    Returns (combined image, detection tier). If the upload crashes a worker process, only
+    this upload fails: the pool replaces its processes for the uploads that follow.
+    """
+    from image_preprocess import autocrop_array, decode_image, create_preprocess_executor, preprocess_batch
+    global _preprocess_executor
+    options = {'output_mode': app.config['ENHANCE_OUTPUT_MODE'], 'threshold': app.config['ENHANCE_THRESHOLD']}
+    if app.config['PREPROCESS_WORKERS'] <= 0:
+        return autocrop_array(decode_image(content), return_tier=True, **options)
+    with _preprocess_executor_lock:
+        if _preprocess_executor is None:
+            _preprocess_executor = create_preprocess_executor(app.config['PREPROCESS_WORKERS'])
+    result = preprocess_batch([content], executor=_preprocess_executor, **options)[0]
+    if result['error']:
+        raise ValueError(result['error'])
+    return result['image'], result['tier']
+
+def process_upload_task(task, content=None):
+    """
+    Preprocess, extract and validate a single uploaded file. Returns the form and its
+    entries as an ingest item for FormIngestor, which the job queue stores in batches.
+
+    `content` is the upload's bytes as read from the request; the pipeline decodes
+    them once and keeps every intermediate image in memory, while the original and
+    the combined image are written to the upload store in the background. When the
+    bytes aren't available (recovered task) the original is read back from the store.
+    """
+    orig_filename = task.original_filename or task.stored_filename
+
+    cached = db.session.get(ExtractionCache, task.content_hash) if task.content_hash else None
+    data = None
+    processed_filename = None
+    processed_image = None
+    if cached and cached.result_json:
+        # Resubmitted form: link to the form already created from it, or rebuild from the cached result
+        existing = ReimbursementForm.query.filter_by(image_filename=cached.processed_filename).first() if cached.processed_filename else None
+        if existing:
+            logger.info(f"{orig_filename} is identical to form {existing.id}; skipping processing")
+            return {'form_id': existing.id}
+        data = json.loads(cached.result_json)
+        processed_filename = cached.processed_filename
+        logger.info(f"Using cached extraction for {orig_filename} ({task.content_hash})")
+    elif cached and cached.processed_filename and upload_store.exists(cached.processed_filename):
+        processed_filename = cached.processed_filename
+        logger.info(f"Using cached preprocessed image {processed_filename} for {orig_filename}")
+
+    if processed_filename is None:
+        if content is None:
+            content = upload_store.get(task.stored_filename)
+            if content is None:
+                logger.error(f"File {task.stored_filename} does not exist for task {task.id}")
+                raise TaskError(f"File {orig_filename} could not be found after upload.")
+        # Preprocess the image (autocrop, enhance, combine)
+        try:
+            processed_image, task.detection_tier = preprocess_upload(content)
+        except Exception as e:
+            logger.error(f"Error preprocessing image {task.stored_filename}: {e}")
+            raise TaskError(f"Failed to preprocess image {orig_filename}. Error: {e}")
+        # Binary output compresses far better as lossless PNG than as JPEG
+        processed_ext = '.png' if app.config['ENHANCE_OUTPUT_MODE'] == 'binary' else '.jpg'
+        processed_filename = f"combined_{os.path.splitext(task.stored_filename)[0]}{processed_ext}"
+        storage_writer.write_image(processed_filename, processed_image)
+        # Thumbnail/medium renditions from the pixels already in memory, so list views needn't fetch the full image
+        write_derivatives(storage_writer, processed_filename, processed_image)
+        logger.info(f"Preprocessed image ({task.detection_tier} detection) queued for storage as {processed_filename}")
+        if task.content_hash:
+            store_extraction_cache(task.content_hash, processed_filename=processed_filename)
+
+    if data is None:
+        # Extract data using OpenAI on the preprocessed image
+        try:
+            if processed_image is None:
+                from image_preprocess import decode_image
+                processed_image = decode_image(upload_store.get(processed_filename) or b'')
+            data = extract_data_with_openai(processed_image)
+        except Exception as e:
+            raise TaskError(f"Failed to extract data from {orig_filename}: {e}")
+        if data is None:
+            raise TaskError(f"Failed to extract data from {orig_filename}")
+        if task.content_hash:
+            store_extraction_cache(task.content_hash, result=data)
+
+    header = data['header']
+    expenses = data['expenses']
+
+    # Parse dates with detailed error handling
+    from_date_str = header.get('From Date', '')
+    to_date_str = header.get('To Date', '')
+
+    from_date = parse_date(from_date_str)
+    to_date = parse_date(to_date_str)
+
+    if not from_date:
+        logger.error(f"Failed to parse 'From Date': {from_date_str} in file: {orig_filename}")
+        raise TaskError(f"Invalid 'From Date' format: '{from_date_str}'. Expected format: DD.MM.YYYY, YYYY-MM-DD, or similar")
+
+    if not to_date:
+        logger.error(f"Failed to parse 'To Date': {to_date_str} in file: {orig_filename}")
+        raise TaskError(f"Invalid 'To Date' format: '{to_date_str}'. Expected format: DD.MM.YYYY, YYYY-MM-DD, or similar")
+
+    if to_date < from_date:
+        raise TaskError(f"'To Date' ({to_date}) cannot be before 'From Date' ({from_date}) in file: {orig_filename}")
+
+    # Column values for the form and its entries; FormIngestor inserts them in bulk
+    form = dict(
+        employee_id=header.get('Employee ID', '').replace(' ', ''),
+        designation=header.get('Designation', ''),
+        location=header.get('Location', ''),
+        from_date=from_date,
+        to_date=to_date,
+        total_amount=clean_amount(header.get('Total Amount', '0')),
+        image_filename=processed_filename,
+        raw_data=json.dumps(data),  # <-- Save the extracted data!
+        **extraction_fields(data)
+    )
+    entries = []
+    for exp in expenses:
+        entry_date_str = exp.get('Date', '')
+        entry_date = parse_date(entry_date_str) if entry_date_str else None
+        if not entry_date:
+            continue
+        mode_of_travel = exp.get('Mode of Travel', '')
+        entries.append(dict(
+            date=entry_date,
+            from_location=exp.get('From', ''),
+            to_location=exp.get('To', ''),
+            purpose=exp.get('Purpose', ''),
+            mode_of_travel=mode_of_travel,
+            mode_normalized=normalize_mode(mode_of_travel),  # bulk inserts skip the model validator
+            distance_km=clean_amount(exp.get('Distance (in Km)', '0')),
+            amount_rs=clean_amount(exp.get('Amount (in Rs.)', '0'))
+        ))
+    return {'form': form, 'entries': entries, 'source': orig_filename}
+
+storage_writer = BackgroundWriter(upload_store)
+
+form_ingestor = FormIngestor(db, ReimbursementForm, ExpenseEntry, reports,
+                             batch_size=app.config['INGEST_BATCH_SIZE'], cache=response_cache, search=search_enabled)
+
+job_queue = JobQueue(app, db, ProcessingJob, ProcessingTask, process_upload_task,
+                     max_workers=app.config['JOB_WORKERS'],
+                     eager=app.config['JOB_QUEUE_EAGER'],
+                     writer=form_ingestor.write,
+                     batch_size=app.config['INGEST_BATCH_SIZE'])
+
+# Deletes images of deleted forms (see upload_gc.py)
+upload_collector = UploadCollector(app, db, upload_store, grace=app.config['UPLOAD_GC_GRACE'],
+                                   interval=app.config['UPLOAD_GC_INTERVAL'])
+if SERVER_PROCESS:
+    upload_collector.start()
+
 @app.route('/run_job', methods=['GET', 'POST'])
 def run_job():
     if request.method == 'POST':
-        files = request.files.getlist('images')
-        # Ensure upload folder exists
-        upload_folder = app.config['UPLOAD_FOLDER']
-        if not os.path.exists(upload_folder):
-            try:
-                os.makedirs(upload_folder, exist_ok=True)
-                logger.info(f"Created upload folder: {os.path.abspath(upload_folder)}")
-            except Exception as e:
-                logger.error(f"Failed to create upload folder: {upload_folder}: {e}")
-                flash(f"Server error: Could not create upload folder.", 'error')
-                return redirect(url_for('run_job'))
-
-        from pathlib import Path
-        from image_preprocess import autocrop_image
+        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        files = [f for f in request.files.getlist('images') if f and f.filename]
+        if not files:
+            if is_ajax:
+                return jsonify({'success': False, 'error': 'Please select at least one image file.'}), 400
+            flash('Please select at least one image file.', 'error')
+            return redirect(url_for('run_job'))
+        job = ProcessingJob()
+        db.session.add(job)
+        skipped = []
+        seen_hashes = set()
+        contents = []
         for file in files:
             orig_filename = file.filename
-            ext = os.path.splitext(orig_filename)[1]
-            unique_filename = f"{uuid.uuid4().hex}{ext}"
-            filepath = os.path.join(upload_folder, unique_filename)
-            try:
-                file.save(filepath)
-            except Exception as e:
-                logger.error(f"Failed to save uploaded file {orig_filename} to {filepath}: {e}")
-                flash(f"Failed to save uploaded file {orig_filename}.", 'error')
-                continue
-            # Check file existence and size
-            if not os.path.exists(filepath):
-                logger.error(f"File {filepath} does not exist after save!")
-                flash(f"File {orig_filename} could not be found after upload.", 'error')
-                continue
-            file_size = os.path.getsize(filepath)
-            logger.info(f"Saved file {orig_filename} as {unique_filename} to {filepath} (size: {file_size} bytes)")
-            if file_size == 0:
-                logger.error(f"File {filepath} is empty after save!")
-                flash(f"Uploaded file {orig_filename} is empty after save. Please try again.", 'error')
-                continue
-            # Preprocess the image (autocrop, enhance, combine)
-            try:
-                processed_path = autocrop_image(filepath, Path(upload_folder))
-                processed_filename = os.path.basename(processed_path)
-                logger.info(f"Preprocessed image saved as {processed_filename}")
-            except Exception as e:
-                logger.error(f"Error preprocessing image {filepath}: {e}")
-                flash(f"Failed to preprocess image {orig_filename}. Error: {e}", 'error')
-                continue
-            # Extract data using OpenAI on the preprocessed image
-            data = extract_data_with_openai(str(processed_path))
-            if data is None:
-                flash(f"Failed to extract data from {orig_filename}")
-                continue
-            
-            header = data['header']
-            expenses = data['expenses']
-            
-            # Parse dates with detailed error handling
-            from_date_str = header.get('From Date', '')
-            to_date_str = header.get('To Date', '')
-            
-            from_date = parse_date(from_date_str)
-            to_date = parse_date(to_date_str)
-            
-            if not from_date:
-                flash(f"Invalid 'From Date' format: '{from_date_str}'. Expected format: DD.MM.YYYY, YYYY-MM-DD, or similar", 'error')
-                logger.error(f"Failed to parse 'From Date': {from_date_str} in file: {filename}")
-                continue
-                
-            if not to_date:
-                flash(f"Invalid 'To Date' format: '{to_date_str}'. Expected format: DD.MM.YYYY, YYYY-MM-DD, or similar", 'error')
-                logger.error(f"Failed to parse 'To Date': {to_date_str} in file: {filename}")
+            ext = os.path.splitext(orig_filename)[1].lower()
+            content = file.read()
+            if not content:
+                logger.error(f"Uploaded file {orig_filename} is empty")
+                skipped.append(f"Uploaded file {orig_filename} is empty. Please try again.")
                 continue
-                
-            if to_date < from_date:
-                flash(f"'To Date' ({to_date}) cannot be before 'From Date' ({from_date}) in file: {filename}", 'error')
+            # Address uploads by content so identical files share storage and cached results
+            content_hash = hashlib.sha256(content).hexdigest()
+            if content_hash in seen_hashes:
+                skipped.append(f"{orig_filename} is a duplicate of another file in this upload.")
                 continue
-            
-            # Create ReimbursementForm
-            form = ReimbursementForm(
-                employee_id=header.get('Employee ID', '').replace(' ', ''),
-                designation=header.get('Designation', ''),
-                location=header.get('Location', ''),
-                from_date=from_date,
-                to_date=to_date,
-                total_amount=clean_amount(header.get('Total Amount', '0')),
-                image_filename=processed_filename,
-                raw_data=json.dumps(data)  # <-- Save the extracted data!
-            )
-            try:
-                db.session.add(form)
-                db.session.flush()
-                
-                # Create ExpenseEntry records
-                for exp in expenses:
-                    entry_date_str = exp.get('Date', '')
-                    entry_date = parse_date(entry_date_str) if entry_date_str else None
-                    if not entry_date:
-                        continue
-                    distance = clean_amount(exp.get('Distance (in Km)', '0'))
-                    amount = clean_amount(exp.get('Amount (in Rs.)', '0'))
-                    entry = ExpenseEntry(
-                        form_id=form.id,
-                        date=entry_date,
-                        from_location=exp.get('From', ''),
-                        to_location=exp.get('To', ''),
-                        purpose=exp.get('Purpose', ''),
-                        mode_of_travel=exp.get('Mode of Travel', ''),
-                        distance_km=distance,
-                        amount_rs=amount
-                    )
-                    db.session.add(entry)
-                db.session.commit()
-            except IntegrityError:
-                db.session.rollback()
-                flash(f"Employee ID {header.get('Employee ID', '')} does not exist for {filename}")
-            except Exception as e:
-                db.session.rollback()
-                flash(f"Error processing {filename}: {str(e)}")
-        
-        flash('Job completed successfully!')
+            seen_hashes.add(content_hash)
+            unique_filename = f"{content_hash}{ext}"
+            # The worker processes the in-memory bytes; the original is stored off the request path
+            storage_writer.write_bytes(unique_filename, content)
+            logger.info(f"Received {orig_filename} as {unique_filename} (size: {len(content)} bytes)")
+            task = ProcessingTask(original_filename=orig_filename, stored_filename=unique_filename,
+                                  content_hash=content_hash)
+            job.tasks.append(task)
+            contents.append((task, content))
+        job.total_files = len(job.tasks)
+        if not job.tasks:
+            db.session.rollback()
+            if is_ajax:
+                return jsonify({'success': False, 'error': ' '.join(skipped) or 'No files could be saved.'}), 400
+            for message in skipped:
+                flash(message, 'error')
+            return redirect(url_for('run_job'))
+        db.session.commit()
+        job_id = job.id
+        job_queue.submit(job_id, payloads={task.id: content for task, content in contents})
+        logger.info(f"Queued job {job_id} with {len(contents)} file(s)")
+
+        if is_ajax:
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status_url': url_for('job_status', job_id=job_id),
+                'skipped': skipped
+            }), 202
+        for message in skipped:
+            flash(message, 'error')
+        flash(f'Job {job_id} queued. Forms will appear as they are processed.')
         return redirect(url_for('index'))
     return render_template('run_job.html')
 
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Report per-file progress and results of a processing job"""
+    job = db.session.get(ProcessingJob, job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    tasks = [{
+        'id': task.id,
+        'filename': task.original_filename,
+        'status': task.status,
+        'message': task.message,
+        'detection_tier': task.detection_tier,
+        'form_id': task.form_id
+    } for task in job.tasks]
+    counts = {}
+    for task in tasks:
+        counts[task['status']] = counts.get(task['status'], 0) + 1
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'total': job.total_files,
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'pending': counts.get('queued', 0) + counts.get('running', 0),
+        'tasks': tasks
+    })
+
+@app.cli.command('requeue-jobs')
+def requeue_jobs_command():
+    """Re-queue upload tasks left unfinished by a previous run and process them."""
+    count = job_queue.recover()
+    job_queue.shutdown(wait=True)
+    print(f"Processed {count} pending task(s).")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the monthly_employee_rollup table from forms and expense entries."""
+    count = reports.rebuild_rollups()
+    db.session.commit()
+    response_cache.clear()
+    print(f"Rebuilt {count} monthly rollup row(s).")
+
+@app.cli.command('generate-derivatives')
+def generate_derivatives_command():
+    """Create missing thumbnail/medium renditions of every form image."""
+    filenames = [name for (name,) in db.session.query(ReimbursementForm.image_filename)
+                 .filter(ReimbursementForm.image_filename.isnot(None)).distinct()]
+    missing = [filename for filename in filenames
+               if any(ensure_derivative(upload_store, filename, rendition) is None
+                      for rendition in RENDITIONS)]
+    for filename in missing:
+        logger.warning(f"Could not create renditions of {filename}")
+    print(f"Renditions ready for {len(filenames) - len(missing)} of {len(filenames)} image(s).")
+
+@app.cli.command('migrate-uploads')
+def migrate_uploads_command():
+    """Move uploads stored flat in UPLOAD_FOLDER (before sharding) into their shard directories."""
+    if not isinstance(upload_store, LocalStorage):
+        print(f"UPLOAD_BACKEND={app.config['UPLOAD_BACKEND']} has no flat upload folder; nothing to move.")
+        return
+    print(f"Moved {upload_store.migrate_flat()} upload(s) into shard directories.")
+
+@app.cli.command('gc-uploads')
+@click.option('--sweep', is_flag=True, help='Also list the whole store for files no form ever referenced.')
+def gc_uploads_command(sweep):
+    """Delete stored images no form has used for UPLOAD_GC_GRACE seconds."""
+    count = upload_collector.sweep() if sweep else upload_collector.collect()
+    print(f"Deleted {count} unreferenced upload file(s).")
+
 @app.route('/monthly_summary_selector')
 def monthly_summary_selector():
     """Show a form to select month and year for summary"""
@@ -571,18 +875,13 @@ def monthly_summary_selector():
     current_month = now.month
     
     # Get distinct months with data for the recent months list
-    recent_months = db.session.query(
-        func.strftime('%Y', ReimbursementForm.to_date).label('year'),
-        func.strftime('%m', ReimbursementForm.to_date).cast(db.Integer).label('month')
-    ).distinct().order_by(
-        func.strftime('%Y', ReimbursementForm.to_date).desc(),
-        func.strftime('%m', ReimbursementForm.to_date).desc()
-    ).limit(6).all()
+    recent_months = reports.recent_months(limit=6)
     
     return render_template('monthly_summary_selector.html',
                          current_year=current_year,
                          current_month=current_month,
                          recent_months=recent_months,
+                         parquet_available=parquet_available(),
                          month_names={
                              1: 'January', 2: 'February', 3: 'March', 4: 'April',
                              5: 'May', 6: 'June', 7: 'July', 8: 'August',
@@ -603,10 +902,6 @@ def monthly_summary():
 
 @app.route('/monthly_summary/<int:year>/<int:month>')
 def monthly_summary_detail(year, month):
-    # Only these modes are allowed for local conveyance
-    local_modes = {'2-wheeler', '4-wheeler', 'cab'}
-    food_misc_mode = 'food & misc.'
-
     # Get month name for display
     month_names = [
         'January', 'February', 'March', 'April', 'May', 'June',
@@ -614,150 +909,120 @@ def monthly_summary_detail(year, month):
     ]
     month_name = month_names[month - 1] if 1 <= month <= 12 else f'Month {month}'
 
-    # Query for forms ending in the specified month
-    forms = ReimbursementForm.query.filter(
-        func.strftime('%Y', ReimbursementForm.to_date) == str(year),
-        func.strftime('%m', ReimbursementForm.to_date) == f'{month:02d}'
-    ).all()
-
-    summary = {}
-    for form in forms:
-        emp = Employee.query.filter_by(employee_id=form.employee_id).first() if form.employee_id else None
-        # Fallback: Try to get extracted name from raw_data if no DB employee
-        extracted_name = None
-        if not emp and getattr(form, 'raw_data', None):
-            try:
-                import json
-                raw = form.raw_data if isinstance(form.raw_data, dict) else json.loads(form.raw_data)
-                extracted_name = raw.get('header', {}).get('Name of Employee')
-            except Exception:
-                extracted_name = None
-        emp_key = form.employee_id or f'form_{form.id}'
-        if emp_key not in summary:
-            summary[emp_key] = {
-                'employee_id': form.employee_id or '',
-                'name': emp.name if emp and emp.name else (extracted_name or ''),
-                'location': form.location or '',
-                'exp_reimbursement': 0,
-                'local_conveyance': 0,
-                'bank_name': emp.bank_name if emp else '',
-                'account_number': emp.account_number if emp else '',
-                'ifsc_code': emp.ifsc_code if emp else ''
-            }
-        entries = ExpenseEntry.query.filter_by(form_id=form.id).all()
-        for entry in entries:
-            # Normalize mode for strict matching
-            mode = (entry.mode_of_travel or '').strip().lower().replace('-', '').replace('&', 'and').replace(' ', '')
-            # Map allowed modes to normalized forms
-            allowed_modes = {
-                '2-wheeler': '2wheeler',
-                '4-wheeler': '4wheeler',
-                'cab': 'cab',
-                'food & misc.': 'foodandmisc.'
-            }
-            if mode == allowed_modes['2-wheeler'] or mode == allowed_modes['4-wheeler'] or mode == allowed_modes['cab']:
-                summary[emp_key]['local_conveyance'] += (entry.amount_rs or 0)
-            else:
-                summary[emp_key]['exp_reimbursement'] += (entry.amount_rs or 0)
-
-    summary_list = sorted(
-        [
-            {
-                'employee_id': data['employee_id'],
-                'name': data['name'],
-                'location': data['location'],
-                'exp_reimbursement': data['exp_reimbursement'],
-                'local_conveyance': data['local_conveyance'],
-                'total_payable': data['exp_reimbursement'] + data['local_conveyance'],
-                'bank_name': data['bank_name'],
-                'account_number': data['account_number'],
-                'ifsc_code': data['ifsc_code']
-            }
-            for emp_key, data in summary.items()
-        ],
-        key=lambda x: x['name'].lower() if x['name'] else x['employee_id']
-    )
+    def summary_data():
+        summary_list = reports.monthly_employee_summary(year, month)
+        return {'summary': summary_list, 'totals': reports.summary_totals(summary_list)}
 
-    totals = {
-        'reimbursement': sum(item['exp_reimbursement'] for item in summary_list),
-        'local': sum(item['local_conveyance'] for item in summary_list),
-        'grand_total': sum(item['total_payable'] for item in summary_list)
-    }
-
-    return render_template('monthly_summary.html',
-                         summary=summary_list,
+    entry = response_cache.get_or_set(f'monthly_summary:{year}-{month:02d}', [summary_tag(year, month), EMPLOYEES],
+                                      summary_data)
+    return cached_page(entry, lambda: render_template('monthly_summary.html',
+                         summary=entry.value['summary'],
                          year=year,
                          month=month,
                          month_name=month_name,
-                         totals=totals,
-                         month_names=month_names)
+                         totals=entry.value['totals'],
+                         month_names=month_names))
+
+def filtered_form_list_query(args):
+    """form_list_query() narrowed by the /forms filters in args. Returns (query, list of error messages)."""
+    query = form_list_query()
+    errors = []
+    from_date_str = args.get('from_date')
+    to_date_str = args.get('to_date')
+    employee_id = args.get('employee_id', '').strip()
+    search_query = fts_query(args.get('q'))
 
-@app.route('/forms')
-def view_forms():
-    """View all processed reimbursement forms with filtering options"""
-    # Get filter parameters
-    from_date_str = request.args.get('from_date')
-    to_date_str = request.args.get('to_date')
-    employee_id = request.args.get('employee_id', '').strip()
-    
-    # Start with base query
-    query = ReimbursementForm.query
-    
-    # Apply filters
     if from_date_str:
         try:
             from_date = datetime.strptime(from_date_str, '%Y-%m-%d').date()
             query = query.filter(ReimbursementForm.from_date >= from_date)
         except ValueError:
-            flash('Invalid from date format. Use YYYY-MM-DD.', 'error')
-    
+            errors.append('Invalid from date format. Use YYYY-MM-DD.')
+
     if to_date_str:
         try:
             to_date = datetime.strptime(to_date_str, '%Y-%m-%d').date()
             query = query.filter(ReimbursementForm.to_date <= to_date)
         except ValueError:
-            flash('Invalid to date format. Use YYYY-MM-DD.', 'error')
-    
+            errors.append('Invalid to date format. Use YYYY-MM-DD.')
+
     if employee_id:
         query = query.filter(ReimbursementForm.employee_id.ilike(f'%{employee_id}%'))
+
+    if search_query:
+        if search_enabled:
+            query = query.filter(ReimbursementForm.id.in_(matching_form_ids(search_query)))
+        else:
+            errors.append('Search is not available on this server.')
+    return query, errors
+
+# Sortable columns for form listings; id breaks ties so keyset cursors are unique
+FORM_SORTS = {
+    'to_date': ReimbursementForm.to_date,
+    'from_date': ReimbursementForm.from_date,
+    'created_at': ReimbursementForm.created_at,
+    'total_amount': ReimbursementForm.total_amount,
+    'id': ReimbursementForm.id,
+}
+
+def form_page(args):
+    """
+    One keyset page of forms for /forms and /api/forms: filters, sort, direction, limit and
+    cursor all come from args. Returns (rows, next_cursor, page_args, errors); raises CursorError.
+    """
+    query, errors = filtered_form_list_query(args)
+    sort = args.get('sort', 'to_date')
+    if sort not in FORM_SORTS:
+        sort = 'to_date'
+    direction = args.get('direction', 'desc').lower()
+    if direction not in DIRECTIONS:
+        direction = 'desc'
+    limit = page_size(args.get('limit'))
+    rows, next_cursor = keyset_page(query, sort, direction, FORM_SORTS[sort], ReimbursementForm.id,
+                                    limit, args.get('cursor'))
+    return rows, next_cursor, {'sort': sort, 'direction': direction, 'limit': limit}, errors
+
+@app.route('/forms')
+def view_forms():
+    """View processed reimbursement forms a page at a time, with filtering and sorting options"""
+    try:
+        forms, next_cursor, page_args, errors = form_page(request.args)
+    except CursorError:
+        flash('That page link has expired; showing the first page.', 'warning')
+        forms, next_cursor, page_args, errors = form_page(request.args.to_dict() | {'cursor': None})
+    for error in errors:
+        flash(error, 'error')
     
-    # Order by most recent first
-    forms = query.order_by(ReimbursementForm.to_date.desc()).all()
+    form_data = [{
+        'id': form.id,
+        'employee_id': form.employee_id,
+        'designation': form.designation or '',
+        'location': form.location or '',
+        'from_date': form.from_date,
+        'to_date': form.to_date,
+        'total_amount': form.total_amount or 0,
+        'image_filename': form.image_filename,
+        'name': form.name
+    } for form in forms]
     
-    # Get employee details for display
-    form_data = []
-    for form in forms:
-        emp = Employee.query.filter_by(employee_id=form.employee_id).first()
-        raw_data = getattr(form, 'raw_data', None)
-        extracted_name = None
-        if raw_data:
-            try:
-                if isinstance(raw_data, str):
-                    raw_data = json.loads(raw_data)
-                extracted_name = raw_data.get('header', {}).get('Name of Employee') if raw_data else None
-            except Exception:
-                extracted_name = None
-        form_data.append({
-            'id': form.id,
-            'employee_id': form.employee_id,
-            'designation': form.designation or '',
-            'location': form.location or '',
-            'from_date': form.from_date,
-            'to_date': form.to_date,
-            'total_amount': form.total_amount or 0,
-            'image_filename': form.image_filename,
-            'employee': emp,
-            'extracted_name': extracted_name
-        })
-    
-    return render_template('view_forms.html', forms=form_data)
+    # Links for the next page: a plain URL (no JS) and the JSON API the page fetches from
+    list_args = {k: v for k, v in request.args.items() if k != 'cursor'} | page_args
+    next_url = url_for('view_forms', **list_args, cursor=next_cursor) if next_cursor else None
+    return render_template('view_forms.html', forms=form_data, next_cursor=next_cursor,
+                           next_url=next_url, api_url=url_for('api_forms', **list_args),
+                           page_args=page_args)
 
 @app.route('/form_details/<int:form_id>')
 def form_details(form_id):
     """Get details of a specific form (for AJAX loading)"""
     try:
         logger.info(f"Fetching details for form ID: {form_id}")
-        form = ReimbursementForm.query.get(form_id)
+        # A client holding the current version gets a 304 before any query runs
+        validator, last_modified = form_validator(form_id)
+        unchanged = validator.value is not None and not_modified(validator.etag, last_modified)
+        if unchanged:
+            return unchanged
+        form = ReimbursementForm.query.get(form_id) if validator.value is not None else None
         if not form:
             logger.error(f"Form with ID {form_id} not found")
             return "Form not found", 404
@@ -766,20 +1031,11 @@ def form_details(form_id):
         
         entries = ExpenseEntry.query.filter_by(form_id=form_id).order_by(ExpenseEntry.date).all()
         emp = Employee.query.filter_by(employee_id=form.employee_id).first()
-        raw_data = None
-        extracted_name = None
-        if hasattr(form, 'raw_data') and form.raw_data:
-            try:
-                raw_data = form.raw_data if isinstance(form.raw_data, dict) else json.loads(form.raw_data)
-                extracted_name = raw_data.get('header', {}).get('Name of Employee') if raw_data else None
-            except Exception:
-                raw_data = None
-                extracted_name = None
-        return render_template('_form_details.html',
+        return add_validators(make_response(render_template('_form_details.html',
                             form=form,
                             entries=entries,
                             employee=emp,
-                            extracted_name=extracted_name)
+                            extracted_name=form.extracted_name)), validator.etag, last_modified)
     except Exception as e:
         logger.error(f"Error in form_details route: {str(e)}", exc_info=True)
         if app.debug:
@@ -792,7 +1048,12 @@ def form_details_ajax(form_id):
     """Get details of a specific form (for AJAX loading)"""
     try:
         logger.info(f"[AJAX] Fetching details for form ID: {form_id}")
-        form = ReimbursementForm.query.get(form_id)
+        # A client holding the current version gets a 304 before any query runs
+        validator, last_modified = form_validator(form_id)
+        unchanged = validator.value is not None and not_modified(validator.etag, last_modified)
+        if unchanged:
+            return unchanged
+        form = ReimbursementForm.query.get(form_id) if validator.value is not None else None
         if not form:
             logger.error(f"[AJAX] Form with ID {form_id} not found")
             return "Form not found", 404
@@ -801,20 +1062,11 @@ def form_details_ajax(form_id):
         
         entries = ExpenseEntry.query.filter_by(form_id=form_id).order_by(ExpenseEntry.date).all()
         emp = Employee.query.filter_by(employee_id=form.employee_id).first()
-        raw_data = None
-        extracted_name = None
-        if hasattr(form, 'raw_data') and form.raw_data:
-            try:
-                raw_data = form.raw_data if isinstance(form.raw_data, dict) else json.loads(form.raw_data)
-                extracted_name = raw_data.get('header', {}).get('Name of Employee') if raw_data else None
-            except Exception:
-                raw_data = None
-                extracted_name = None
-        return render_template('_form_details_ajax.html',
+        return add_validators(make_response(render_template('_form_details_ajax.html',
                             form=form,
                             entries=entries,
                             employee=emp,
-                            extracted_name=extracted_name)
+                            extracted_name=form.extracted_name)), validator.etag, last_modified)
     except Exception as e:
         logger.error(f"[AJAX] Error in form_details_ajax route: {str(e)}", exc_info=True)
         if app.debug:
@@ -828,18 +1080,13 @@ def edit_form(form_id):
     form_data = ReimbursementForm.query.get_or_404(form_id)
     employee = Employee.query.filter_by(employee_id=form_data.employee_id).first()
     entries = ExpenseEntry.query.filter_by(form_id=form_id).order_by(ExpenseEntry.date).all()
-
-    extracted_name = None
-    if form_data.raw_data:
-        try:
-            import json
-            raw = form_data.raw_data if isinstance(form_data.raw_data, dict) else json.loads(form_data.raw_data)
-            extracted_name = raw.get('header', {}).get('Name of Employee')
-        except Exception:
-            extracted_name = None
+    extracted_name = form_data.extracted_name
 
     if request.method == 'POST':
         try:
+            # Rollup bucket before the edit; the employee or month may change
+            rollup_keys = [reports.rollup_key(form_data)]
+
             # Update form header data
             form_data.employee_id = request.form.get('employee_id', form_data.employee_id).replace(' ', '')
             form_data.designation = request.form.get('designation', form_data.designation)
@@ -855,45 +1102,51 @@ def edit_form(form_id):
                 employee.account_number = request.form.get('account_number', employee.account_number)
                 employee.ifsc_code = request.form.get('ifsc_code', employee.ifsc_code)
             
-            # Update or create expense entries
-            entry_ids = []
-            for i, entry in enumerate(request.form.getlist('entry_id')):
-                entry_data = {
-                    'id': int(entry) if entry else None,
-                    'date': datetime.strptime(request.form.getlist('entry_date')[i], '%Y-%m-%d'),
-                    'from_location': request.form.getlist('entry_from')[i],
-                    'to_location': request.form.getlist('entry_to')[i],
-                    'purpose': request.form.getlist('entry_purpose')[i],
-                    'mode_of_travel': request.form.getlist('entry_mode')[i],
-                    'distance_km': float(request.form.getlist('entry_distance')[i] or 0),
-                    'amount_rs': float(request.form.getlist('entry_amount')[i] or 0)
-                }
+            # Update or create expense entries; the search document is rebuilt once at the end
+            with deferred_reindex(db.session, form_id, search_enabled):
+                entry_ids = []
+                for i, entry in enumerate(request.form.getlist('entry_id')):
+                    entry_data = {
+                        'id': int(entry) if entry else None,
+                        'date': datetime.strptime(request.form.getlist('entry_date')[i], '%Y-%m-%d'),
+                        'from_location': request.form.getlist('entry_from')[i],
+                        'to_location': request.form.getlist('entry_to')[i],
+                        'purpose': request.form.getlist('entry_purpose')[i],
+                        'mode_of_travel': request.form.getlist('entry_mode')[i],
+                        'distance_km': float(request.form.getlist('entry_distance')[i] or 0),
+                        'amount_rs': float(request.form.getlist('entry_amount')[i] or 0)
+                    }
                 
-                if entry_data['id']:
-                    # Update existing entry
-                    db_entry = db.session.get(ExpenseEntry, entry_data['id'])
-                    if db_entry:
-                        for key, value in entry_data.items():
-                            if key != 'id' and hasattr(db_entry, key):
-                                setattr(db_entry, key, value)
-                        entry_ids.append(db_entry.id)
-                else:
-                    # Create new entry
-                    new_entry = ExpenseEntry(
-                        form_id=form_id,
-                        **{k: v for k, v in entry_data.items() if k != 'id'}
-                    )
-                    db.session.add(new_entry)
-                    db.session.flush()
-                    entry_ids.append(new_entry.id)
+                    if entry_data['id']:
+                        # Update existing entry
+                        db_entry = db.session.get(ExpenseEntry, entry_data['id'])
+                        if db_entry:
+                            for key, value in entry_data.items():
+                                if key != 'id' and hasattr(db_entry, key):
+                                    setattr(db_entry, key, value)
+                            entry_ids.append(db_entry.id)
+                    else:
+                        # Create new entry
+                        new_entry = ExpenseEntry(
+                            form_id=form_id,
+                            **{k: v for k, v in entry_data.items() if k != 'id'}
+                        )
+                        db.session.add(new_entry)
+                        db.session.flush()
+                        entry_ids.append(new_entry.id)
             
-            # Delete entries that were removed
-            ExpenseEntry.query.filter(
-                ExpenseEntry.form_id == form_id,
-                ~ExpenseEntry.id.in_(entry_ids)
-            ).delete(synchronize_session=False)
+                # Delete entries that were removed
+                ExpenseEntry.query.filter(
+                    ExpenseEntry.form_id == form_id,
+                    ~ExpenseEntry.id.in_(entry_ids)
+                ).delete(synchronize_session=False)
             
+            # Entry changes alone leave the form row untouched; bump it for the detail ETags
+            form_data.updated_at = datetime.now(timezone.utc)
+            rollup_keys.append(reports.rollup_key(form_data))
+            reports.refresh_rollups(rollup_keys)
             db.session.commit()
+            response_cache.invalidate(*form_tags(rollup_keys, [form_id]), *([EMPLOYEES] if employee else []))
             flash('Form updated successfully!', 'success')
             return redirect(url_for('view_forms'))
             
@@ -927,11 +1180,15 @@ def delete_form(form_id):
     
     try:
         # Delete associated expense entries
-        ExpenseEntry.query.filter_by(form_id=form_id).delete()
+        with deferred_reindex(db.session, form_id, search_enabled):
+            ExpenseEntry.query.filter_by(form_id=form_id).delete()
         
         # Delete the form
+        rollup_key = reports.rollup_key(form)
         db.session.delete(form)
+        reports.refresh_rollups([rollup_key])
         db.session.commit()
+        response_cache.invalidate(*form_tags([rollup_key], [form_id]))
         
         success_message = 'Form and associated entries deleted successfully!'
         app.logger.info(success_message)
@@ -971,12 +1228,19 @@ def bulk_delete_forms():
         form_ids = data.get('form_ids', [])
         if not form_ids:
             return jsonify({'success': False, 'message': 'No forms selected.'}), 400
+        rollup_keys = []
+        deleted_ids = []
         for form_id in form_ids:
             form = ReimbursementForm.query.get(form_id)
             if form:
-                ExpenseEntry.query.filter_by(form_id=form.id).delete()
+                rollup_keys.append(reports.rollup_key(form))
+                deleted_ids.append(form.id)
+                with deferred_reindex(db.session, form.id, search_enabled):
+                    ExpenseEntry.query.filter_by(form_id=form.id).delete()
                 db.session.delete(form)
+        reports.refresh_rollups(rollup_keys)
         db.session.commit()
+        response_cache.invalidate(*form_tags(rollup_keys, deleted_ids))
         return jsonify({'success': True, 'message': 'Selected forms deleted.'})
     except Exception as e:
         db.session.rollback()
@@ -988,188 +1252,118 @@ def export_monthly_summary():
         year = int(request.form.get('year', datetime.now().year))
         month = int(request.form.get('month', datetime.now().month))
 
-        # Only these modes are allowed for local conveyance
-        local_modes = {'2-wheeler', '4-wheeler', 'cab'}
-        food_misc_mode = 'food & misc.'
-
-        # Query for forms ending in the specified month
-        forms = ReimbursementForm.query.filter(
-            func.strftime('%Y', ReimbursementForm.to_date) == str(year),
-            func.strftime('%m', ReimbursementForm.to_date) == f'{month:02d}'
-        ).all()
-
-        summary = {}
-        for form in forms:
-            emp = Employee.query.filter_by(employee_id=form.employee_id).first() if form.employee_id else None
-            extracted_name = None
-            if not emp and getattr(form, 'raw_data', None):
-                try:
-                    import json
-                    raw = form.raw_data if isinstance(form.raw_data, dict) else json.loads(form.raw_data)
-                    extracted_name = raw.get('header', {}).get('Name of Employee')
-                except Exception:
-                    extracted_name = None
-            emp_key = form.employee_id or f'form_{form.id}'
-            if emp_key not in summary:
-                summary[emp_key] = {
-                    'employee_id': form.employee_id or '',
-                    'name': emp.name if emp and emp.name else (extracted_name or ''),
-                    'location': form.location or '',
-                    'exp_reimbursement': 0,
-                    'local_conveyance': 0,
-                    'bank_name': emp.bank_name if emp else '',
-                    'account_number': emp.account_number if emp else '',
-                    'ifsc_code': emp.ifsc_code if emp else ''
-                }
-            entries = ExpenseEntry.query.filter_by(form_id=form.id).all()
-            for entry in entries:
-                mode = (entry.mode_of_travel or '').strip().lower().replace('-', '').replace('&', 'and').replace(' ', '')
-                allowed_modes = {
-                    '2-wheeler': '2wheeler',
-                    '4-wheeler': '4wheeler',
-                    'cab': 'cab',
-                    'food & misc.': 'foodandmisc.'
-                }
-                if mode == allowed_modes['2-wheeler'] or mode == allowed_modes['4-wheeler'] or mode == allowed_modes['cab']:
-                    summary[emp_key]['local_conveyance'] += (entry.amount_rs or 0)
-                else:
-                    summary[emp_key]['exp_reimbursement'] += (entry.amount_rs or 0)
-
-        summary_list = sorted(
-            [
-                {
-                    'Employee ID': data['employee_id'],
-                    'Employee Name': data['name'],
-                    'Location': data['location'],
-                    'Expense Reimbursement (₹)': data['exp_reimbursement'],
-                    'Local Conveyance (₹)': data['local_conveyance'],
-                    'Total Payable (₹)': data['exp_reimbursement'] + data['local_conveyance'],
-                    'Bank Name': data['bank_name'],
-                    'Account Number': data['account_number'],
-                    'IFSC Code': data['ifsc_code']
-                }
-                for emp_key, data in summary.items()
-            ],
-            key=lambda x: x['Employee Name'].lower() if x['Employee Name'] else x['Employee ID']
-        )
-
-        if not summary_list:
+        summary = reports.monthly_employee_summary(year, month)
+        if not summary:
             flash('No data available for the selected period', 'warning')
             return redirect(url_for('monthly_summary_selector'))
 
-        # Create Excel file in memory
-        output = io.BytesIO()
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f"{month:02d}-{year} Summary"
-
-        # Add headers
-        headers = list(summary_list[0].keys())
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.font = openpyxl.styles.Font(bold=True)
-            cell.fill = openpyxl.styles.PatternFill("solid", fgColor="DDDDDD")
-
-        # Add data
-        for row_num, row_data in enumerate(summary_list, 2):
-            for col_num, key in enumerate(headers, 1):
-                ws.cell(row=row_num, column=col_num, value=row_data[key])
-
-        # Auto-adjust column widths
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2) * 1.2
-            ws.column_dimensions[column].width = min(adjusted_width, 30)
-
-        # Add totals row
-        total_row = len(summary_list) + 3
-        ws.cell(row=total_row, column=1, value="TOTALS:").font = openpyxl.styles.Font(bold=True)
-        for col_num, key in enumerate(headers[3:6], 4):  # Only sum the numeric columns
-            if col_num <= 6:  # Expense, Local, Total columns
-                col_letter = openpyxl.utils.get_column_letter(col_num)
-                ws[f"{col_letter}{total_row}"] = f"=SUM({col_letter}2:{col_letter}{len(summary_list) + 1})"
-                ws[f"{col_letter}{total_row}"].number_format = '#,##0.00'
-        for row in ws.iter_rows(min_row=2, max_row=len(summary_list) + 1, min_col=4, max_col=6):
-            for cell in row:
-                cell.number_format = '#,##0.00'
-        wb.save(output)
-        output.seek(0)
+        # Rows are written into the xlsx while the response is being sent
+        wb = new_workbook()
+        ws = wb.create_sheet(f"{month:02d}-{year} Summary")
+        headers = ['Employee ID', 'Employee Name', 'Location', 'Expense Reimbursement (₹)',
+                   'Local Conveyance (₹)', 'Total Payable (₹)', 'Bank Name', 'Account Number', 'IFSC Code']
+
+        def summary_rows():
+            yield header_row(ws, headers)
+            for data in summary:
+                yield [
+                    data['employee_id'],
+                    data['name'],
+                    data['location'],
+                    cell(ws, data['exp_reimbursement'], MONEY_FORMAT),
+                    cell(ws, data['local_conveyance'], MONEY_FORMAT),
+                    cell(ws, data['total_payable'], MONEY_FORMAT),
+                    data['bank_name'],
+                    data['account_number'],
+                    data['ifsc_code']
+                ]
+            # Totals row after a blank line; only the Expense, Local and Total columns are summed
+            last_row = len(summary) + 1
+            yield []
+            yield ([cell(ws, "TOTALS:", font=HEADER_FONT), None, None] +
+                   [cell(ws, f"=SUM({col}2:{col}{last_row})", MONEY_FORMAT) for col in 'DEF'])
+
         month_name = datetime(year, month, 1).strftime('%B')
         filename = f"Expense_Summary_{month_name}_{year}.xlsx"
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
+        return send_workbook(wb, filename, summary_rows())
     except Exception as e:
         logger.error(f"Error exporting monthly summary: {str(e)}")
         flash('Error generating Excel file. Please try again.', 'error')
         return redirect(url_for('monthly_summary_selector'))
 
+@app.route('/export_ledger')
+def export_ledger():
+    """
+    Stream every expense entry (joined to its form and employee) for forms whose to_date is
+    within [from_date, to_date], optionally limited to comma-separated employee IDs.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    employee_ids = [e.strip() for e in request.args.get('employee_id', '').split(',') if e.strip()]
+    try:
+        start = datetime.strptime(request.args['from_date'], '%Y-%m-%d').date() if request.args.get('from_date') else None
+        end = datetime.strptime(request.args['to_date'], '%Y-%m-%d').date() if request.args.get('to_date') else None
+    except ValueError:
+        flash('Invalid date format. Use YYYY-MM-DD.', 'error')
+        return redirect(url_for('monthly_summary_selector'))
+    if fmt not in LEDGER_FORMATS:
+        flash(f'Unsupported export format: {fmt}', 'error')
+        return redirect(url_for('monthly_summary_selector'))
+    if fmt == 'parquet' and not parquet_available():
+        flash('Parquet export is not available on this server (pyarrow is not installed).', 'error')
+        return redirect(url_for('monthly_summary_selector'))
+
+    stmt = ledger_statement(ReimbursementForm, ExpenseEntry, Employee, start, end, employee_ids)
+    period = f"{start.isoformat() if start else 'start'}_to_{end.isoformat() if end else 'latest'}"
+    filename = f"Expense_Ledger_{period}.{fmt}"
+    logger.info(f"Exporting ledger {period} as {fmt} (employees: {employee_ids or 'all'})")
+
+    if fmt == 'parquet':
+        output = write_parquet(iter_ledger_batches(db.session, stmt))
+        return send_file(output, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                         download_name=filename)
+
+    # Rows are fetched and encoded batch by batch while the response is being sent
+    response = Response(stream_with_context(csv_chunks(iter_ledger_batches(db.session, stmt))),
+                        mimetype='text/csv')
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    return response
+
 @app.route('/export_form_excel/<int:form_id>', methods=['GET', 'POST'])
 def export_form_excel(form_id):
     form = ReimbursementForm.query.get_or_404(form_id)
-    entries = ExpenseEntry.query.filter_by(form_id=form_id).all()
-    # Try to get extracted header from raw_data
-    header = {}
-    if getattr(form, 'raw_data', None):
-        try:
-            import json
-            raw = form.raw_data if isinstance(form.raw_data, dict) else json.loads(form.raw_data)
-            header = raw.get('header', {})
-        except Exception:
-            header = {}
-    # Fallbacks
+    entries = ExpenseEntry.query.filter_by(form_id=form_id)
     header_fields = [
         ('Employee ID', form.employee_id or ''),
-        ('Name of Employee', header.get('Name of Employee', '')),
-        ('Designation', form.designation or header.get('Designation', '')),
-        ('Location', form.location or header.get('Location', '')),
-        ('From Date', form.from_date.strftime('%d-%m-%Y') if form.from_date else header.get('From Date', '')),
-        ('To Date', form.to_date.strftime('%d-%m-%Y') if form.to_date else header.get('To Date', '')),
-        ('Total Amount', form.total_amount or header.get('Total Amount', '')),
+        ('Name of Employee', form.extracted_name or ''),
+        ('Designation', form.designation or ''),
+        ('Location', form.location or ''),
+        ('From Date', form.from_date.strftime('%d-%m-%Y') if form.from_date else ''),
+        ('To Date', form.to_date.strftime('%d-%m-%Y') if form.to_date else ''),
+        ('Total Amount', form.total_amount or form.header_total or ''),
     ]
-    output = io.BytesIO()
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"Form_{form_id}"
-    # Write header section
-    row = 1
-    for label, value in header_fields:
-        ws.cell(row=row, column=1, value=label)
-        ws.cell(row=row, column=2, value=value)
-        row += 1
-    row += 1
-    # Write expense entries
+    wb = new_workbook()
+    ws = wb.create_sheet(f"Form_{form_id}")
     entry_headers = ['Date', 'From', 'To', 'Purpose', 'Mode of Travel', 'Distance (Km)', 'Amount (₹)']
-    for col_num, h in enumerate(entry_headers, 1):
-        ws.cell(row=row, column=col_num, value=h).font = openpyxl.styles.Font(bold=True)
-    for entry in entries:
-        row += 1
-        ws.cell(row=row, column=1, value=entry.date.strftime('%d-%m-%Y') if entry.date else '')
-        ws.cell(row=row, column=2, value=entry.from_location)
-        ws.cell(row=row, column=3, value=entry.to_location)
-        ws.cell(row=row, column=4, value=entry.purpose)
-        ws.cell(row=row, column=5, value=entry.mode_of_travel)
-        ws.cell(row=row, column=6, value=entry.distance_km)
-        ws.cell(row=row, column=7, value=entry.amount_rs)
-    wb.save(output)
-    output.seek(0)
+
+    def form_rows():
+        # Header section, a blank row, then the expense entries
+        for label, value in header_fields:
+            yield [label, value]
+        yield []
+        yield header_row(ws, entry_headers, fill=None)
+        for entry in entries.yield_per(500):
+            yield [
+                entry.date.strftime('%d-%m-%Y') if entry.date else '',
+                entry.from_location,
+                entry.to_location,
+                entry.purpose,
+                entry.mode_of_travel,
+                entry.distance_km,
+                entry.amount_rs
+            ]
+
     filename = f"Form_{form_id}_Details.xlsx"
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=filename
-    )
+    return send_workbook(wb, filename, form_rows())
 
 @app.route('/delete_employee/<int:employee_id>', methods=['POST'])
 @csrf.exempt  # Remove this if you want CSRF protection and your form includes the token
@@ -1177,59 +1371,101 @@ def delete_employee(employee_id):
     employee = Employee.query.get_or_404(employee_id)
     db.session.delete(employee)
     db.session.commit()
+    response_cache.invalidate(EMPLOYEES)
     flash('Employee deleted successfully!', 'success')
     return redirect(url_for('employees'))
 
-@app.route('/api/recent_forms')
-def api_recent_forms():
-    recent_forms = ReimbursementForm.query.order_by(ReimbursementForm.created_at.desc()).limit(5).all()
+def recent_forms_data():
+    recent_forms = form_list_query().order_by(ReimbursementForm.created_at.desc()).limit(5).all()
     result = []
     for form in recent_forms:
-        emp = Employee.query.filter_by(employee_id=form.employee_id).first()
-        raw_data = None
-        extracted_name = None
-        if hasattr(form, 'raw_data') and form.raw_data:
-            try:
-                raw_data = form.raw_data if isinstance(form.raw_data, dict) else json.loads(form.raw_data)
-                extracted_name = raw_data.get('header', {}).get('Name of Employee') if raw_data else None
-            except Exception:
-                raw_data = None
-                extracted_name = None
         result.append({
             'id': form.id,
             'employee_id': form.employee_id,
-            'name': emp.name if emp and emp.name else (extracted_name or ''),
+            'name': form.name,
             'from_date': form.from_date.strftime('%d-%b-%Y') if form.from_date else '',
             'to_date': form.to_date.strftime('%d-%b-%Y') if form.to_date else '',
             'total_amount': form.total_amount or 0,
         })
-    return jsonify(result)
+    return result
+
+@app.route('/api/recent_forms')
+def api_recent_forms():
+    return cached_json(response_cache.get_or_set('api_recent_forms', [FORMS, EMPLOYEES], recent_forms_data))
 
 @app.route('/api/forms')
 def api_forms():
-    forms = ReimbursementForm.query.order_by(ReimbursementForm.to_date.desc()).all()
+    """
+    A page of forms as JSON. Accepts the /forms filters plus sort, direction, limit and
+    cursor; pass next_cursor back as cursor to fetch the following page.
+    """
+    def page_data():
+        forms, next_cursor, page_args, errors = form_page(request.args)
+        if errors:
+            return {'success': False, 'message': ' '.join(errors)}
+        result = []
+        for form in forms:
+            result.append({
+                'id': form.id,
+                'employee_id': form.employee_id,
+                'name': form.name,
+                'from_date': form.from_date.strftime('%d-%b-%Y') if form.from_date else '',
+                'to_date': form.to_date.strftime('%d-%b-%Y') if form.to_date else '',
+                'location': form.location or '',
+                'total_amount': form.total_amount or 0,
+            })
+        return {'forms': result, 'next_cursor': next_cursor, **page_args}
+
+    # One entry per distinct query string (filters, sort and cursor)
+    key = 'api_forms:' + urlencode(sorted(request.args.items(multi=True)))
+    try:
+        entry = response_cache.get_or_set(key, [FORMS, EMPLOYEES], page_data)
+    except CursorError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if 'message' in entry.value:
+        return jsonify(entry.value), 400
+    return cached_json(entry)
+
+@app.route('/api/search')
+def api_search():
+    """
+    Full-text search over employee names and IDs, designations, locations, routes and
+    purposes. Results are ranked best first; pass next_cursor back as cursor for more.
+    """
+    if not search_enabled:
+        return jsonify({'success': False, 'message': 'Search is not available on this server.'}), 503
+    query = fts_query(request.args.get('q'))
+    if not query:
+        return jsonify({'success': False, 'message': 'Enter something to search for.'}), 400
+    limit = page_size(request.args.get('limit'), default=20)
+    try:
+        matches, next_cursor = search_forms(db.session, query, limit, request.args.get('cursor'))
+    except CursorError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    forms = {form.id: form for form in form_list_query().filter(
+        ReimbursementForm.id.in_([match.form_id for match in matches]))}
     result = []
-    for form in forms:
-        emp = Employee.query.filter_by(employee_id=form.employee_id).first()
-        raw_data = getattr(form, 'raw_data', None)
-        extracted_name = None
-        if raw_data:
-            try:
-                if isinstance(raw_data, str):
-                    raw_data = json.loads(raw_data)
-                extracted_name = raw_data.get('header', {}).get('Name of Employee') if raw_data else None
-            except Exception:
-                extracted_name = None
+    for match in matches:
+        form = forms.get(match.form_id)
+        if not form:
+            continue
         result.append({
             'id': form.id,
             'employee_id': form.employee_id,
-            'name': emp.name if emp and emp.name else (extracted_name or ''),
+            'name': form.name,
             'from_date': form.from_date.strftime('%d-%b-%Y') if form.from_date else '',
             'to_date': form.to_date.strftime('%d-%b-%Y') if form.to_date else '',
             'location': form.location or '',
             'total_amount': form.total_amount or 0,
+            'score': -match.score,
+            'snippet': match.snippet,
         })
-    return jsonify(result)
+    return jsonify({'results': result, 'next_cursor': next_cursor, 'q': request.args.get('q'), 'limit': limit})
 
 if __name__ == '__main__':
+    # Skip recovery in the reloader's watcher process so tasks only run once
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        with app.app_context():
+            job_queue.recover()
     app.run(debug=True, port=5001)
\ No newline at end of file
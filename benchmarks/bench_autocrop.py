@@ -0,0 +1,133 @@
+"""
+Compare full-resolution table detection with detection on a downscaled proxy.
+
+--upscale simulates 12+ MP phone photos from the sample scans:
+
+    python benchmarks/bench_autocrop.py --upscale 2.5 --repeat 5
+
+Exits non-zero when the two paths disagree by more than --tolerance (except for the samples
+in ACCEPTED_DIVERGENCES) or when the proxy path gets a sample in REGRESSIONS wrong.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_preprocess import (DETECT_MAX_SIDE, MIN_FIT_CONTRAST, MIN_FIT_WIDTH, autocrop_array, detect_tables,
+                              order_points)
+
+# Sample -> tiers the proxy path may detect it with. Outside the page tier it must find two
+# tables spanning most of the page width. test5_handwritten.jpg has no clean table outlines,
+# only a stray pen stroke whose convex hull (~2.9% of the page) passes MIN_TABLE_AREA although
+# the stroke covers ~0.5%, and table fragments; it must not come out as a blank strip or a part.
+REGRESSIONS = {
+    'test1.jpg': ('quad',),
+    'test2.jpg': ('quad',),
+    'test3.jpg': ('quad',),
+    'test4.jpg': ('quad',),
+    'test5_handwritten.jpg': ('hough', 'page'),
+    'test6_handwritten.jpg': ('quad', 'fitted'),  # fitted from a 2400 px proxy: the expenses border breaks up
+}
+
+# Samples whose full-resolution detection is known to differ from the proxy's. Blur, Canny and
+# approxPolyDP are tuned for the proxy size; on these the full-resolution path is the wrong one.
+ACCEPTED_DIVERGENCES = {
+    'test2.jpg': 'upscaled 2.5x, full resolution finds one header row instead of the header table',
+    'test6_handwritten.jpg': 'full resolution finds the signature table instead of the expenses table',
+}
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def divergence(full, proxy):
+    """Largest corner distance in px between two detect_tables() results (inf if tier or count differ)."""
+    (full_tables, full_tier), (proxy_tables, proxy_tier) = full, proxy
+    if full_tier != proxy_tier or len(full_tables) != len(proxy_tables):
+        return float('inf')
+    full_tables = sorted(full_tables, key=lambda t: t[1])
+    proxy_tables = sorted(proxy_tables, key=lambda t: t[1])
+    return max(float(np.abs(order_points(a[0]) - order_points(b[0])).max()) for a, b in zip(full_tables, proxy_tables))
+
+
+def regression(name, image, detection, output):
+    """Problem with the proxy path's result for a REGRESSIONS sample, or None."""
+    tables, tier = detection
+    if tier not in REGRESSIONS[name]:
+        return f"tier {tier}, expected {' or '.join(REGRESSIONS[name])}"
+    if tier != 'page':
+        widths = [float(np.ptp(corners[:, 0])) / image.shape[1] for corners, _ in tables]
+        if len(tables) != 2 or min(widths) < MIN_FIT_WIDTH:
+            return f"{len(tables)} table(s) spanning {', '.join(f'{w:.0%}' for w in widths)} of the page width"
+    gray = cv2.cvtColor(output, cv2.COLOR_BGR2GRAY) if output.ndim == 3 else output
+    if float(gray.std()) < MIN_FIT_CONTRAST:
+        return 'blank output'
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', default='test_images/*.jpg')
+    parser.add_argument('--upscale', type=float, default=2.5)
+    parser.add_argument('--detect-max-side', type=int, default=DETECT_MAX_SIDE)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='largest corner difference allowed, as a fraction of the long side')
+    args = parser.parse_args()
+
+    total_full = total_proxy = detect_full = detect_proxy = 0.0
+    failures = 0
+    for path in sorted(glob.glob(args.images)):
+        image = cv2.imread(path)
+        if args.upscale != 1:
+            image = cv2.resize(image, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_CUBIC)
+        full, full_time = timed(lambda: autocrop_array(image, detect_max_side=None), args.repeat)
+        proxy, proxy_time = timed(lambda: autocrop_array(image, detect_max_side=args.detect_max_side), args.repeat)
+        full_detection, full_detect_time = timed(lambda: detect_tables(image, None), args.repeat)
+        proxy_detection, proxy_detect_time = timed(lambda: detect_tables(image, args.detect_max_side), args.repeat)
+        total_full += full_time
+        total_proxy += proxy_time
+        detect_full += full_detect_time
+        detect_proxy += proxy_detect_time
+
+        name = os.path.basename(path)
+        diff = divergence(full_detection, proxy_detection)
+        allowed = args.tolerance * max(image.shape[:2])
+        print(f"{name} {image.shape[1]}x{image.shape[0]}: detect {full_detect_time * 1000:.0f} -> "
+              f"{proxy_detect_time * 1000:.0f} ms, autocrop {full_time * 1000:.0f} -> {proxy_time * 1000:.0f} ms, "
+              f"tier {full_detection[1]} vs {proxy_detection[1]}, max corner diff {diff:.1f} px, "
+              f"output {full.shape[1]}x{full.shape[0]} vs {proxy.shape[1]}x{proxy.shape[0]}")
+        if diff > allowed:
+            if name in ACCEPTED_DIVERGENCES:
+                print(f"  accepted: diff above {allowed:.0f} px ({ACCEPTED_DIVERGENCES[name]})")
+            else:
+                print(f"  FAIL: full resolution and proxy differ by more than {allowed:.0f} px")
+                failures += 1
+        if name in REGRESSIONS:
+            problem = regression(name, image, proxy_detection, proxy)
+            if problem:
+                print(f"  FAIL: regression on the proxy path: {problem}")
+                failures += 1
+    print(f"detection: full {detect_full:.2f}s, proxy {detect_proxy:.2f}s ({detect_full / detect_proxy:.1f}x)")
+    print(f"autocrop:  full {total_full:.2f}s, proxy {total_proxy:.2f}s ({total_full / total_proxy:.1f}x)")
+    if failures:
+        print(f"{failures} check(s) failed")
+        sys.exit(1)
+    print('all checks passed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare the in-memory Excel export with the streaming write-only exporter: time to the
+first byte of the response, total time and peak Python memory.
+
+Uses synthetic summary rows, so no database is needed:
+
+    python benchmarks/bench_excel_export.py --rows 20000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+
+from excel_export import MONEY_FORMAT, cell, header_row, iter_workbook, new_workbook
+
+HEADERS = ['Employee ID', 'Employee Name', 'Location', 'Expense Reimbursement (₹)',
+           'Local Conveyance (₹)', 'Total Payable (₹)', 'Bank Name', 'Account Number', 'IFSC Code']
+
+
+def synthetic_rows(count):
+    for i in range(count):
+        yield [f'RIPL{i:05d}', f'Employee Number {i}', 'Ahmedabad', i * 1.5, i * 2.25, i * 3.75,
+               'ICICI Bank', f'{i:012d}', 'ICIC0001234']
+
+
+def in_memory(count):
+    """The previous export: every cell in a Workbook, a width pass over ws.columns, saved to BytesIO and sent whole."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for col_num, header in enumerate(HEADERS, 1):
+        ws.cell(row=1, column=col_num, value=header).font = openpyxl.styles.Font(bold=True)
+    for row_num, row in enumerate(synthetic_rows(count), 2):
+        for col_num, value in enumerate(row, 1):
+            ws.cell(row=row_num, column=col_num, value=value)
+    for col in ws.columns:
+        max_length = max(len(str(c.value)) for c in col)
+        ws.column_dimensions[col[0].column_letter].width = min((max_length + 2) * 1.2, 30)
+    for row in ws.iter_rows(min_row=2, max_row=count + 1, min_col=4, max_col=6):
+        for c in row:
+            c.number_format = MONEY_FORMAT
+    output = io.BytesIO()
+    wb.save(output)
+    yield output.getvalue()
+
+
+def streaming(count):
+    wb = new_workbook()
+    ws = wb.create_sheet('Summary')
+
+    def rows():
+        yield header_row(ws, HEADERS)
+        for row in synthetic_rows(count):
+            yield row[:3] + [cell(ws, v, MONEY_FORMAT) for v in row[3:6]] + row[6:]
+
+    yield from iter_workbook(wb, rows())
+
+
+def measure(fn, count):
+    """Consume the chunks fn(count) generates like a response would: (first byte, total) seconds, peak, size."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in fn(count):
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first, elapsed, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    for name, fn in (('in-memory', in_memory), ('streaming', streaming)):
+        first, elapsed, peak, size = measure(fn, args.rows)
+        print(f"{name:<10} {args.rows} rows: first byte {first:6.2f}s, total {elapsed:6.2f}s, "
+              f"peak Python memory {peak / 1e6:7.1f} MB, file {size / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Compare sequential extraction with the concurrent ExtractionEngine.
+
+Runs against the local fake API, so no key or network access is needed:
+
+    python benchmarks/bench_extraction.py --forms 20 --latency 0.5 --concurrency 8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI
+
+from extraction import ExtractionEngine
+from benchmarks.fake_openai import start_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--forms', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per fake API call')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of model calls answered with 429')
+    parser.add_argument('--image', default='test_images/test1.jpg')
+    parser.add_argument('--image-mode', choices=ExtractionEngine.IMAGE_MODES, default='inline')
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency=args.latency, error_rate=args.error_rate)
+    client = OpenAI(api_key='sk-fake', base_url=base_url, max_retries=0)
+    paths = [args.image] * args.forms
+
+    sequential = ExtractionEngine(client, max_concurrency=1, backoff_base=0.1, image_mode=args.image_mode)
+    start = time.perf_counter()
+    for path in paths:
+        sequential.extract(path)
+    sequential_time = time.perf_counter() - start
+
+    engine = ExtractionEngine(client, max_concurrency=args.concurrency, backoff_base=0.1,
+                              image_mode=args.image_mode)
+    start = time.perf_counter()
+    results = engine.extract_batch(paths)
+    concurrent_time = time.perf_counter() - start
+    server.shutdown()
+
+    failures = sum(1 for r in results if r['error'] or r['data'] is None)
+    print(f"forms={args.forms} latency={args.latency}s concurrency={args.concurrency} mode={args.image_mode}")
+    print(f"sequential: {sequential_time:.2f}s")
+    print(f"concurrent: {concurrent_time:.2f}s ({sequential_time / concurrent_time:.1f}x, {failures} failed)")
+
+
+if __name__ == '__main__':
+    main()
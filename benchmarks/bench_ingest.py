@@ -0,0 +1,102 @@
+"""
+Compare storing forms one ORM commit at a time with FormIngestor's bulk batches, and bulk
+batches with the full-text index present, where each form's search document is either rebuilt
+per inserted entry (the triggers alone) or once per form (search.deferred_reindex).
+
+Uses synthetic extraction results in throwaway databases:
+
+    python benchmarks/bench_ingest.py --forms 500 --entries 20 --batch-size 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never touch the real database; the key is only needed to import the app
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='claimistry-ingest-'), 'ingest.db')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+
+from app import app, db, reports, Employee, ReimbursementForm, ExpenseEntry
+from ingest import FormIngestor
+from search import DEFERRED_TABLE, SEARCH_TABLE, create_search_index
+from sqlalchemy import text
+from reports import normalize_mode
+
+MODES = ['Cab', '2-Wheeler', 'Food & Misc.', 'Bus']
+
+
+def synthetic_items(forms, entries):
+    for i in range(forms):
+        to_date = date(2025, 1, 1) + timedelta(days=i % 365)
+        form = dict(employee_id=f'EMP{i % 50:04d}', designation='Engineer', location='Ahmedabad',
+                    from_date=to_date - timedelta(days=5), to_date=to_date, total_amount=entries * 100.0,
+                    extracted_name=f'Employee {i % 50}', raw_data='{}')
+        rows = [dict(date=to_date - timedelta(days=d % 5), from_location='Office', to_location='Client site',
+                     purpose='Client meeting', mode_of_travel=MODES[d % len(MODES)],
+                     mode_normalized=normalize_mode(MODES[d % len(MODES)]), distance_km=12.0, amount_rs=100.0)
+                for d in range(entries)]
+        yield {'form': form, 'entries': rows, 'source': f'form{i}.jpg'}
+
+
+def reset(search=False):
+    """Empty tables; drop_all() also drops the search triggers, so they're only back with search."""
+    db.drop_all()
+    with db.engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+        conn.execute(text(f'DROP TABLE IF EXISTS {DEFERRED_TABLE}'))
+    db.create_all()
+    if search:
+        with db.engine.begin() as conn:
+            create_search_index(conn)
+    db.session.add_all(Employee(employee_id=f'EMP{i:04d}', name=f'Employee {i}') for i in range(50))
+    db.session.commit()
+
+
+def orm_per_form(items):
+    """The previous ingest: ORM objects and a commit (and rollup refresh) per form."""
+    for item in items:
+        form = ReimbursementForm(**item['form'])
+        db.session.add(form)
+        db.session.flush()
+        for entry in item['entries']:
+            db.session.add(ExpenseEntry(form_id=form.id, **{k: v for k, v in entry.items() if k != 'mode_normalized'}))
+        reports.refresh_rollups([reports.rollup_key(form)])
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--forms', type=int, default=500)
+    parser.add_argument('--entries', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+
+    def ingestor(search):
+        return FormIngestor(db, ReimbursementForm, ExpenseEntry, reports, batch_size=args.batch_size, search=search)
+    # (name, write function, whether the FTS index and its triggers exist)
+    runs = (('orm per form', orm_per_form, False),
+            (f'bulk x{args.batch_size}', ingestor(False).write, False),
+            ('+ fts per entry', ingestor(False).write, True),
+            ('+ fts per form', ingestor(True).write, True))
+    with app.app_context():
+        for name, fn, search in runs:
+            reset(search)
+            items = list(synthetic_items(args.forms, args.entries))
+            start = time.perf_counter()
+            fn(items)
+            elapsed = time.perf_counter() - start
+            stored = ExpenseEntry.query.count()
+            if search:
+                indexed = db.session.execute(text(
+                    f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH 'purposes:client'")).scalar()
+                assert indexed == args.forms, f"{indexed} of {args.forms} forms indexed with their entries"
+            print(f"{name:<16} {args.forms} forms / {stored} entries: {elapsed:6.2f}s "
+                  f"({args.forms / elapsed:7.1f} forms/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Compare one-at-a-time autocrop with preprocess_batch on a process pool.
+
+    python benchmarks/bench_preprocess.py --workers 4 --repeat 4
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_preprocess import create_preprocess_executor, preprocess_batch, preprocess_one
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', default='test_images/*.jpg')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=2, help='times each image is included in the batch')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.images)) * args.repeat
+    sources = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            sources.append(f.read())
+
+    start = time.perf_counter()
+    sequential = [preprocess_one(source) for source in sources]
+    sequential_time = time.perf_counter() - start
+
+    executor = create_preprocess_executor(args.workers)
+    preprocess_batch(sources[:1], executor=executor)  # warm up the worker processes
+    start = time.perf_counter()
+    batch = preprocess_batch(sources, executor=executor)
+    batch_time = time.perf_counter() - start
+    executor.shutdown()
+
+    failures = sum(1 for r in batch if r['error'])
+    print(f"images={len(sources)} workers={args.workers} cpus={os.cpu_count()}")
+    print(f"sequential: {sequential_time:.2f}s ({sum(1 for r in sequential if r['error'])} failed)")
+    print(f"batch:      {batch_time:.2f}s ({sequential_time / batch_time:.1f}x, {failures} failed)")
+    for path, result in zip(paths, batch[:len(set(paths))]):
+        status = 'ok' if result['error'] is None else result['error']
+        print(f"  {os.path.basename(path)}: {status}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Time the dashboard, a monthly summary and the form APIs with the response cache off, on,
+and when the client revalidates its copy (If-None-Match, answered with 304).
+
+Uses a throwaway database seeded with synthetic forms:
+
+    python benchmarks/bench_response_cache.py --forms 5000 --requests 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never touch the real database; the key is only needed to import the app
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='claimistry-cache-'), 'cache.db')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+
+import logging
+
+from app import app, db, form_ingestor, response_cache, Employee
+
+logging.disable(logging.INFO)
+
+
+def seed(forms):
+    db.session.add_all(Employee(employee_id=f'EMP{i:04d}', name=f'Employee {i}', account_number=f'{i:012d}')
+                       for i in range(50))
+    db.session.commit()
+    today = date.today()
+    items = []
+    for i in range(forms):
+        to_date = today - timedelta(days=i % 365)
+        entries = [dict(date=to_date, purpose='Client meeting', mode_of_travel='Cab', mode_normalized='cab',
+                        amount_rs=100.0) for _ in range(5)]
+        items.append({'form': dict(employee_id=f'EMP{i % 50:04d}', location='Ahmedabad', from_date=to_date,
+                                   to_date=to_date, total_amount=500.0), 'entries': entries, 'source': f'form{i}'})
+    form_ingestor.write(items)
+
+
+def timed(client, url, requests, revalidate=False):
+    etag = client.get(url).headers.get('ETag')
+    headers = {'If-None-Match': etag} if revalidate and etag else {}
+    start = time.perf_counter()
+    for _ in range(requests):
+        status = client.get(url, headers=headers).status_code
+    return (time.perf_counter() - start) / requests * 1000, status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--forms', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.forms)
+    today = date.today()
+    urls = ['/', f'/monthly_summary/{today.year}/{today.month}', '/api/recent_forms',
+            '/api/forms?limit=50&sort=total_amount']
+    client = app.test_client()
+    print(f"{'':<40} {'no cache':>10} {'cached':>10} {'304':>10}  (ms per request)")
+    for url in urls:
+        response_cache.enabled = False
+        uncached, _ = timed(client, url, args.requests)
+        response_cache.enabled = True
+        cached, _ = timed(client, url, args.requests)
+        revalidated, status = timed(client, url, args.requests, revalidate=True)
+        print(f"{url:<40} {uncached:10.2f} {cached:10.2f} {revalidated:10.2f}"
+              + ('' if status == 304 else f"  (revalidation returned {status})"))
+    print(f"cache hits {response_cache.hits}, misses {response_cache.misses}")
+
+
+if __name__ == '__main__':
+    main()
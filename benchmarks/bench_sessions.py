@@ -0,0 +1,138 @@
+"""
+Compare session backends on the hot read-only pages (/ and /api/recent_forms).
+
+Each backend runs in its own process against a throwaway database; the redis backend talks
+to the in-memory stand-in in fake_redis.py. 'filesystem-refresh' is the previous setup, which
+rewrote the session file on every request. Client threads each keep one session and poll
+the pages; the store writes per request should be ~0 for every other backend.
+
+    python benchmarks/bench_sessions.py --requests 500 --clients 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BACKENDS = ['filesystem-refresh', 'filesystem', 'sqlite', 'redis', 'cookie']
+HOT_URLS = ['/', '/api/recent_forms']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_child(args):
+    """Run one backend in this process and print its results as JSON."""
+    sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix='claimistry-sessions-')
+    backend = args.child.split('-')[0]
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'bench.db')
+    os.environ['SESSION_BACKEND'] = 'cookie' if backend == 'filesystem' else backend  # filesystem is set up below
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+    if backend == 'redis':
+        from benchmarks.fake_redis import start_server
+        _, store, os.environ['REDIS_URL'] = start_server()
+    import logging
+    from datetime import date
+    from app import app, db, reports, Employee, ReimbursementForm, ExpenseEntry
+    from ingest import FormIngestor
+    from sessions import configure_sessions
+    logging.disable(logging.INFO)
+
+    if backend == 'filesystem':
+        app.config['SESSION_FILE_DIR'] = os.path.join(workdir, 'flask_session')
+        configure_sessions(app, db, 'filesystem')
+    if args.child == 'filesystem-refresh':
+        app.config['SESSION_REFRESH_EACH_REQUEST'] = True
+    with app.app_context():
+        db.session.add_all(Employee(employee_id=f'EMP{i:04d}', name=f'Employee {i}', account_number=f'{i:012d}')
+                           for i in range(20))
+        db.session.commit()
+        FormIngestor(db, ReimbursementForm, ExpenseEntry, reports).write([
+            {'form': dict(employee_id=f'EMP{i:04d}', from_date=date(2025, 1, 1), to_date=date(2025, 1, 31),
+                          total_amount=100.0 * i), 'entries': [], 'source': f'form{i}'} for i in range(20)])
+
+    # Count writes to the store (server-side backends) or re-issued cookies (cookie backend)
+    writes = [0]
+    lock = threading.Lock()
+    interface = app.session_interface
+    server_side = hasattr(interface, '_upsert_session')
+    if server_side:
+        upsert = interface._upsert_session
+
+        def counting_upsert(*a, **kw):
+            with lock:
+                writes[0] += 1
+            return upsert(*a, **kw)
+        interface._upsert_session = counting_upsert
+
+    # The first visit creates each client's session (CSRF token); only returning visits are timed
+    clients = [app.test_client() for _ in range(args.clients)]
+    for client in clients:
+        client.get('/')
+    writes[0] = 0
+    latencies = []
+    errors = []
+
+    def client_loop(client):
+        for i in range(args.requests):
+            url = HOT_URLS[i % len(HOT_URLS)]
+            start = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    errors.append(f'{url}: {response.status_code}')
+                if not server_side and 'Set-Cookie' in response.headers:
+                    writes[0] += 1
+
+    threads = [threading.Thread(target=client_loop, args=(client,)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'requests_per_second': len(latencies) / elapsed,
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'writes': writes[0],
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500, help='requests per client')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--child', choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    for name in BACKENDS:
+        command = [sys.executable, os.path.abspath(__file__), '--child', name,
+                   '--requests', str(args.requests), '--clients', str(args.clients)]
+        output = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{name:<18} {result['requests_per_second']:7.1f} req/s | p50 {result['p50_ms']:6.2f} ms, "
+              f"p99 {result['p99_ms']:6.2f} ms | {result['writes']:5d} session writes / {result['requests']} requests"
+              f" | {result['errors']} error(s)" + (f" (first: {result['first_error']})" if result['first_error'] else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Measure dashboard/API read latency while forms are being ingested, with and without the WAL tuning.
+
+Each configuration runs in its own process against a throwaway seeded database: a writer
+stores batches of synthetic forms through FormIngestor, reader threads poll the JSON APIs
+and one thread keeps downloading the full ledger export (a long read, like a month-end export).
+
+    python benchmarks/bench_sqlite_concurrency.py --seconds 10 --readers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The previous settings: pysqlite's defaults (rollback journal, 5s lock timeout)
+CONFIGURATIONS = {
+    'default': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_MMAP_SIZE': '0',
+                'SQLITE_CACHE_SIZE': '-2000', 'SQLITE_BUSY_TIMEOUT': '5000'},
+    'tuned': {},
+}
+READ_URLS = ['/api/recent_forms', '/api/forms?limit=50', '/api/forms?sort=total_amount&limit=50']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_child(args):
+    """Run one configuration in this process and print its results as JSON."""
+    sys.path.insert(0, ROOT)
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='claimistry-concurrency-'), 'bench.db')
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+    import logging
+    from app import app, db, reports, Employee, ReimbursementForm, ExpenseEntry
+    from ingest import FormIngestor
+    logging.disable(logging.INFO)
+
+    ingestor = FormIngestor(db, ReimbursementForm, ExpenseEntry, reports, batch_size=args.batch_size)
+    stop = threading.Event()
+    written = [0]
+    exports = []
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def items(start):
+        for i in range(start, start + args.batch_size):
+            to_date = date(2025, 1, 1) + timedelta(days=i % 365)
+            form = dict(employee_id=f'EMP{i % 50:04d}', location='Ahmedabad', from_date=to_date,
+                        to_date=to_date, total_amount=float(i % 997), extracted_name=f'Employee {i % 50}')
+            entries = [dict(date=to_date, purpose='Client meeting', mode_of_travel='Cab', mode_normalized='cab',
+                            amount_rs=100.0) for _ in range(args.entries)]
+            yield {'form': form, 'entries': entries, 'source': f'form{i}'}
+
+    with app.app_context():
+        db.session.add_all(Employee(employee_id=f'EMP{i:04d}', name=f'Employee {i}') for i in range(50))
+        db.session.commit()
+        for start in range(0, args.seed_forms, args.batch_size):
+            ingestor.write(list(items(-args.seed_forms + start)))
+
+    def writer():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    ingestor.write(list(items(written[0])))
+                    written[0] += args.batch_size
+                except Exception as e:
+                    with lock:
+                        errors.append(f'write: {e}')
+                    db.session.rollback()
+
+    def reader(n):
+        client = app.test_client()
+        i = n
+        while not stop.is_set():
+            url = READ_URLS[i % len(READ_URLS)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                status = client.get(url).status_code
+            except Exception as e:
+                status = str(e)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if status != 200:
+                    errors.append(f'{url}: {status}')
+
+    def exporter():
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.get('/export_ledger?format=csv')
+            body = response.data
+            with lock:
+                exports.append(time.perf_counter() - start)
+                if response.status_code != 200 or not body:
+                    errors.append(f'export: {response.status_code}')
+
+    threads = ([threading.Thread(target=writer), threading.Thread(target=exporter)]
+               + [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print(json.dumps({
+        'forms_per_second': written[0] / args.seconds,
+        'reads': len(latencies),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': max(latencies, default=0) * 1000,
+        'exports': len(exports),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--entries', type=int, default=20)
+    parser.add_argument('--seed-forms', type=int, default=2000, help='forms stored before the run')
+    parser.add_argument('--child', choices=CONFIGURATIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    for name, overrides in CONFIGURATIONS.items():
+        env = dict(os.environ, **overrides)
+        command = [sys.executable, os.path.abspath(__file__), '--child', name, '--seconds', str(args.seconds),
+                   '--readers', str(args.readers), '--batch-size', str(args.batch_size), '--entries', str(args.entries),
+                   '--seed-forms', str(args.seed_forms)]
+        output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{name:<8} writes {result['forms_per_second']:6.1f} forms/s | {result['reads']:5d} reads: "
+              f"p50 {result['p50_ms']:6.1f} ms, p95 {result['p95_ms']:6.1f} ms, p99 {result['p99_ms']:6.1f} ms, "
+              f"max {result['max_ms']:7.1f} ms | {result['exports']} exports | {result['errors']} error(s)"
+              + (f" (first: {result['first_error']})" if result['first_error'] else ''))
+
+
+if __name__ == '__main__':
+    main()
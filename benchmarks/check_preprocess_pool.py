@@ -0,0 +1,60 @@
+"""
+Check that a worker process dying mid-batch fails only the entry that killed it, and that the
+shared pool keeps working for later batches (as app.preprocess_upload uses it):
+
+    python benchmarks/check_preprocess_pool.py
+"""
+import argparse
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_preprocess import create_preprocess_executor, preprocess_batch, preprocess_one
+
+CRASH = b'crash the worker'
+
+
+def preprocess_or_crash(source, **options):
+    """preprocess_one, except that the CRASH marker kills the worker process like a native crash would."""
+    if source == CRASH:
+        os._exit(1)
+    return preprocess_one(source, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', default='test_images/*.jpg')
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    sources = []
+    for path in sorted(glob.glob(args.images))[:4]:
+        with open(path, 'rb') as f:
+            sources.append(f.read())
+    pool = create_preprocess_executor(args.workers)
+    results = []
+
+    def check(ok, description):
+        results.append(ok)
+        print(f"{'ok  ' if ok else 'FAIL'} {description}")
+
+    try:
+        batch = sources[:2] + [CRASH] + sources[2:]
+        outcome = pool.run(preprocess_or_crash, batch)
+        failed = [i for i, r in enumerate(outcome) if isinstance(r, Exception) or r['error']]
+        check(failed == [2], f'only the crashing entry failed (failed entries: {failed})')
+        after = preprocess_batch(sources, executor=pool)
+        check(all(r['error'] is None for r in after), 'the next batch on the same pool succeeds')
+        outcome = pool.run(preprocess_or_crash, [CRASH, CRASH])
+        check(all(isinstance(r, Exception) for r in outcome), 'a batch of crashing entries fails without hanging')
+        check(preprocess_batch(sources[:1], executor=pool)[0]['error'] is None, 'and the pool recovers again')
+    finally:
+        pool.shutdown()
+    print('all checks passed' if all(results) else f'{results.count(False)} check(s) failed')
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
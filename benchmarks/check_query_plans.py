@@ -0,0 +1,145 @@
+"""
+Check that dashboard, monthly summary, rollup and listing queries use their indexes.
+
+Seeds a throwaway database, captures the SQL the app issues for each page (and
+for a rollup refresh, as done on every form write) and
+runs EXPLAIN QUERY PLAN on it. Exits non-zero if an expected index is unused or
+a hot table is scanned without one:
+
+    python benchmarks/check_query_plans.py --forms 2000 --verbose
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never touch the real database; the key is only needed to build the client
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='claimistry-plans-'), 'plans.db')
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+os.environ['RESPONSE_CACHE'] = 'off'  # every page must reach the database
+
+from sqlalchemy import event
+
+import app as claimistry
+from app import app, db, Employee, ReimbursementForm, ExpenseEntry
+
+# Tables that grow with usage; a plain "SCAN <table>" on these is a regression
+HOT_TABLES = ('reimbursement_form', 'expense_entry', 'monthly_employee_rollup')
+# SQLite's name for the (year, month, group_key) unique constraint
+ROLLUP_INDEX = 'sqlite_autoindex_monthly_employee_rollup_1'
+
+
+def seed(forms, months=24):
+    employees = [Employee(employee_id=f'EMP{i:04d}', name=f'Employee {i}', account_number=f'{i:012d}')
+                 for i in range(50)]
+    db.session.add_all(employees)
+    start = date.today().replace(day=1) - timedelta(days=30 * months)
+    for i in range(forms):
+        to_date = start + timedelta(days=random.randrange(30 * months))
+        form = ReimbursementForm(employee_id=random.choice(employees).employee_id, location='Ahmedabad',
+                                 from_date=to_date - timedelta(days=3), to_date=to_date, total_amount=0)
+        db.session.add(form)
+        db.session.flush()
+        for d in range(4):
+            db.session.add(ExpenseEntry(form_id=form.id, date=form.from_date + timedelta(days=d),
+                                        mode_of_travel=random.choice(['Cab', '2-Wheeler', 'Food & Misc.']),
+                                        distance_km=random.randint(1, 40), amount_rs=random.randint(50, 500)))
+    db.session.commit()
+    claimistry.reports.rebuild_rollups()
+    db.session.commit()
+
+
+def get(client, url):
+    def run():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return run
+
+
+def refresh_rollup():
+    """What every form write does: recompute one employee's rollup row (rolled back afterwards)."""
+    form = db.session.get(ReimbursementForm, 1)
+    claimistry.reports.refresh_rollups([claimistry.reports.rollup_key(form)])
+    db.session.rollback()
+
+
+def capture(action):
+    """(sql, params) for every statement executed by action()."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        action()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return statements
+
+
+def explain(statement, parameters):
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--forms', type=int, default=2000)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    today = date.today()
+    summary_url = f'/monthly_summary/{today.year}/{today.month}'
+
+    with app.app_context():
+        random.seed(0)
+        seed(args.forms)
+        client = app.test_client()
+        checks = [
+            # (label, action, index that must appear in at least one plan)
+            ('/', get(client, '/'), ROLLUP_INDEX),
+            ('/', get(client, '/'), 'ix_reimbursement_form_created_at'),
+            ('/api/recent_forms', get(client, '/api/recent_forms'), 'ix_reimbursement_form_created_at'),
+            ('/api/forms', get(client, '/api/forms'), 'ix_reimbursement_form_to_date'),
+            ('/api/forms?sort=created_at', get(client, '/api/forms?sort=created_at'), 'ix_reimbursement_form_created_at'),
+            ('/monthly_summary_selector', get(client, '/monthly_summary_selector'), 'ix_reimbursement_form_to_date'),
+            (summary_url, get(client, summary_url), ROLLUP_INDEX),
+            ('rollup refresh', refresh_rollup, 'ix_reimbursement_form_employee_id_to_date'),
+            ('rollup refresh', refresh_rollup, 'ix_expense_entry_form_id_date'),
+            ('/form_details/1', get(client, '/form_details/1'), 'ix_expense_entry_form_id_date'),
+            ('/api/forms?q=employee 7', get(client, '/api/forms?q=employee%207'), 'form_search VIRTUAL TABLE'),
+            ('/api/search?q=employee 7', get(client, '/api/search?q=employee%207'), 'INTEGER PRIMARY KEY'),
+        ]
+        failures = 0
+        for label, action, index in checks:
+            plans = []
+            for statement, parameters in capture(action):
+                if not any(table in statement for table in HOT_TABLES):
+                    continue
+                plan = explain(statement, parameters)
+                plans.append((statement, plan))
+            used = any(index in line for _, plan in plans for line in plan)
+            scans = [line for _, plan in plans for line in plan
+                     if any(line == f'SCAN {table}' for table in HOT_TABLES)]
+            ok = used and not scans
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {label:<30} {index}" + (f"  full scans: {scans}" if scans else ''))
+            if args.verbose or not ok:
+                for statement, plan in plans:
+                    print('     ' + ' '.join(statement.split())[:160])
+                    for line in plan:
+                        print(f'       {line}')
+        print(f"{len(checks) - failures}/{len(checks)} checks passed ({os.environ['DATABASE_PATH']})")
+    claimistry.job_queue.shutdown(wait=False)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Check the upload store end to end for each backend: sharded layout, serving, lazy renditions,
+reference counts through the form delete routes, and garbage collection of unreferenced images.
+
+Each backend runs in its own process, in a throwaway directory with its own database and upload
+folder; the s3 backend talks to the stand-in in fake_s3.py:
+
+    python benchmarks/check_upload_storage.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ['local', 's3']
+
+
+def run_child(backend):
+    """Run the checks for one backend in this process and print [(ok, description)] as JSON."""
+    sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix='claimistry-uploads-')
+    os.chdir(workdir)  # UPLOAD_FOLDER and app.log are relative to the working directory
+    os.environ.update(DATABASE_PATH=os.path.join(workdir, 'uploads.db'), UPLOAD_BACKEND=backend,
+                      UPLOAD_GC_INTERVAL='0', UPLOAD_GC_GRACE='0', RESPONSE_CACHE='off')
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+    legacy = 'c0ffee00c0ffee00c0ffee00c0ffee00.jpg'
+    if backend == 's3':
+        from benchmarks.fake_s3 import start_server
+        _, fake, endpoint = start_server(buckets=['claims'])
+        os.environ.update(S3_BUCKET='claims', S3_ENDPOINT_URL=endpoint, S3_REGION='us-east-1',
+                          AWS_ACCESS_KEY_ID='test', AWS_SECRET_ACCESS_KEY='test')
+    else:
+        # An image stored by a version before sharding, directly in the upload folder
+        os.makedirs('static/uploads')
+        with open(os.path.join('static/uploads', legacy), 'wb') as f:
+            f.write(fake_jpeg())
+
+    import logging
+    from datetime import date
+    import numpy as np
+    from sqlalchemy import text
+    from app import (app, db, form_ingestor, upload_collector, upload_store, storage_writer, upload_url,
+                     ProcessingJob, ProcessingTask, ExtractionCache, ReimbursementForm)
+    from derivatives import derivative_filename, write_derivatives
+    from storage import LocalStorage
+    logging.disable(logging.INFO)
+    app.config['WTF_CSRF_ENABLED'] = False
+    if backend == 's3':
+        upload_store.put(legacy, fake_jpeg())
+
+    results = []
+
+    def check(ok, description):
+        results.append((bool(ok), description))
+
+    def stored():
+        return {name for name, _ in upload_store.list()}
+
+    # Three processed uploads: a and b get forms (a twice), c's processing failed (original only)
+    image = np.full((2000, 1500, 3), 200, np.uint8)
+    names = {}
+    for key in 'abc':
+        digest = str('abc'.index(key) + 1) * 64  # stands in for the upload's SHA-256
+        names[key] = (f'{digest}.jpg', f'combined_{digest}.jpg')
+        storage_writer.write_bytes(names[key][0], b'original upload bytes')
+        if key != 'c':
+            storage_writer.write_image(names[key][1], image)
+            write_derivatives(storage_writer, names[key][1], image)
+    storage_writer.flush()
+
+    with app.app_context():
+        form_ingestor.write([{'form': dict(employee_id='EMP1', from_date=date(2025, 1, 1), to_date=date(2025, 1, 31),
+                                           total_amount=10.0, image_filename=names[key][1]),
+                              'entries': [], 'source': key} for key in ('a', 'a', 'b')])
+        db.session.add(ExtractionCache(content_hash='b' * 64, processed_filename=names['b'][1]))
+        db.session.commit()
+        forms = {f.id: f.image_filename for f in ReimbursementForm.query.all()}
+        refs = dict(db.session.execute(text('SELECT name, refcount FROM upload_ref')).all())
+    check(refs == {names['a'][1]: 2, names['b'][1]: 1}, f'reference counts after ingest: {refs}')
+
+    a_files = {names['a'][0], names['a'][1], derivative_filename(names['a'][1], 'thumb'),
+               derivative_filename(names['a'][1], 'medium')}
+    check(a_files <= stored(), 'original, combined image and renditions stored')
+    if isinstance(upload_store, LocalStorage):
+        path = upload_store.path(names['a'][1])
+        check(os.path.relpath(path, 'static/uploads').count(os.sep) == 2, f'sharded path {path}')
+        check(os.path.exists(os.path.join('static/uploads', legacy)), 'importing the app leaves flat uploads alone')
+        output = app.test_cli_runner().invoke(args=['migrate-uploads']).output.strip()
+        check(os.path.exists(upload_store.path(legacy)) and not os.path.exists(os.path.join('static/uploads', legacy)),
+              f'flask migrate-uploads moved the flat upload into its shard ({output})')
+
+    client = app.test_client()
+    with app.test_request_context():
+        url = upload_url(names['a'][1])
+        thumb_url = upload_url(legacy, 'thumb')
+    if backend == 'local':
+        check(url.startswith('/static/uploads/') and url.count('/') == 5, f'static URL {url}')
+    else:
+        response = client.get(url)
+        check(response.status_code == 200 and response.mimetype == 'image/jpeg'
+              and 'immutable' in response.headers.get('Cache-Control', ''), f'served from the bucket: {url}')
+    response = client.get(thumb_url)
+    check(response.status_code == 200 and upload_store.exists(derivative_filename(legacy, 'thumb')),
+          f'legacy thumbnail generated on request: {thumb_url} -> {response.status_code}')
+    check(client.get('/uploads/..%2Fapp.py').status_code == 404
+          and client.get('/uploads/thumb/../../app.py').status_code == 404, 'names outside the store rejected')
+
+    # Deleting b's only form frees its image; deleting one of a's two forms doesn't
+    b_form = next(i for i, name in forms.items() if name == names['b'][1])
+    a_form = next(i for i, name in forms.items() if name == names['a'][1])
+    client.post(f'/delete_form/{b_form}')
+    client.post('/bulk_delete_forms', json={'form_ids': [a_form]})
+    with app.app_context():
+        deleted = upload_collector.collect()
+        refs = dict(db.session.execute(text('SELECT name, refcount FROM upload_ref')).all())
+        cached = db.session.get(ExtractionCache, 'b' * 64).processed_filename
+    check(not any(name.startswith(('combined_' + names['b'][0][:8], names['b'][0][:8])) for name in stored()),
+          f'collect() deleted the 4 files of the deleted form ({deleted} deleted)')
+    check(a_files <= stored() and refs == {names['a'][1]: 1}, f'image still used by a form kept: {refs}')
+    check(cached is None, 'extraction cache no longer points at the deleted image')
+
+    # sweep() finds never-referenced files, except those of tasks still in progress
+    with app.app_context():
+        job = ProcessingJob(total_files=1)
+        job.tasks.append(ProcessingTask(stored_filename=legacy, content_hash=legacy[:-4]))
+        db.session.add(job)
+        db.session.commit()
+        upload_collector.sweep()
+    check(names['c'][0] not in stored(), 'sweep() deleted the original of a failed upload')
+    check(legacy in stored() and a_files <= stored(), 'sweep() kept queued and referenced uploads')
+    print(json.dumps(results))
+
+
+def fake_jpeg():
+    import cv2
+    import numpy as np
+    return cv2.imencode('.jpg', np.full((1200, 1600, 3), 128, np.uint8))[1].tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--child', choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child)
+        return
+
+    failures = 0
+    for backend in BACKENDS:
+        command = [sys.executable, os.path.abspath(__file__), '--child', backend]
+        process = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+        if process.returncode != 0:
+            print(f"{backend}: failed\n{process.stderr[-2000:]}")
+            failures += 1
+            continue
+        for ok, description in json.loads(process.stdout.strip().splitlines()[-1]):
+            print(f"{'ok  ' if ok else 'FAIL'} {backend:<6} {description}")
+            failures += not ok
+    print('all checks passed' if not failures else f'{failures} check(s) failed')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
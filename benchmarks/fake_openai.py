@@ -0,0 +1,80 @@
+"""
+Minimal stand-in for the OpenAI Files and Responses endpoints, for benchmarks.
+
+Every call sleeps for `latency` seconds; a fraction of model calls can be
+answered with 429 to exercise the retry path.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_RESULT = {
+    "header": {
+        "Employee ID": "EMP001",
+        "Name of Employee": "John Doe",
+        "Designation": "Engineer",
+        "Location": "Mumbai",
+        "From Date": "01.09.2026",
+        "To Date": "30.09.2026",
+        "Total Amount": "250",
+        "Calculated Total": "250",
+        "total_mismatch": False
+    },
+    "expenses": [
+        {"Date": "02.09.2026", "From": "Home", "To": "Office", "Purpose": "Commute",
+         "Mode of Travel": "2-Wheeler", "Distance (in Km)": "15", "Amount (in Rs.)": "250"}
+    ]
+}
+
+
+def make_handler(latency, error_rate):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency)
+            if self.path.endswith('/files'):
+                self._send(200, {"id": f"file-{uuid.uuid4().hex}", "object": "file", "bytes": 0,
+                                 "created_at": int(time.time()), "filename": "form.jpg",
+                                 "purpose": "user_data", "status": "processed"})
+            elif self.path.endswith('/responses'):
+                if random.random() < error_rate:
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+                    return
+                self._send(200, {
+                    "id": f"resp-{uuid.uuid4().hex}", "object": "response", "created_at": int(time.time()),
+                    "model": "gpt-4.1", "status": "completed",
+                    "output": [{"type": "message", "id": "msg-1", "role": "assistant", "status": "completed",
+                                "content": [{"type": "output_text", "text": json.dumps(SAMPLE_RESULT),
+                                             "annotations": []}]}],
+                    "usage": {"input_tokens": 1500, "output_tokens": 300, "total_tokens": 1800}
+                })
+            else:
+                self._send(404, {"error": {"message": "Not found"}})
+
+        def do_DELETE(self):
+            time.sleep(latency)
+            file_id = self.path.rsplit('/', 1)[-1]
+            self._send(200, {"id": file_id, "object": "file", "deleted": True})
+
+    return Handler
+
+
+def start_server(latency=0.5, error_rate=0.0, port=0):
+    """Start the fake API on a background thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(latency, error_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
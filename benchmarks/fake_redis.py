@@ -0,0 +1,149 @@
+"""
+Minimal in-memory Redis-protocol server, for testing the redis session backend.
+
+Supports the commands the session store, the response cache and redis-py's handshake use:
+HELLO, PING, GET, MGET, SET (with EX/PX), SETEX, MSET, DEL, EXISTS, TTL, FLUSHDB and
+CLIENT/SELECT (acknowledged).
+Each connection answers in the protocol it negotiated with HELLO (RESP2 or RESP3, which
+only differ here in the null reply). Keys expire lazily on access. Run standalone with:
+
+    python benchmarks/fake_redis.py --port 6379
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class Store:
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+
+    def _alive(self, key):
+        deadline = self.expiry.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.data
+
+    def _value(self, key, connection):
+        if not self._alive(key):
+            return b'_\r\n' if connection['protocol'] == 3 else b'$-1\r\n'
+        return bulk(self.data[key])
+
+    def execute(self, args, connection):
+        """Reply to one command; connection is a per-client dict holding the negotiated protocol."""
+        command = args[0].upper()
+        with self.lock:
+            self.commands += 1
+            if command == b'PING':
+                return b'+PONG\r\n'
+            if command == b'HELLO':
+                proto = int(args[1]) if len(args) > 1 else 2
+                connection['protocol'] = proto
+                header = b'%2\r\n' if proto == 3 else b'*4\r\n'
+                return header + bulk(b'server') + bulk(b'redis') + bulk(b'proto') + b':%d\r\n' % proto
+            if command in (b'CLIENT', b'SELECT'):
+                return b'+OK\r\n'
+            if command == b'GET':
+                return self._value(args[1], connection)
+            if command == b'MGET':
+                return b'*%d\r\n' % (len(args) - 1) + b''.join(self._value(key, connection) for key in args[1:])
+            if command == b'MSET':
+                for key, value in zip(args[1::2], args[2::2]):
+                    self.data[key] = value
+                    self.expiry.pop(key, None)
+                return b'+OK\r\n'
+            if command in (b'SET', b'SETEX'):
+                if command == b'SETEX':
+                    key, seconds, value = args[1], args[2], args[3]
+                    ttl = float(seconds)
+                else:
+                    key, value, ttl = args[1], args[2], None
+                    options = [a.upper() for a in args[3:]]
+                    if b'EX' in options:
+                        ttl = float(args[3 + options.index(b'EX') + 1])
+                    elif b'PX' in options:
+                        ttl = float(args[3 + options.index(b'PX') + 1]) / 1000
+                self.data[key] = value
+                if ttl is None:
+                    self.expiry.pop(key, None)
+                else:
+                    self.expiry[key] = time.monotonic() + ttl
+                return b'+OK\r\n'
+            if command in (b'DEL', b'EXISTS'):
+                keys = [key for key in args[1:] if self._alive(key)]
+                if command == b'DEL':
+                    for key in keys:
+                        self.data.pop(key, None)
+                        self.expiry.pop(key, None)
+                return b':%d\r\n' % len(keys)
+            if command == b'TTL':
+                if not self._alive(args[1]):
+                    return b':-2\r\n'
+                deadline = self.expiry.get(args[1])
+                return b':%d\r\n' % (-1 if deadline is None else int(deadline - time.monotonic()))
+            if command == b'FLUSHDB':
+                self.data.clear()
+                self.expiry.clear()
+                return b'+OK\r\n'
+        return b'-ERR unknown command\r\n'
+
+
+def bulk(value):
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def read_command(rfile):
+    """One RESP array of bulk strings, or None at end of stream."""
+    line = rfile.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.split()  # inline command, e.g. from telnet
+    args = []
+    for _ in range(int(line[1:])):
+        length = int(rfile.readline()[1:])
+        args.append(rfile.read(length + 2)[:-2])
+    return args
+
+
+def make_handler(store):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            connection = {'protocol': 2}
+            while True:
+                args = read_command(self.rfile)
+                if not args:
+                    return
+                self.wfile.write(store.execute(args, connection))
+
+    return Handler
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(port=0):
+    """Start the fake server on a background thread. Returns (server, store, redis_url)."""
+    store = Store()
+    server = Server(('127.0.0.1', port), make_handler(store))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, store, f"redis://127.0.0.1:{server.server_address[1]}/0"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    server, _, url = start_server(args.port)
+    print(f"Listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
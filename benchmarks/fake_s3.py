@@ -0,0 +1,167 @@
+"""
+Minimal in-memory S3-compatible server (MinIO-style, path-style URLs), for testing the s3 upload backend.
+
+Supports what storage.S3Storage and boto3 use: create bucket, PUT/GET/HEAD/DELETE object and
+ListObjectsV2 (prefix, max-keys, continuation tokens). Request signatures are not checked, so
+any credentials work. Run standalone with:
+
+    python benchmarks/fake_s3.py --port 9000
+"""
+import argparse
+import hashlib
+import threading
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+
+class Store:
+    def __init__(self):
+        self.buckets = {}  # bucket -> {key: (data, content type, modified)}
+        self.lock = threading.Lock()
+        self.requests = {}  # method -> count
+
+    def count(self, method):
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+
+def decode_aws_chunked(body):
+    """The payload of an aws-chunked body ('<hex size>;chunk-signature=...\\r\\n<data>\\r\\n' ... '0' + trailers)."""
+    data = bytearray()
+    while body:
+        header, _, body = body.partition(b'\r\n')
+        size = int(header.split(b';')[0], 16)
+        if size == 0:
+            break
+        data += body[:size]
+        body = body[size + 2:]
+    return bytes(data)
+
+
+def error(handler, status, code, message):
+    body = (f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+            f'<Message>{message}</Message></Error>').encode()
+    handler.send_response(status)
+    handler.send_header('Content-Type', 'application/xml')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    if handler.command != 'HEAD':
+        handler.wfile.write(body)
+
+
+def make_handler(store):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _target(self):
+            url = urlsplit(self.path)
+            bucket, _, key = url.path.lstrip('/').partition('/')
+            return unquote(bucket), unquote(key), parse_qs(url.query)
+
+        def _reply(self, status, body=b'', headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD' and body:
+                self.wfile.write(body)
+
+        def do_PUT(self):
+            store.count('PUT')
+            bucket, key, _ = self._target()
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if 'aws-chunked' in self.headers.get('Content-Encoding', ''):
+                body = decode_aws_chunked(body)
+            with store.lock:
+                if not key:
+                    store.buckets.setdefault(bucket, {})
+                    return self._reply(200)
+                if bucket not in store.buckets:
+                    return error(self, 404, 'NoSuchBucket', 'The specified bucket does not exist')
+                store.buckets[bucket][key] = (body, self.headers.get('Content-Type', 'binary/octet-stream'),
+                                              datetime.now(timezone.utc).replace(microsecond=0))
+            self._reply(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+        def do_GET(self):
+            store.count('GET')
+            bucket, key, query = self._target()
+            if not key:
+                return self._list(bucket, query)
+            self._object(bucket, key)
+
+        def do_HEAD(self):
+            store.count('HEAD')
+            bucket, key, _ = self._target()
+            self._object(bucket, key)
+
+        def do_DELETE(self):
+            store.count('DELETE')
+            bucket, key, _ = self._target()
+            with store.lock:
+                store.buckets.get(bucket, {}).pop(key, None)
+            self._reply(204)
+
+        def _object(self, bucket, key):
+            with store.lock:
+                item = store.buckets.get(bucket, {}).get(key)
+            if item is None:
+                return error(self, 404, 'NoSuchKey', 'The specified key does not exist.')
+            data, content_type, modified = item
+            self._reply(200, data, {'Content-Type': content_type, 'Last-Modified': format_datetime(modified, usegmt=True),
+                                    'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+
+        def _list(self, bucket, query):
+            prefix = query.get('prefix', [''])[0]
+            max_keys = int(query.get('max-keys', ['1000'])[0])
+            after = query.get('continuation-token', query.get('start-after', ['']))[0]
+            with store.lock:
+                if bucket not in store.buckets:
+                    return error(self, 404, 'NoSuchBucket', 'The specified bucket does not exist')
+                keys = sorted(k for k in store.buckets[bucket] if k.startswith(prefix) and k > after)
+                page = [(k, store.buckets[bucket][k]) for k in keys[:max_keys]]
+            truncated = len(keys) > max_keys
+            contents = ''.join(
+                f'<Contents><Key>{escape(k)}</Key><LastModified>{modified.strftime("%Y-%m-%dT%H:%M:%S.000Z")}'
+                f'</LastModified><ETag>"{hashlib.md5(data).hexdigest()}"</ETag><Size>{len(data)}</Size>'
+                f'<StorageClass>STANDARD</StorageClass></Contents>'
+                for k, (data, _, modified) in page)
+            token = f'<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>' if truncated else ''
+            body = (f'<?xml version="1.0" encoding="UTF-8"?>'
+                    f'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/"><Name>{escape(bucket)}</Name>'
+                    f'<Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>'
+                    f'<IsTruncated>{"true" if truncated else "false"}</IsTruncated>{token}{contents}'
+                    f'</ListBucketResult>').encode()
+            self._reply(200, body, {'Content-Type': 'application/xml'})
+
+    return Handler
+
+
+def start_server(port=0, buckets=()):
+    """Start the fake server on a background thread. Returns (server, store, endpoint_url)."""
+    store = Store()
+    for bucket in buckets:
+        store.buckets[bucket] = {}
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(store))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, store, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--bucket', action='append', default=[], help='bucket to create at startup')
+    args = parser.parse_args()
+    server, _, url = start_server(args.port, args.bucket)
+    print(f"Listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
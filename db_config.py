@@ -0,0 +1,71 @@
+import logging
+import re
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Applied to every new SQLite connection, in this order; each can be overridden with an
+# environment variable named SQLITE_<PRAGMA>, e.g. SQLITE_JOURNAL_MODE=DELETE.
+DEFAULT_PRAGMAS = {
+    'busy_timeout': 5000,  # ms to wait for a lock before "database is locked"
+    'journal_mode': 'WAL',  # readers and the writer no longer block each other
+    'synchronous': 'NORMAL',  # fsync at checkpoints rather than every commit; safe with WAL
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative = KiB, i.e. 64 MB of page cache per connection
+}
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def sqlite_pragmas(environ):
+    """PRAGMA settings from SQLITE_* environment variables, falling back to DEFAULT_PRAGMAS."""
+    pragmas = {}
+    for name, default in DEFAULT_PRAGMAS.items():
+        value = str(environ.get(f'SQLITE_{name.upper()}', default)).strip()
+        if not _PRAGMA_VALUE.match(value):
+            raise ValueError(f"Invalid value for SQLITE_{name.upper()}: {value!r}")
+        pragmas[name] = value
+    return pragmas
+
+
+def engine_options(environ, database_uri):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS with pool sizing from DB_POOL_SIZE, DB_MAX_OVERFLOW and
+    DB_POOL_TIMEOUT (seconds to wait for a free connection).
+
+    Size the pool for the request threads plus JOB_WORKERS; with WAL each connection
+    can read while another writes. In-memory databases keep Flask-SQLAlchemy's single
+    shared connection.
+    """
+    if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}
+    return {
+        'pool_size': int(environ.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)),
+    }
+
+
+def configure_sqlite(engine, pragmas):
+    """Run the pragmas on every new connection of engine (most pragmas only last for a connection)."""
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+
+
+def log_sqlite_settings(engine):
+    """Log the pragmas in effect, as reported by SQLite (journal_mode can silently stay unchanged)."""
+    with engine.connect() as conn:
+        settings = {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar() for name in DEFAULT_PRAGMAS}
+    logger.info('SQLite settings: ' + ', '.join(f'{name}={value}' for name, value in settings.items()))
+    return settings
@@ -0,0 +1,57 @@
+import logging
+import os
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Downscaled renditions of processed form images: name -> maximum width in pixels
+RENDITIONS = {'thumb': 320, 'medium': 1024}
+
+# WebP is roughly a third smaller than JPEG at the same quality; fall back where OpenCV lacks it
+if cv2.haveImageWriter('.webp'):
+    DERIVATIVE_EXT, DERIVATIVE_PARAMS = '.webp', [cv2.IMWRITE_WEBP_QUALITY, 80]
+else:
+    DERIVATIVE_EXT, DERIVATIVE_PARAMS = '.jpg', [cv2.IMWRITE_JPEG_QUALITY, 80, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+
+
+def derivative_filename(filename, rendition):
+    """'combined_ab12.jpg', 'thumb' -> 'combined_ab12.thumb.webp'"""
+    return f"{os.path.splitext(filename)[0]}.{rendition}{DERIVATIVE_EXT}"
+
+
+def resize_to_width(image, width):
+    """image scaled down (never up) to at most width pixels wide."""
+    height, current = image.shape[:2]
+    if current <= width:
+        return image
+    return cv2.resize(image, (width, max(1, round(height * width / current))), interpolation=cv2.INTER_AREA)
+
+
+def write_derivatives(writer, filename, image):
+    """Queue every rendition of image (the pixels of filename, already in memory) on a BackgroundWriter."""
+    for rendition, width in RENDITIONS.items():
+        writer.write_image(derivative_filename(filename, rendition), resize_to_width(image, width), DERIVATIVE_PARAMS)
+
+
+def ensure_derivative(store, filename, rendition):
+    """
+    Name of the rendition of filename, generating it from the full image in store if it doesn't
+    exist yet (images stored before renditions were made at ingest). None if the image can't be read.
+    """
+    name = derivative_filename(filename, rendition)
+    if store.exists(name):
+        return name
+    data = store.get(filename)
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+    if image is None:
+        return None
+    ok, buf = cv2.imencode(DERIVATIVE_EXT, resize_to_width(image, RENDITIONS[rendition]), DERIVATIVE_PARAMS)
+    if not ok:
+        logger.error(f"Could not encode {rendition} rendition of {filename}")
+        return None
+    # Concurrent requests may both generate it; stores replace files whole, so either copy wins intact
+    store.put(name, buf.tobytes())
+    logger.info(f"Generated {rendition} rendition {name} ({len(buf)} bytes)")
+    return name
@@ -0,0 +1,151 @@
+import logging
+from datetime import datetime, timezone
+from itertools import chain, islice
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import openpyxl
+from flask import Response, stream_with_context
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.writer.excel import ExcelWriter
+
+logger = logging.getLogger(__name__)
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+MONEY_FORMAT = '#,##0.00'
+MAX_COLUMN_WIDTH = 30
+# Write-only sheets emit column widths before the first row, so widths are estimated
+# from this many leading rows; the rest stream straight through.
+WIDTH_SAMPLE_ROWS = 500
+CHUNK_SIZE = 64 * 1024  # bytes of compressed output per response chunk
+
+HEADER_FONT = Font(bold=True)
+HEADER_FILL = PatternFill('solid', fgColor='DDDDDD')
+
+
+def new_workbook():
+    """Write-only workbook for iter_workbook()/send_workbook(): rows are written out as they are appended."""
+    return openpyxl.Workbook(write_only=True)
+
+
+def cell(ws, value, number_format=None, font=None, fill=None):
+    """A styled cell for ws.append() on a write-only sheet."""
+    c = WriteOnlyCell(ws, value=value)
+    if number_format:
+        c.number_format = number_format
+    if font:
+        c.font = font
+    if fill:
+        c.fill = fill
+    return c
+
+
+def header_row(ws, headers, fill=HEADER_FILL):
+    return [cell(ws, h, font=HEADER_FONT, fill=fill) for h in headers]
+
+
+def cell_length(value):
+    if isinstance(value, Cell):
+        value = value.value
+    return len(str(value)) if value is not None else 0
+
+
+def column_width(length):
+    return min((length + 2) * 1.2, MAX_COLUMN_WIDTH)
+
+
+def size_columns(ws, sample):
+    """Set ws's column widths from the longest value per column in sample (must precede the first row)."""
+    lengths = {}
+    for row in sample:
+        for col, value in enumerate(row, 1):
+            lengths[col] = max(lengths.get(col, 0), cell_length(value))
+    for col, length in lengths.items():
+        ws.column_dimensions[get_column_letter(col)].width = column_width(length)
+
+
+class _ChunkBuffer:
+    """Write-only sink for ZipFile; take() hands over what has been written since the last call."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+class _StreamedSheetWriter(ExcelWriter):
+    """ExcelWriter for a write-only workbook whose sheet XML is already in the archive."""
+
+    def write_worksheet(self, ws):
+        ws._drawing = None
+        ws._rels = ws._writer._rels
+        self.manifest.append(ws)
+
+
+def iter_workbook(wb, rows, chunk_size=CHUNK_SIZE, sample_size=WIDTH_SAMPLE_ROWS):
+    """
+    Generate the .xlsx bytes of a write-only workbook with a single sheet, appending rows
+    (lists of values or cells) to that sheet as the output is consumed.
+
+    The sheet XML is written straight into a deflated zip entry and handed out every
+    chunk_size bytes, so the first bytes leave while later rows are still being produced
+    and neither rows nor the file are held in full, in memory or on disk. The zip is written
+    without seeking (sizes follow each entry in data descriptors) and the rest of the
+    workbook (styles, workbook and content types parts) is added after the rows.
+    Column widths are sized from the first sample_size rows, the only rows held in memory.
+    """
+    ws, = wb.worksheets
+    rows = iter(rows)
+    sample = list(islice(rows, sample_size))
+    size_columns(ws, sample)
+
+    buffer = _ChunkBuffer()
+    archive = ZipFile(buffer, 'w', ZIP_DEFLATED, allowZip64=True)
+    ws._id = 1
+    with archive.open(ws.path[1:], 'w') as entry:
+        # What WriteOnlyWorksheet sets up on the first append, writing to the entry instead of a temp file
+        ws._writer = WorksheetWriter(ws, out=entry)
+        ws._writer.write_top()
+        for row in chain(sample, rows):
+            ws.append(row)
+            if buffer.size >= chunk_size:
+                yield buffer.take()
+        ws.close()
+    wb.properties.modified = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+    _StreamedSheetWriter(wb, archive).save()
+    yield buffer.take()
+
+
+def send_workbook(wb, download_name, rows):
+    """
+    Attachment response that streams wb with rows appended to its only sheet (see iter_workbook).
+
+    Rows are generated while the response is sent, inside the request's app context, so they
+    can come from a query. The size isn't known up front, so there is no Content-Length;
+    an error after the first chunk can only cut the download short.
+    """
+    def generate():
+        try:
+            yield from iter_workbook(wb, rows)
+        except Exception as e:
+            logger.error(f"Error streaming {download_name}: {e}")
+            raise
+
+    response = Response(stream_with_context(generate()), mimetype=XLSX_MIMETYPE)
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    return response
@@ -0,0 +1,393 @@
+import base64
+import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import openai
+
+from image_preprocess import encode_image
+
+logger = logging.getLogger(__name__)
+
+# Define the prompt with explicit date format and strict JSON response requirement
+EXTRACTION_PROMPT = """
+            Carefully examine the expense table on this form. Internally determine the layout including the number of rows and columns to ensure no values are skipped during extraction — especially merged cells or multi-line text.
+
+            Then extract:
+
+            1. Header Section (top of the form):
+            - Employee ID, Name of Employee, Designation, Location
+            - From Date and To Date (format: DD.MM.YYYY)
+            - Total Amount (numeric only, no symbols).  
+                It may be labeled as "Total" or "Total Amount" or "Total Amount (in Rs.)"  
+                If this field is **not present anywhere in the image**, return 0.
+            - In addition to the above, always compute and return the sum of all extracted "Amount (in Rs.)" values as a separate field called "Calculated Total".
+            - If both a header total and a calculated total are present, compare them and add a boolean field "total_mismatch": true if they differ, false if they match. Always include both totals and the flag in the output.
+
+            2. Expense Entries (the table):
+            - Merged-cell values (e.g. Purpose, Date, From/To) must be duplicated across the rows they visually span.
+            - For each row, extract:
+                • Date (in DD.MM.YYYY format)
+                • From, To
+                • Purpose (exact text)
+                • Mode of Travel: normalize to one of the following values:
+                - "2-Wheeler"
+                - "4-Wheeler"
+                - "Cab" (for entries mentioning cab, ola, uber, auto, or taxi)
+                - "Food & Misc." (see below)
+                • Distance (in Km): extract numeric only, or zero
+                • Amount (in Rs.): extract numeric only
+
+            Special case:
+            - For any row related to food or miscellaneous expenses:
+                • Set **From**, **To**, and **Mode of Travel** to `"Food & Misc."`
+                • Set **Distance (in Km)** to `"0"`
+                • Purpose should remain as-is
+
+            3. Validation:
+            - Sum all extracted "Amount (in Rs.)" values.
+            - If a Total Amount is present in the header, compare it to the computed sum.
+            - If the header total is missing, simply use the computed sum as the total.
+
+            Return ONLY a single JSON object — no markdown, no explanation, no comments:
+
+            {
+            "header": {
+                "Employee ID": "string",
+                "Name of Employee": "string",
+                "Designation": "string",
+                "Location": "string",
+                "From Date": "DD.MM.YYYY",
+                "To Date": "DD.MM.YYYY",
+                "Total Amount": "string",
+                "Calculated Total": "string",
+                "total_mismatch": true/false
+            },
+            "expenses": [
+                {
+                "Date": "DD.MM.YYYY",
+                "From": "string",
+                "To": "string",
+                "Purpose": "string",
+                "Mode of Travel": "string",
+                "Distance (in Km)": "string",
+                "Amount (in Rs.)": "string"
+                }
+            ]
+            }
+            """
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Block until `amount` tokens are available, then take them."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """Give back (positive) or take extra (negative) tokens after the real cost is known."""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for model calls. A limit of 0 disables it."""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, estimated_tokens):
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens:
+            self.tokens.acquire(estimated_tokens)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        if self.tokens and actual_tokens:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+
+def is_retryable(error):
+    """429s, 5xx responses, timeouts and connection errors are worth retrying."""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, openai.APIConnectionError)
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, if it sent a Retry-After header."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_extraction_content(content):
+    """Parse the model's text output into the header/expenses dict, or None if unusable."""
+    # Clean the response (remove markdown code blocks if present)
+    if content.strip().startswith('```'):
+        # Handle both ```json and ``` cases
+        if content.strip().startswith('```json'):
+            content = content.split('```json')[1].split('```')[0].strip()
+        else:
+            content = content.split('```')[1].strip()
+
+    if not content:
+        logger.error("Empty response from OpenAI API")
+        return None
+
+    try:
+        # Try to parse the JSON
+        data = json.loads(content)
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse response as JSON: {e}. Raw response: {content}")
+        return None
+
+    # Validate the response structure
+    if not isinstance(data, dict) or 'header' not in data or 'expenses' not in data:
+        logger.error(f"Invalid response format. Missing required fields. Content: {content}")
+        return None
+
+    # Postprocess: If Total Amount is '0' or empty, replace with sum of expenses
+    header = data.get('header', {})
+    expenses = data.get('expenses', [])
+    total_amount = header.get('Total Amount', '').strip()
+    # Compute sum of all extracted expense amounts
+    try:
+        sum_expenses = sum(float(e.get('Amount (in Rs.)', '0').replace(',', '').strip()) for e in expenses)
+    except Exception as e:
+        logger.error(f"Error calculating sum of expenses: {e}")
+        sum_expenses = 0
+
+    if not total_amount or total_amount == '0':
+        header['Total Amount'] = str(int(sum_expenses) if sum_expenses == int(sum_expenses) else sum_expenses)
+    # Always update Calculated Total to backend sum for consistency
+    header['Calculated Total'] = str(int(sum_expenses) if sum_expenses == int(sum_expenses) else sum_expenses)
+    # Update mismatch flag
+    try:
+        total_amount_val = float(header['Total Amount'])
+        calculated_total_val = float(header['Calculated Total'])
+        header['total_mismatch'] = abs(total_amount_val - calculated_total_val) > 0.01
+    except Exception as e:
+        logger.warning(f"Could not compare totals for mismatch: {e}")
+        header['total_mismatch'] = False
+
+    logger.info(f"Successfully parsed data from OpenAI: {json.dumps(data, indent=2)}")
+    return data
+
+
+def parse_amount(value):
+    """Float from an extracted amount such as 'Rs. 1,011 only', or None if it has no number."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    cleaned = re.sub(r'[^\d.]', '', str(value or ''))
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def extraction_fields(data):
+    """
+    Normalized form columns from an extraction result (dict or stored JSON text): extracted_name,
+    header_total, calculated_total, total_mismatch, extraction_model and extraction_ms.
+    Missing or unparseable values come back as None.
+    """
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            data = None
+    if not isinstance(data, dict):
+        data = {}
+    header = data.get('header') if isinstance(data.get('header'), dict) else {}
+    meta = data.get('extraction') if isinstance(data.get('extraction'), dict) else {}
+    mismatch = header.get('total_mismatch')
+    if isinstance(mismatch, str):
+        mismatch = mismatch.strip().lower() == 'true'
+    return {
+        'extracted_name': header.get('Name of Employee') or None,
+        'header_total': parse_amount(header.get('Total Amount')),
+        'calculated_total': parse_amount(header.get('Calculated Total')),
+        'total_mismatch': bool(mismatch) if mismatch is not None else None,
+        'extraction_model': meta.get('model'),
+        'extraction_ms': meta.get('latency_ms'),
+    }
+
+
+class ExtractionEngine:
+    """
+    Runs form extractions against the OpenAI API with bounded parallelism.
+
+    At most `max_concurrency` extractions are in flight at once (shared by every
+    caller thread), model calls go through a requests/tokens-per-minute limiter,
+    and 429/5xx/connection errors are retried with exponential backoff and jitter.
+    The client should be created with max_retries=0 so retries aren't doubled.
+
+    With image_mode='inline' the image is downscaled, re-encoded in memory and sent
+    as a data URL in the model request. With image_mode='file' it is uploaded through
+    the Files API first and the remote file is deleted once the response arrives.
+    """
+
+    IMAGE_MODES = ('inline', 'file')
+
+    def __init__(self, client, model="gpt-4.1", max_concurrency=4, requests_per_minute=0,
+                 tokens_per_minute=0, tokens_per_request=4000, max_retries=5,
+                 backoff_base=1.0, backoff_max=60.0, image_mode='inline',
+                 image_format='jpeg', image_max_side=2048, image_quality=85):
+        if image_mode not in self.IMAGE_MODES:
+            raise ValueError(f"image_mode must be one of {self.IMAGE_MODES}, got {image_mode!r}")
+        self.client = client
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.tokens_per_request = tokens_per_request
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.image_mode = image_mode
+        self.image_format = image_format
+        self.image_max_side = image_max_side
+        self.image_quality = image_quality
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _with_retries(self, description, call):
+        attempt = 0
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                attempt += 1
+                logger.warning(f"{description} failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _encode(self, image):
+        """Encode an image array (or load one from a path) as downscaled JPEG/WebP bytes."""
+        if not isinstance(image, np.ndarray):
+            path = str(image)
+            image = cv2.imread(path)
+            if image is None:
+                raise ValueError(f"Could not load image at {path}")
+        return encode_image(image, fmt=self.image_format, max_side=self.image_max_side,
+                            quality=self.image_quality)
+
+    def _upload(self, image):
+        if isinstance(image, np.ndarray):
+            payload, mime_type = self._encode(image)
+            ext = {'image/webp': '.webp', 'image/png': '.png'}.get(mime_type, '.jpg')
+            return self.client.files.create(file=(f"form{ext}", payload, mime_type), purpose="user_data")
+        with open(image, 'rb') as f:
+            return self.client.files.create(file=f, purpose="user_data")
+
+    def _delete_file(self, file_id):
+        try:
+            self._with_retries("File delete", lambda: self.client.files.delete(file_id))
+        except Exception as e:
+            logger.warning(f"Could not delete uploaded file {file_id}: {e}")
+
+    def _respond(self, image_part):
+        self.limiter.acquire(self.tokens_per_request)
+        response = self.client.responses.create(
+            model=self.model,
+            input=[
+                {
+                    "role": "user",
+                    "content": [
+                        image_part,
+                        {"type": "input_text", "text": EXTRACTION_PROMPT}
+                    ]
+                }
+            ]
+        )
+        usage = getattr(response, 'usage', None)
+        self.limiter.settle(self.tokens_per_request, getattr(usage, 'total_tokens', None))
+        return response
+
+    def extract(self, image):
+        """
+        Extract header and expenses from one preprocessed image, given as a BGR array
+        or a file path. Returns None if the model output is unusable. The result's
+        'extraction' dict records the model and the latency of the API calls.
+        """
+        with self._slots:
+            started = time.monotonic()
+            try:
+                if self.image_mode == 'inline':
+                    payload, mime_type = self._encode(image)
+                    data_url = f"data:{mime_type};base64,{base64.b64encode(payload).decode('ascii')}"
+                    image_part = {"type": "input_image", "image_url": data_url}
+                    response = self._with_retries("Extraction", lambda: self._respond(image_part))
+                else:
+                    # Upload the image
+                    file = self._with_retries("File upload", lambda: self._upload(image))
+                    try:
+                        # Call the model with the required input format
+                        image_part = {"type": "input_image", "file_id": file.id}
+                        response = self._with_retries("Extraction", lambda: self._respond(image_part))
+                    finally:
+                        self._delete_file(file.id)
+            except Exception as e:
+                logger.error(f"OpenAI API error: {str(e)}", exc_info=True)
+                raise
+        # Extract the content from the response
+        latency_ms = int((time.monotonic() - started) * 1000)
+        content = response.output[0].content[0].text
+        data = parse_extraction_content(content)
+        if data is not None:
+            data['extraction'] = {'model': getattr(response, 'model', None) or self.model, 'latency_ms': latency_ms}
+        return data
+
+    def extract_batch(self, images):
+        """
+        Extract several images (arrays or paths) concurrently.
+
+        Returns a list aligned with `images` of {'index', 'data', 'error'} dicts;
+        one failing image does not affect the others.
+        """
+        def run(item):
+            index, image = item
+            try:
+                return {'index': index, 'data': self.extract(image), 'error': None}
+            except Exception as e:
+                return {'index': index, 'data': None, 'error': e}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='extract') as pool:
+            return list(pool.map(run, enumerate(images)))
@@ -1,7 +1,15 @@
+import logging
+import multiprocessing
+import os
+import threading
 import cv2
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 def order_points(pts):
     """Order points in top-left, top-right, bottom-right, bottom-left order."""
     rect = np.zeros((4, 2), dtype="float32")
@@ -28,68 +36,473 @@ def four_point_transform(image, pts):
     warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
     return warped
 
-def clean_document_effect(image: np.ndarray, block_size: int = 35, c: int = 10) -> np.ndarray:
+OUTPUT_MODES = ('color', 'gray', 'binary')
+THRESHOLD_METHODS = ('mean', 'integral')
+
+def integral_threshold(gray: np.ndarray, block_size: int = 35, c: int = 10, out: np.ndarray = None) -> np.ndarray:
+    """
+    Adaptive-mean threshold computed from an integral image (summed-area table).
+
+    Each pixel is compared with the mean of the block_size x block_size window
+    around it (windows are clipped at the borders), so the cost per pixel is four
+    lookups regardless of block size. Returns 255 for paper and 0 for ink.
+    """
+    h, w = gray.shape
+    half = block_size // 2
+    integral = cv2.integral(gray, sdepth=cv2.CV_32S)
+    rows = np.arange(h)
+    cols = np.arange(w)
+    y0 = np.clip(rows - half, 0, h)
+    y1 = np.clip(rows + half + 1, 0, h)
+    x0 = np.clip(cols - half, 0, w)
+    x1 = np.clip(cols + half + 1, 0, w)
+    # Row differences first, then column differences: two passes of whole-row/column gathers
+    row_sums = integral[y1] - integral[y0]
+    window_sum = row_sums[:, x1] - row_sums[:, x0]
+    # Compare gray * area > sum - c * area to stay in integers
+    area = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    paper = gray.astype(np.int32) * area > window_sum - c * area
+    if out is None:
+        out = np.empty((h, w), dtype=np.uint8)
+    np.multiply(paper, 255, out=out, casting='unsafe')
+    return out
+
+def clean_document_effect(image: np.ndarray, block_size: int = 35, c: int = 10, out: np.ndarray = None,
+                          output_mode: str = 'color', threshold: str = 'mean') -> np.ndarray:
     """
     1. Convert to gray and blur a little.
     2. Adaptive‐mean threshold to separate paper vs. ink.
     3. Whiten all 'paper' pixels in the original color image.
+
+    `out` may be a preallocated buffer (or a view into a larger canvas, or `image`
+    itself) that receives the result, avoiding a full-frame copy. output_mode 'gray'
+    whitens a grayscale image instead and 'binary' returns the threshold mask itself;
+    both give single-channel output. threshold='integral' uses integral_threshold().
     """
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"output_mode must be one of {OUTPUT_MODES}, got {output_mode!r}")
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     blur = cv2.GaussianBlur(gray, (3, 3), 0)
-    thresh = cv2.adaptiveThreshold(
-        blur, 255,
-        cv2.ADAPTIVE_THRESH_MEAN_C,
-        cv2.THRESH_BINARY,
-        block_size,
-        c
-    )
-    out = image.copy()
-    paper_mask = (thresh == 255)
-    out[paper_mask] = (255, 255, 255)
-    return out
+    if threshold == 'integral':
+        thresh = integral_threshold(blur, block_size, c, out=blur)
+    else:
+        thresh = cv2.adaptiveThreshold(
+            blur, 255,
+            cv2.ADAPTIVE_THRESH_MEAN_C,
+            cv2.THRESH_BINARY,
+            block_size,
+            c,
+            dst=blur
+        )
+    if output_mode == 'binary':
+        if out is None:
+            return thresh
+        np.copyto(out, thresh)
+        return out
+    # Paper pixels are 255 in the mask and ink is 0, so an element-wise max whitens
+    # exactly the paper pixels without building a boolean index
+    if output_mode == 'gray':
+        return np.maximum(gray, thresh, out=out if out is not None else gray)
+    if out is None:
+        out = np.empty_like(image)
+    return np.maximum(image, thresh[:, :, None], out=out)
 
-def autocrop_image(image_path, output_dir):
-    """Detect and crop both header and expenses tables from the image, then combine them."""
-    image = cv2.imread(image_path)
+ENCODE_FORMATS = {
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 'image/jpeg'),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 'image/webp'),
+    # Lossless; by far the smallest for binary output. Quality maps to compression level 0-9
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION, 'image/png'),
+}
+
+def encode_image(image: np.ndarray, fmt: str = 'jpeg', max_side: int = None, quality: int = 85):
+    """Downscale so the longest side is at most max_side, then encode in memory. Returns (bytes, mime type)."""
+    if fmt not in ENCODE_FORMATS:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    ext, quality_flag, mime_type = ENCODE_FORMATS[fmt]
+    if fmt == 'png':
+        quality = min(9, max(0, quality // 10))
+    h, w = image.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(ext, image, [quality_flag, quality])
+    if not ok:
+        raise ValueError(f"Could not encode image as {fmt}")
+    return buf.tobytes(), mime_type
+
+def decode_image(data) -> np.ndarray:
+    """Decode encoded image bytes (e.g. an upload read into memory) into a BGR array."""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
     if image is None:
-        raise ValueError(f"Could not load image at {image_path}")
+        raise ValueError("Could not decode image data")
+    return image
+
+# Longest side of the downscaled proxy used for contour detection (the resolution
+# the Canny/approxPolyDP thresholds were tuned on; smaller images are used as-is)
+DETECT_MAX_SIDE = 1600
+
+# Ordered detection strategies tried by detect_tables(); the first that finds a table wins
+DETECTION_TIERS = ('quad', 'fitted', 'hough', 'page')
+# Smallest region (fraction of the page) the fallback tiers accept as a table
+MIN_TABLE_AREA = 0.02
+# Plausibility checks for the 'fitted' tier, all relative so they hold at any detection size:
+# the contour must fill this much of its convex hull (a stray pen stroke has a large hull but
+# little area), the ordered quad must cover the hull within these bounds and span this fraction
+# of the page width (the form's tables run across the page; a table fragment doesn't), and the
+# crop must show at least this grey-level spread (a blank strip doesn't)
+MIN_FIT_SOLIDITY = 0.35
+FIT_HULL_RATIO = (0.75, 1.5)
+MIN_FIT_WIDTH = 0.6
+MIN_FIT_CONTRAST = 10.0
+
+def _detection_proxy(image: np.ndarray, detect_max_side: int = DETECT_MAX_SIDE):
+    """Grayscale copy of the image downscaled to at most detect_max_side, and the scale used."""
+    # Convert first so the resize only touches one channel
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    scale = 1.0
+    if detect_max_side and max(h, w) > detect_max_side:
+        scale = detect_max_side / max(h, w)
+        gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    return gray, scale
+
+def _find_edges_and_contours(gray: np.ndarray):
     blurred = cv2.GaussianBlur(gray, (5, 5), 0)
     edged = cv2.Canny(blurred, 75, 200)
-    contours, _ = cv2.findContours(edged.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not contours:
-        raise ValueError("No contours found in the image")
-    contours = sorted(contours, key=cv2.contourArea, reverse=True)[:2]
-    table_images = []
-    table_positions = []
+    contours, _ = cv2.findContours(edged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return edged, sorted(contours, key=cv2.contourArea, reverse=True)[:2]
+
+def _quad_tables(contours, scale):
+    """Tier 1: both of the two largest contours simplify to exactly four corners."""
+    tables = []
     for contour in contours:
         epsilon = 0.02 * cv2.arcLength(contour, True)
         approx = cv2.approxPolyDP(contour, epsilon, True)
-        if len(approx) == 4:
-            warped = four_point_transform(image, approx.reshape(4, 2))
-            x, y, w, h = cv2.boundingRect(contour)
-            table_images.append(warped)
-            table_positions.append(y)
-        else:
+        if len(approx) != 4:
             raise ValueError("Could not detect a quadrilateral (4 corners) for a table")
+        x, y, cw, ch = cv2.boundingRect(contour)
+        tables.append((approx.reshape(4, 2).astype("float32") / scale, y / scale))
+    return tables
+
+def _plausible_fit(contour, hull, corners, gray):
+    """Whether a fitted quad outlines a table rather than a stray stroke or a degenerate fit."""
+    hull_area = cv2.contourArea(hull)
+    if cv2.contourArea(contour) < MIN_FIT_SOLIDITY * hull_area:
+        return False
+    quad_area = cv2.contourArea(order_points(corners))
+    if not FIT_HULL_RATIO[0] * hull_area <= quad_area <= FIT_HULL_RATIO[1] * hull_area:
+        return False
+    if corners[:, 0].max() - corners[:, 0].min() < MIN_FIT_WIDTH * gray.shape[1]:
+        return False
+    crop = four_point_transform(gray, corners)
+    return crop.size > 0 and float(crop.std()) >= MIN_FIT_CONTRAST
+
+def _fitted_tables(contours, scale, gray):
+    """
+    Tier 2: fit four corners to large contours via their convex hull, else a rotated bounding box.
+    Like the quad tier, every one of the two largest contours must give a table: if one is too
+    small or fails _plausible_fit(), the tier finds nothing and the chain falls through, rather
+    than returning a single table or a fragment.
+    """
+    page_area = gray.shape[0] * gray.shape[1]
+    tables = []
+    for contour in contours:
+        hull = cv2.convexHull(contour)
+        if cv2.contourArea(hull) < MIN_TABLE_AREA * page_area:
+            return []
+        corners = None
+        perimeter = cv2.arcLength(hull, True)
+        for factor in (0.02, 0.04, 0.06, 0.08):
+            approx = cv2.approxPolyDP(hull, factor * perimeter, True)
+            if len(approx) == 4:
+                corners = approx.reshape(4, 2).astype("float32")
+                break
+        if corners is None:
+            corners = cv2.boxPoints(cv2.minAreaRect(hull)).astype("float32")
+        if not _plausible_fit(contour, hull, corners, gray):
+            return []
+        tables.append((corners / scale, float(corners[:, 1].min()) / scale))
+    return tables
+
+def _hough_tables(edged, scale):
+    """
+    Tier 3: ruled tables from long horizontal lines. Lines are grouped into tables
+    wherever the vertical gap between neighbours is large; the two largest groups win.
+    """
+    h, w = edged.shape
+    lines = cv2.HoughLinesP(edged, 1, np.pi / 180, threshold=80, minLineLength=int(w * 0.4), maxLineGap=10)
+    if lines is None:
+        return []
+    horizontal = sorted(
+        (min(y1, y2), min(x1, x2), max(x1, x2))
+        for x1, y1, x2, y2 in lines.reshape(-1, 4)
+        if abs(y2 - y1) <= 0.02 * abs(x2 - x1)
+    )
+    groups = []
+    for line in horizontal:
+        if groups and line[0] - groups[-1][-1][0] <= h * 0.15:
+            groups[-1].append(line)
+        else:
+            groups.append([line])
+    boxes = []
+    for group in groups:
+        top, bottom = group[0][0], group[-1][0]
+        left, right = min(l[1] for l in group), max(l[2] for l in group)
+        if len(group) >= 2 and (bottom - top) * (right - left) >= MIN_TABLE_AREA * h * w:
+            boxes.append((left, top, right, bottom))
+    boxes = sorted(boxes, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]), reverse=True)[:2]
+    return [
+        (np.array([[l, t], [r, t], [r, b], [l, b]], dtype="float32") / scale, t / scale)
+        for l, t, r, b in boxes
+    ]
+
+def detect_tables(image: np.ndarray, detect_max_side: int = DETECT_MAX_SIDE):
+    """
+    Locate the tables with a cheap ordered fallback chain (see DETECTION_TIERS):
+    exact quadrilaterals, then hull/minAreaRect fitting, then Hough-line table
+    detection, then the whole page. Never fails on a readable image.
+    Returns (list of (corners, top_y) in full-resolution coordinates, tier name).
+    """
+    gray, scale = _detection_proxy(image, detect_max_side)
+    edged, contours = _find_edges_and_contours(gray)
+    if contours:
+        try:
+            return _quad_tables(contours, scale), 'quad'
+        except ValueError:
+            pass
+        tables = _fitted_tables(contours, scale, gray)
+        if tables:
+            return tables, 'fitted'
+    tables = _hough_tables(edged, scale)
+    if tables:
+        return tables, 'hough'
+    h, w = image.shape[:2]
+    page = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype="float32")
+    return [(page, 0.0)], 'page'
+
+def find_table_quads(image: np.ndarray, detect_max_side: int = DETECT_MAX_SIDE):
+    """
+    Find the corner points of the two largest tables.
+
+    Edge and contour detection run on a proxy downscaled so its longest side is at
+    most detect_max_side (None = full resolution); the corners are scaled back to
+    full-resolution coordinates. Returns a list of (corners, top_y) tuples.
+    Strict: raises ValueError unless both tables are clean quadrilaterals.
+    """
+    gray, scale = _detection_proxy(image, detect_max_side)
+    _, contours = _find_edges_and_contours(gray)
+    if not contours:
+        raise ValueError("No contours found in the image")
+    return _quad_tables(contours, scale)
+
+def autocrop_array(image: np.ndarray, detect_max_side: int = DETECT_MAX_SIDE, output_mode: str = 'color',
+                   threshold: str = 'mean', return_tier: bool = False):
+    """
+    Detect, crop, enhance and combine the tables of an in-memory BGR image.
+    output_mode 'gray'/'binary' produce a single-channel image (smaller payload for the model).
+    With return_tier=True, returns (image, tier) where tier is the detect_tables() strategy used.
+    """
+    table_images = []
+    table_positions = []
+    tables, tier = detect_tables(image, detect_max_side)
+    for corners, y in tables:
+        # Warp the full-resolution original once per table
+        table_images.append(four_point_transform(image, corners))
+        table_positions.append(y)
     combined = [img for _, img in sorted(zip(table_positions, table_images), key=lambda x: x[0])]
-    widths = [img.shape[1] for img in combined]
-    max_width = max(widths)
-    resized_tables = [cv2.resize(img, (max_width, int(img.shape[0] * max_width / img.shape[1]))) for img in combined]
-    enhanced_tables = []
-    border_color = (0, 128, 255)
-    for img in resized_tables:
-        enhanced = clean_document_effect(img)
-        bordered = cv2.copyMakeBorder(
-            enhanced,
-            top=8, bottom=8, left=8, right=8,
-            borderType=cv2.BORDER_CONSTANT,
-            value=border_color
-        )
-        enhanced_tables.append(bordered)
-    gap_height = 30
-    white_gap = np.full((gap_height, enhanced_tables[0].shape[1], 3), (255, 255, 255), dtype=np.uint8)
-    final_image = cv2.vconcat([enhanced_tables[0], white_gap, enhanced_tables[1]])
+    final_image = compose_tables(combined, output_mode=output_mode, threshold=threshold)
+    if return_tier:
+        return final_image, tier
+    return final_image
+
+def compose_tables(tables, output_mode: str = 'color', threshold: str = 'mean', border: int = 8,
+                   gap_height: int = 30, border_color=(0, 128, 255)) -> np.ndarray:
+    """
+    Scale the tables to a common width, enhance them and stack them top to bottom
+    with a border around each and a white gap between them.
+
+    The final canvas is allocated once; each table is resized and enhanced straight
+    into its slot, so no per-table bordered copies or concatenation are needed.
+    """
+    max_width = max(img.shape[1] for img in tables)
+    heights = [int(img.shape[0] * max_width / img.shape[1]) for img in tables]
+    total_height = sum(heights) + 2 * border * len(tables) + gap_height * (len(tables) - 1)
+    width = max_width + 2 * border
+    if output_mode == 'color':
+        canvas = np.empty((total_height, width, 3), dtype=np.uint8)
+        fill = border_color
+    else:
+        canvas = np.empty((total_height, width), dtype=np.uint8)
+        fill = 0 if output_mode == 'binary' else int(cv2.cvtColor(np.uint8([[border_color]]), cv2.COLOR_BGR2GRAY)[0, 0])
+    canvas[:] = fill
+    y = 0
+    for i, (img, height) in enumerate(zip(tables, heights)):
+        slot = canvas[y + border:y + border + height, border:border + max_width]
+        if output_mode == 'color':
+            # Resize (or copy) into the slot, then enhance in place
+            if img.shape[1] == max_width and img.shape[0] == height:
+                np.copyto(slot, img)
+            else:
+                cv2.resize(img, (max_width, height), dst=slot)
+            clean_document_effect(slot, out=slot, threshold=threshold)
+        else:
+            if img.shape[1] != max_width or img.shape[0] != height:
+                img = cv2.resize(img, (max_width, height))
+            clean_document_effect(img, out=slot, output_mode=output_mode, threshold=threshold)
+        y += height + 2 * border
+        if i < len(tables) - 1:
+            canvas[y:y + gap_height] = 255
+            y += gap_height
+    return canvas
+
+def autocrop_image(image_path, output_dir, return_image=False):
+    """
+    Detect and crop both header and expenses tables from the image, then combine them.
+    With return_image=True, returns (output_path, combined_array) so callers can reuse the pixels.
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not load image at {image_path}")
+    final_image = autocrop_array(image)
     output_path = output_dir / f"combined_{Path(image_path).name}"
     cv2.imwrite(str(output_path), final_image)
+    if return_image:
+        return output_path, final_image
     return output_path
+
+def _init_preprocess_worker():
+    # One OpenCV thread per worker process; the pool itself provides the parallelism
+    cv2.setNumThreads(1)
+
+def preprocess_one(source, **options):
+    """
+    Load one image from a path or encoded bytes and run autocrop_array(image, **options) on it.
+    Never raises: returns {'image': array or None, 'tier': detection tier or None, 'error': message or None}.
+    """
+    try:
+        if isinstance(source, (str, Path)):
+            image = cv2.imread(str(source))
+            if image is None:
+                raise ValueError(f"Could not load image at {source}")
+        else:
+            image = decode_image(source)
+        final_image, tier = autocrop_array(image, return_tier=True, **options)
+        return {'image': final_image, 'tier': tier, 'error': None}
+    except Exception as e:
+        return {'image': None, 'tier': None, 'error': str(e)}
+
+def _pool_context():
+    # Workers never inherit the parent's threads, locks or open connections the way fork does
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+class PreprocessPool:
+    """
+    Process pool for preprocess_batch that survives its workers dying.
+
+    When a worker process exits abruptly (segfault in a native decoder, OOM kill, os._exit)
+    the underlying ProcessPoolExecutor is broken for good and every pending call on it fails
+    with BrokenProcessPool. run() then replaces the executor and retries the calls lost with
+    it one at a time on the fresh pool, so only the call that crashed a worker fails and
+    later batches get working processes again. Safe to share between threads.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context(),
+                                                     initializer=_init_preprocess_worker)
+            return self._executor
+
+    def _replace(self, broken):
+        # Several threads may see the same broken executor; only the first one replaces it
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+                logger.warning("Preprocessing worker process died; starting a new process pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, executor, fn, *args, **kwargs):
+        try:
+            return executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            return None
+
+    def run(self, fn, items, **kwargs):
+        """
+        Call fn(item, **kwargs) for each item on the pool. Returns a list aligned with `items`
+        of return values, or of the exception an item's call raised.
+        """
+        executor = self._current()
+        futures = [self._submit(executor, fn, item, **kwargs) for item in items]
+        results = [None] * len(items)
+        lost = []
+        for index, future in enumerate(futures):
+            try:
+                if future is None:
+                    raise BrokenProcessPool('process pool was already broken')
+                results[index] = future.result()
+            except BrokenProcessPool:
+                lost.append(index)
+            except Exception as e:
+                results[index] = e
+        if lost:
+            self._replace(executor)
+        for index in lost:
+            # Alone on a fresh pool, a call that breaks it again is the one killing workers. It
+            # gets a second try in case another thread's call broke the shared pool meanwhile.
+            for attempt in range(2):
+                executor = self._current()
+                future = self._submit(executor, fn, items[index], **kwargs)
+                try:
+                    if future is None:
+                        raise BrokenProcessPool('process pool was already broken')
+                    results[index] = future.result()
+                    break
+                except BrokenProcessPool as e:
+                    self._replace(executor)
+                    results[index] = e
+                except Exception as e:
+                    results[index] = e
+                    break
+        return results
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+def create_preprocess_executor(workers=None):
+    """PreprocessPool for preprocess_batch; reuse it across batches to avoid start-up cost."""
+    return PreprocessPool(workers)
+
+def preprocess_batch(sources, workers=None, executor=None, **options):
+    """
+    Autocrop a batch of images (paths or encoded bytes) across a process pool.
+
+    Returns a list aligned with `sources` of {'index', 'image', 'tier', 'error'} dicts. A bad
+    image fails only its own entry; so does one that crashes its worker process, since the
+    PreprocessPool replaces the broken pool and retries the other entries (see PreprocessPool).
+    Pass a long-lived `executor` from create_preprocess_executor() to reuse worker processes.
+    Extra keyword options are passed on to autocrop_array.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = create_preprocess_executor(workers)
+    try:
+        results = []
+        for index, result in enumerate(executor.run(preprocess_one, sources, **options)):
+            if isinstance(result, Exception):
+                result = {'image': None, 'tier': None, 'error': f"Preprocessing worker failed: {result}"}
+            result['index'] = index
+            results.append(result)
+        return results
+    finally:
+        if own_executor:
+            executor.shutdown()
@@ -0,0 +1,106 @@
+import logging
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from response_cache import form_tags
+from search import deferred_reindex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INGEST_BATCH_SIZE = 50
+
+
+class FormIngestor:
+    """
+    Stores validated forms and their expense entries in bulk.
+
+    write() takes prepared items, each {'form': column values, 'entries': [column values],
+    'source': name for messages} or {'form_id': id} for a form that already exists, and
+    stores them in transactions of `batch_size` forms. Forms are inserted one by one (their
+    ids are needed for the entries) and each form's entries with one executemany INSERT.
+    Every form runs in its own SAVEPOINT, so a failing form is rolled back and reported
+    without losing the rest of its batch. Rollups are refreshed once per batch, and the
+    response cache (if given) is invalidated for the batch's months after it commits.
+    With `search` (the FTS5 index exists), each form's search document is built once after
+    its entries are inserted rather than once per entry.
+
+    Entries bypass the ORM, so model validators don't run: callers supply derived columns
+    such as mode_normalized themselves.
+    """
+
+    def __init__(self, db, form_model, entry_model, reports, batch_size=DEFAULT_INGEST_BATCH_SIZE, cache=None,
+                 search=False):
+        self.db = db
+        self.form_model = form_model
+        self.entry_model = entry_model
+        self.reports = reports
+        self.batch_size = max(1, batch_size)
+        self.cache = cache
+        self.search = search
+
+    def write(self, items):
+        """Store items; returns a list aligned with items of (form_id, error message or None)."""
+        results = []
+        for start in range(0, len(items), self.batch_size):
+            results.extend(self._write_batch(items[start:start + self.batch_size]))
+        return results
+
+    def _begin(self):
+        """
+        Open the SQLite transaction before the first SAVEPOINT.
+
+        pysqlite only issues BEGIN ahead of DML, so a SAVEPOINT on an idle connection would
+        start a transaction of its own and its RELEASE would commit the forms so far.
+        IMMEDIATE takes the write lock up front instead of upgrading a read lock later.
+        """
+        connection = self.db.session.connection()
+        if not connection.connection.driver_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    def _write_batch(self, items):
+        session = self.db.session
+        results = []
+        rollup_keys = []
+        try:
+            self._begin()
+            for item in items:
+                if item.get('form_id'):
+                    results.append((item['form_id'], None))
+                    continue
+                result = self._write_form(item)
+                results.append(result)
+                form_id, error = result
+                to_date = item['form'].get('to_date')
+                if error is None and to_date is not None:
+                    rollup_keys.append((to_date.year, to_date.month,
+                                        item['form'].get('employee_id') or f'form_{form_id}'))
+            self.reports.refresh_rollups(rollup_keys)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        new_ids = [form_id for item, (form_id, error) in zip(items, results) if not item.get('form_id') and error is None]
+        failed = sum(1 for _, error in results if error)
+        if new_ids and self.cache is not None:
+            self.cache.invalidate(*form_tags(rollup_keys, new_ids))
+        logger.info(f"Stored {len(new_ids)} new form(s) in one transaction ({failed} failed)")
+        return results
+
+    def _write_form(self, item):
+        session = self.db.session
+        source = item.get('source') or 'form'
+        try:
+            with session.begin_nested():
+                form_id = session.execute(insert(self.form_model).values(**item['form'])).inserted_primary_key[0]
+                entries = [dict(entry, form_id=form_id) for entry in item['entries']]
+                if entries:
+                    with deferred_reindex(session, form_id, self.search):
+                        session.execute(insert(self.entry_model), entries)
+        except IntegrityError as e:
+            logger.error(f"Integrity error storing {source}: {e}")
+            return None, f"Employee ID {item['form'].get('employee_id', '')} does not exist for {source}"
+        except SQLAlchemyError as e:
+            logger.error(f"Error storing {source}: {e}")
+            return None, f"Error processing {source}: {e}"
+        return form_id, None
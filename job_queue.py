@@ -0,0 +1,194 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Task and job states shared with the ProcessingJob/ProcessingTask models
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+COMPLETED = 'completed'
+
+
+class TaskError(Exception):
+    """Raised by a task handler when a file cannot be processed; the message is shown to the user."""
+
+
+class JobQueue:
+    """
+    Persistent background queue for upload processing.
+
+    Jobs and tasks live in the ProcessingJob/ProcessingTask tables so a restart
+    can pick up unfinished work via recover(). Each task is executed on a local
+    thread pool inside its own app context by `handler(task, payload)`, which must
+    return the created form id or raise TaskError. `payload` is the in-memory data
+    handed to submit() for that task, or None when it has to be reloaded (recovery).
+
+    With a `writer`, handlers return a value to store instead, and the queue collects
+    them and calls `writer(values)` with up to `batch_size` at a time (sooner when no
+    other task is in flight). The writer returns (form_id, error message or None) per
+    value; tasks stay running until their value has been written.
+    """
+
+    def __init__(self, app, db, job_model, task_model, handler, max_workers=4, eager=False,
+                 writer=None, batch_size=50):
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.task_model = task_model
+        self.handler = handler
+        self.max_workers = max_workers
+        self.eager = eager
+        self._executor = None
+        self.writer = writer
+        self.batch_size = max(1, batch_size)
+        self._payloads = {}
+        self._pending_writes = []
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='job-worker')
+            return self._executor
+
+    def submit(self, job_id, payloads=None):
+        """Queue every pending task of a job, optionally with in-memory payloads keyed by task id."""
+        task_ids = [t.id for t in self.task_model.query.filter_by(job_id=job_id, status=QUEUED).all()]
+        with self._lock:
+            for task_id, payload in (payloads or {}).items():
+                if task_id in task_ids:
+                    self._payloads[task_id] = payload
+            self._in_flight += len(task_ids)
+        for task_id in task_ids:
+            if self.eager:
+                self._run_task(task_id)
+            else:
+                self._get_executor().submit(self._run_task, task_id)
+        return task_ids
+
+    def recover(self):
+        """Re-queue tasks left queued or running by a previous process."""
+        stale = self.task_model.query.filter(self.task_model.status.in_([QUEUED, RUNNING])).all()
+        job_ids = set()
+        for task in stale:
+            task.status = QUEUED
+            job_ids.add(task.job_id)
+        self.db.session.commit()
+        for job_id in job_ids:
+            self.submit(job_id)
+        if job_ids:
+            logger.info(f"Recovered {len(stale)} pending task(s) across {len(job_ids)} job(s)")
+        return len(stale)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def _run_task(self, task_id):
+        try:
+            self._process_task(task_id)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                batch = self._take_writes()
+            if batch:
+                self._write(batch)
+
+    def _process_task(self, task_id):
+        with self._lock:
+            payload = self._payloads.pop(task_id, None)
+        with self.app.app_context():
+            task = self.db.session.get(self.task_model, task_id)
+            if task is None or task.status not in (QUEUED, RUNNING):
+                return
+            task.status = RUNNING
+            task.started_at = datetime.now(timezone.utc)
+            self._touch_job(task.job_id, RUNNING)
+            self.db.session.commit()
+            try:
+                result = self.handler(task, payload)
+                if self.writer is not None:
+                    self.db.session.commit()
+                    with self._lock:
+                        self._pending_writes.append((task_id, result))
+                    return
+                form_id = result
+                task = self.db.session.get(self.task_model, task_id)
+                task.status = DONE
+                task.form_id = form_id
+                task.message = None
+            except TaskError as e:
+                self.db.session.rollback()
+                task = self.db.session.get(self.task_model, task_id)
+                task.status = FAILED
+                task.message = str(e)
+            except Exception as e:
+                self.db.session.rollback()
+                logger.error(f"Unexpected error in task {task_id}: {e}", exc_info=True)
+                task = self.db.session.get(self.task_model, task_id)
+                task.status = FAILED
+                task.message = f"Unexpected error: {e}"
+            task.finished_at = datetime.now(timezone.utc)
+            self.db.session.flush()
+            self._finish_job_if_done(task.job_id)
+            self.db.session.commit()
+
+    def _take_writes(self):
+        """Pending writer values to store now (call with the lock held), or None to keep collecting."""
+        if not self._pending_writes:
+            return None
+        if len(self._pending_writes) < self.batch_size and self._in_flight > 0:
+            return None
+        batch, self._pending_writes = self._pending_writes, []
+        return batch
+
+    def _write(self, batch):
+        """Store a batch of handler results through the writer and finish their tasks."""
+        with self.app.app_context():
+            try:
+                results = self.writer([result for _, result in batch])
+            except Exception as e:
+                self.db.session.rollback()
+                logger.error(f"Unexpected error storing {len(batch)} form(s): {e}", exc_info=True)
+                results = [(None, f"Unexpected error: {e}")] * len(batch)
+            job_ids = set()
+            for (task_id, _), (form_id, error) in zip(batch, results):
+                task = self.db.session.get(self.task_model, task_id)
+                if task is None:
+                    continue
+                task.status = FAILED if error else DONE
+                task.form_id = form_id
+                task.message = error
+                task.finished_at = datetime.now(timezone.utc)
+                job_ids.add(task.job_id)
+            self.db.session.flush()
+            for job_id in job_ids:
+                self._finish_job_if_done(job_id)
+            self.db.session.commit()
+
+    def _touch_job(self, job_id, status):
+        job = self.db.session.get(self.job_model, job_id)
+        if job is not None and job.status == QUEUED:
+            job.status = status
+
+    def _finish_job_if_done(self, job_id):
+        pending = self.task_model.query.filter(
+            self.task_model.job_id == job_id,
+            self.task_model.status.in_([QUEUED, RUNNING])
+        ).count()
+        if pending:
+            return
+        job = self.db.session.get(self.job_model, job_id)
+        if job is None:
+            return
+        failed = self.task_model.query.filter_by(job_id=job_id, status=FAILED).count()
+        job.status = FAILED if failed == job.total_files else COMPLETED
+        job.finished_at = datetime.now(timezone.utc)
@@ -0,0 +1,135 @@
+import csv
+import io
+import tempfile
+
+from sqlalchemy import case, func, select
+
+from reports import LOCAL_CONVEYANCE_MODES
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional
+    pa = None
+    pq = None
+
+LEDGER_FORMATS = ('csv', 'parquet')
+# Rows fetched from the cursor per round trip, and rows per CSV chunk / Parquet row group
+LEDGER_BATCH_SIZE = 2000
+
+# (column name, pyarrow type name) in output order
+LEDGER_COLUMNS = [
+    ('form_id', 'int64'),
+    ('employee_id', 'string'),
+    ('employee_name', 'string'),
+    ('designation', 'string'),
+    ('location', 'string'),
+    ('form_from_date', 'date32'),
+    ('form_to_date', 'date32'),
+    ('entry_id', 'int64'),
+    ('date', 'date32'),
+    ('from_location', 'string'),
+    ('to_location', 'string'),
+    ('purpose', 'string'),
+    ('mode_of_travel', 'string'),
+    ('category', 'string'),
+    ('distance_km', 'float64'),
+    ('amount_rs', 'float64'),
+]
+
+
+def parquet_available():
+    return pq is not None
+
+
+def ledger_statement(form_model, entry_model, employee_model, start=None, end=None, employee_ids=None):
+    """
+    Every expense entry joined to its form and employee, for forms with start <= to_date <= end.
+
+    Ordered by form to_date, form and entry so exports are stable and ranges follow the
+    (to_date) index.
+    """
+    Form, Entry, Employee = form_model, entry_model, employee_model
+    category = case(
+        (Entry.mode_normalized.in_(LOCAL_CONVEYANCE_MODES), 'local_conveyance'),
+        else_='exp_reimbursement'
+    )
+    stmt = select(
+        Form.id.label('form_id'),
+        Form.employee_id,
+        func.coalesce(func.nullif(Employee.name, ''), Form.extracted_name).label('employee_name'),
+        Form.designation,
+        Form.location,
+        Form.from_date.label('form_from_date'),
+        Form.to_date.label('form_to_date'),
+        Entry.id.label('entry_id'),
+        Entry.date,
+        Entry.from_location,
+        Entry.to_location,
+        Entry.purpose,
+        Entry.mode_of_travel,
+        category.label('category'),
+        Entry.distance_km,
+        Entry.amount_rs
+    ).select_from(Entry).join(
+        Form, Form.id == Entry.form_id
+    ).outerjoin(
+        Employee, Employee.employee_id == Form.employee_id
+    )
+    if start:
+        stmt = stmt.where(Form.to_date >= start)
+    if end:
+        stmt = stmt.where(Form.to_date <= end)
+    if employee_ids:
+        stmt = stmt.where(Form.employee_id.in_(employee_ids))
+    return stmt.order_by(Form.to_date, Form.id, Entry.date, Entry.id)
+
+
+def iter_ledger_batches(session, stmt, batch_size=LEDGER_BATCH_SIZE):
+    """Stream result rows in lists of batch_size without loading the whole range."""
+    result = session.execute(stmt.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield partition
+
+
+def csv_chunks(batches):
+    """Encoded CSV (with a UTF-8 BOM so Excel picks the encoding) one batch at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([name for name, _ in LEDGER_COLUMNS])
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def parquet_schema():
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in LEDGER_COLUMNS])
+
+
+def write_parquet(batches):
+    """
+    Write batches as Parquet row groups to an anonymous temp file and return it rewound.
+
+    Only one batch is held in memory at a time; the footer needs the whole file, so the
+    result is sent after writing rather than streamed while rows are read.
+    """
+    if pq is None:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    schema = parquet_schema()
+    names = [name for name, _ in LEDGER_COLUMNS]
+    output = tempfile.TemporaryFile(suffix='.parquet')
+    try:
+        with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+            for batch in batches:
+                columns = list(zip(*batch))
+                writer.write_table(pa.table(dict(zip(names, columns)), schema=schema))
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output
@@ -0,0 +1,128 @@
+import json
+import logging
+
+from sqlalchemy import inspect, text
+
+from extraction import extraction_fields
+from reports import normalize_mode
+from search import create_search_index, recreate_entry_triggers
+from upload_gc import create_upload_refs
+
+logger = logging.getLogger(__name__)
+
+# Schema migrations for existing databases, applied in order by run_migrations().
+# db.create_all() builds new databases with the current models, so every step must
+# be idempotent (skip columns/indexes that already exist) and safe to re-run.
+
+
+def column_names(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def add_column(conn, table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    if column not in column_names(conn, table):
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+        logger.info(f"Added column {table}.{column}")
+
+
+def create_index(conn, name, table, columns):
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+def extracted_header(raw_data):
+    """The 'header' dict from a stored extraction result, or {} if it can't be parsed."""
+    try:
+        data = json.loads(raw_data) if raw_data else {}
+        return data.get('header', {}) or {}
+    except (TypeError, ValueError, AttributeError):
+        return {}
+
+
+def add_extracted_name(conn):
+    """Store the extracted employee name in its own column so listings don't parse raw_data."""
+    add_column(conn, 'reimbursement_form', 'extracted_name', 'VARCHAR(200)')
+    rows = conn.execute(text(
+        'SELECT id, raw_data FROM reimbursement_form WHERE extracted_name IS NULL AND raw_data IS NOT NULL'
+    )).fetchall()
+    updates = [
+        {'id': row.id, 'name': extracted_header(row.raw_data).get('Name of Employee')}
+        for row in rows
+    ]
+    updates = [u for u in updates if u['name']]
+    if updates:
+        conn.execute(text('UPDATE reimbursement_form SET extracted_name = :name WHERE id = :id'), updates)
+        logger.info(f"Backfilled extracted_name for {len(updates)} form(s)")
+
+
+def add_mode_normalized(conn):
+    """Store normalize_mode(mode_of_travel) so summaries can classify entries in SQL."""
+    add_column(conn, 'expense_entry', 'mode_normalized', 'VARCHAR(50)')
+    create_index(conn, 'ix_expense_entry_mode_normalized', 'expense_entry', 'mode_normalized')
+    rows = conn.execute(text('SELECT id, mode_of_travel FROM expense_entry WHERE mode_normalized IS NULL')).fetchall()
+    updates = [{'id': row.id, 'mode': normalize_mode(row.mode_of_travel)} for row in rows]
+    if updates:
+        conn.execute(text('UPDATE expense_entry SET mode_normalized = :mode WHERE id = :id'), updates)
+        logger.info(f"Backfilled mode_normalized for {len(updates)} expense entries")
+
+
+def add_date_indexes(conn):
+    """Indexes backing the to_date month ranges, recent-form listings and per-form entry lookups."""
+    create_index(conn, 'ix_reimbursement_form_to_date', 'reimbursement_form', 'to_date')
+    create_index(conn, 'ix_reimbursement_form_employee_id_to_date', 'reimbursement_form', 'employee_id, to_date')
+    create_index(conn, 'ix_reimbursement_form_created_at', 'reimbursement_form', 'created_at')
+    create_index(conn, 'ix_expense_entry_form_id_date', 'expense_entry', 'form_id, date')
+
+
+def add_search_index(conn):
+    """FTS5 index over names, locations and purposes, kept current by triggers (see search.py)."""
+    create_search_index(conn)
+
+
+def add_extraction_columns(conn):
+    """Normalize the rest of the extraction result (totals, mismatch flag, model, latency) into columns."""
+    for column, ddl in (('header_total', 'FLOAT'), ('calculated_total', 'FLOAT'), ('total_mismatch', 'BOOLEAN'),
+                        ('extraction_model', 'VARCHAR(100)'), ('extraction_ms', 'INTEGER')):
+        add_column(conn, 'reimbursement_form', column, ddl)
+    rows = conn.execute(text('SELECT id, raw_data FROM reimbursement_form WHERE raw_data IS NOT NULL')).fetchall()
+    updates = [{'id': row.id, **extraction_fields(row.raw_data)} for row in rows]
+    if updates:
+        conn.execute(text(
+            'UPDATE reimbursement_form SET extracted_name = coalesce(extracted_name, :extracted_name), '
+            'header_total = :header_total, calculated_total = :calculated_total, total_mismatch = :total_mismatch, '
+            'extraction_model = :extraction_model, extraction_ms = :extraction_ms WHERE id = :id'
+        ), updates)
+        logger.info(f"Backfilled extraction columns for {len(updates)} form(s)")
+
+
+def add_upload_refs(conn):
+    """Per-image reference counts, kept by triggers, for deleting images of deleted forms (see upload_gc.py)."""
+    create_upload_refs(conn)
+
+
+def defer_entry_reindex(conn):
+    """Entry triggers that skip forms whose entries are written in bulk (see search.deferred_reindex)."""
+    recreate_entry_triggers(conn)
+
+
+MIGRATIONS = [
+    (1, add_extracted_name),
+    (2, add_mode_normalized),
+    (3, add_date_indexes),
+    (4, add_search_index),
+    (5, add_extraction_columns),
+    (6, add_upload_refs),
+    (7, defer_entry_reindex),
+]
+
+
+def run_migrations(engine):
+    """Apply migrations newer than the database's PRAGMA user_version."""
+    with engine.begin() as conn:
+        version = conn.execute(text('PRAGMA user_version')).scalar() or 0
+        for number, migration in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info(f"Applying migration {number}: {migration.__name__}")
+            migration(conn)
+            conn.execute(text(f'PRAGMA user_version = {number}'))
@@ -0,0 +1,224 @@
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import String, case, cast, func, literal, or_
+
+logger = logging.getLogger(__name__)
+
+# Normalized ExpenseEntry.mode_normalized values paid out as local conveyance;
+# every other mode (food & misc., train, bus, ...) counts as expense reimbursement.
+LOCAL_CONVEYANCE_MODES = ('2wheeler', '4wheeler', 'cab')
+
+
+def normalize_mode(mode):
+    """Canonical form of a mode of travel: '2-Wheeler ' -> '2wheeler', 'Food & Misc.' -> 'foodandmisc.'"""
+    return (mode or '').strip().lower().replace('-', '').replace('&', 'and').replace(' ', '')
+
+
+def month_range(year, month):
+    """Half-open [start, end) date range covering a calendar month."""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def to_date_value(value):
+    """Aggregates over Date columns come back as ISO strings on SQLite; normalize to date."""
+    if value is None or isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+class ReportService:
+    """
+    Set-based aggregations over forms and expense entries.
+
+    Monthly totals are materialized per employee in the rollup table and kept current
+    by refresh_rollups() on every form write; reports read those rows instead of
+    regrouping expense entries. Callers get plain dicts back.
+    """
+
+    def __init__(self, db, form_model, entry_model, employee_model, rollup_model):
+        self.db = db
+        self.form_model = form_model
+        self.entry_model = entry_model
+        self.employee_model = employee_model
+        self.rollup_model = rollup_model
+
+    def month_filter(self, year, month):
+        """Filter forms ending in the month as a range on to_date, so the to_date indexes apply."""
+        Form = self.form_model
+        start, end = month_range(year, month)
+        return (Form.to_date >= start, Form.to_date < end)
+
+    def recent_months(self, limit=6):
+        """
+        Most recent (year, month) pairs that have forms, newest first (all of them if limit is None).
+
+        Walks backwards with one MAX(to_date) probe per month, each answered from the
+        to_date index, instead of grouping the whole table by strftime().
+        """
+        Form = self.form_model
+        months = []
+        before = None
+        while limit is None or len(months) < limit:
+            query = self.db.session.query(func.max(Form.to_date))
+            if before is not None:
+                query = query.filter(Form.to_date < before)
+            latest = to_date_value(query.scalar())
+            if latest is None:
+                break
+            months.append((latest.year, latest.month))
+            before = date(latest.year, latest.month, 1)
+        return months
+
+    def group_key(self):
+        """SQL for a form's summary row: its employee ID, or 'form_<id>' when it has none."""
+        Form = self.form_model
+        return func.coalesce(func.nullif(Form.employee_id, ''), literal('form_', String) + cast(Form.id, String))
+
+    @staticmethod
+    def rollup_key(form):
+        """(year, month, group_key) of the rollup row a form counts towards, or None without a to_date."""
+        if form is None or form.to_date is None:
+            return None
+        return (form.to_date.year, form.to_date.month, form.employee_id or f'form_{form.id}')
+
+    def aggregate_month(self, year, month, group_keys=None):
+        """
+        Totals per group key for forms ending in the month, computed from expense entries.
+
+        With group_keys, only those rows are computed; the forms are narrowed through the
+        (employee_id, to_date) index and primary key before grouping.
+        """
+        Form, Entry = self.form_model, self.entry_model
+        group_key = self.group_key()
+        amount = func.coalesce(Entry.amount_rs, 0)
+        is_local = Entry.mode_normalized.in_(LOCAL_CONVEYANCE_MODES)
+
+        query = self.db.session.query(
+            group_key.label('group_key'),
+            func.max(Form.employee_id).label('employee_id'),
+            func.max(Form.extracted_name).label('extracted_name'),
+            func.max(Form.location).label('location'),
+            func.coalesce(func.sum(case((is_local, 0), else_=amount)), 0).label('exp_reimbursement'),
+            func.coalesce(func.sum(case((is_local, amount), else_=0)), 0).label('local_conveyance'),
+            func.count(Form.id.distinct()).label('form_count')
+        ).select_from(Form).outerjoin(
+            Entry, Entry.form_id == Form.id
+        ).filter(
+            *self.month_filter(year, month)
+        )
+        if group_keys is not None:
+            form_ids = [int(key[5:]) for key in group_keys if key.startswith('form_') and key[5:].isdigit()]
+            query = query.filter(
+                or_(Form.employee_id.in_(group_keys), Form.id.in_(form_ids)),
+                group_key.in_(group_keys)
+            )
+        return query.group_by(group_key).all()
+
+    def _insert_rollups(self, year, month, rows):
+        self.db.session.add_all([
+            self.rollup_model(
+                year=year, month=month, group_key=row.group_key, employee_id=row.employee_id or None,
+                extracted_name=row.extracted_name, location=row.location,
+                local_conveyance=row.local_conveyance, exp_reimbursement=row.exp_reimbursement,
+                form_count=row.form_count
+            )
+            for row in rows
+        ])
+        return len(rows)
+
+    def refresh_rollups(self, keys):
+        """
+        Recompute the rollup rows for the given rollup_key()s inside the caller's transaction.
+
+        Call after the form changes are made (they are autoflushed first, so the transaction
+        already holds SQLite's write lock and concurrent refreshes of a row serialize) and
+        before commit. Pass both the old and new key when an edit can move a form.
+        """
+        Rollup = self.rollup_model
+        by_month = {}
+        for key in keys:
+            if key is not None:
+                by_month.setdefault(key[:2], set()).add(key[2])
+        for (year, month), group_keys in by_month.items():
+            group_keys = sorted(group_keys)
+            rows = self.aggregate_month(year, month, group_keys)
+            Rollup.query.filter(
+                Rollup.year == year, Rollup.month == month, Rollup.group_key.in_(group_keys)
+            ).delete(synchronize_session=False)
+            self._insert_rollups(year, month, rows)
+
+    def rebuild_rollups(self):
+        """Recompute every rollup row from scratch (backfill/repair). Returns the row count; caller commits."""
+        self.rollup_model.query.delete(synchronize_session=False)
+        count = 0
+        for year, month in self.recent_months(limit=None):
+            count += self._insert_rollups(year, month, self.aggregate_month(year, month))
+        return count
+
+    def rollups_missing(self):
+        """True when forms exist but the rollup table is empty (new table on an existing database)."""
+        return (self.db.session.query(self.rollup_model.id).first() is None
+                and self.db.session.query(self.form_model.id).first() is not None)
+
+    def monthly_employee_summary(self, year, month):
+        """
+        Per-employee local conveyance and expense reimbursement for forms ending in the month.
+
+        Reads the rollup rows for the month joined to Employee for name and bank details, so
+        the cost depends on the number of employees, not forms or entries. Forms without an
+        employee ID are reported on their own row. Rows are sorted by name, falling back to
+        employee ID.
+        """
+        Rollup, Employee = self.rollup_model, self.employee_model
+        rows = self.db.session.query(
+            Rollup,
+            func.coalesce(func.nullif(Employee.name, ''), Rollup.extracted_name, '').label('name'),
+            Employee.bank_name,
+            Employee.account_number,
+            Employee.ifsc_code
+        ).outerjoin(
+            Employee, Employee.employee_id == Rollup.employee_id
+        ).filter(
+            Rollup.year == year, Rollup.month == month
+        ).all()
+
+        summary = [
+            {
+                'employee_id': rollup.employee_id or '',
+                'name': name,
+                'location': rollup.location or '',
+                'exp_reimbursement': rollup.exp_reimbursement,
+                'local_conveyance': rollup.local_conveyance,
+                'total_payable': rollup.exp_reimbursement + rollup.local_conveyance,
+                'bank_name': bank_name or '',
+                'account_number': account_number or '',
+                'ifsc_code': ifsc_code or ''
+            }
+            for rollup, name, bank_name, account_number, ifsc_code in rows
+        ]
+        summary.sort(key=lambda x: x['name'].lower() if x['name'] else x['employee_id'])
+        return summary
+
+    def month_totals(self, year, month):
+        """Dashboard card: amount, forms and registered employees for the month, from the rollup."""
+        Rollup, Employee = self.rollup_model, self.employee_model
+        return self.db.session.query(
+            func.sum(Rollup.local_conveyance + Rollup.exp_reimbursement).label('total_amount'),
+            func.sum(Rollup.form_count).label('form_count'),
+            func.count(Employee.id).label('employee_count')
+        ).select_from(Rollup).join(
+            Employee, Employee.employee_id == Rollup.employee_id
+        ).filter(
+            Rollup.year == year, Rollup.month == month
+        ).first()
+
+    @staticmethod
+    def summary_totals(summary):
+        return {
+            'reimbursement': sum(item['exp_reimbursement'] for item in summary),
+            'local': sum(item['local_conveyance'] for item in summary),
+            'grand_total': sum(item['total_payable'] for item in summary)
+        }
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+
+from flask import Response, request
+from werkzeug.http import is_resource_modified
+
+try:
+    import redis
+except ImportError:  # only needed for RESPONSE_CACHE=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_BACKENDS = ('memory', 'redis', 'off')
+DEFAULT_CACHE_TTL = 60  # seconds
+DEFAULT_CACHE_SIZE = 512  # entries kept by the in-process cache
+
+# Invalidation tags: what a cached value was built from
+FORMS = 'forms'  # form rows, counts and listings
+EMPLOYEES = 'employees'  # names and bank details shown with forms and summaries
+ALL = '*'  # every entry; invalidated by clear()
+
+
+def summary_tag(year, month):
+    return f'summary:{year}-{month:02d}'
+
+
+def form_tag(form_id):
+    return f'form:{form_id}'
+
+
+def form_tags(rollup_keys, form_ids=()):
+    """
+    Tags to invalidate once forms change: the listings, the summary month of each rollup_key()
+    and the forms themselves (their detail pages).
+    """
+    return ([FORMS] + sorted({summary_tag(key[0], key[1]) for key in rollup_keys if key is not None})
+            + [form_tag(form_id) for form_id in form_ids])
+
+
+def _encode_default(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Cannot cache {type(value).__name__} values")
+
+
+def _decode_hook(obj):
+    if len(obj) == 1 and '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if len(obj) == 1 and '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def encode(value):
+    """JSON for a cached value; dates and datetimes survive the round trip (templates call strftime on them)."""
+    return json.dumps(value, default=_encode_default, sort_keys=True, separators=(',', ':'))
+
+
+def decode(data):
+    return json.loads(data, object_hook=_decode_hook)
+
+
+class CacheEntry:
+    """A cached value with its validators and the tag versions it was computed under."""
+
+    def __init__(self, value, versions, etag=None, created=None):
+        self.value = value
+        self.versions = versions
+        self.etag = etag or hashlib.sha1(encode(value).encode()).hexdigest()
+        self.created = created or time.time()
+
+    @property
+    def last_modified(self):
+        """When the data last changed: the latest invalidation of its tags, or when it was cached."""
+        return datetime.fromtimestamp(max(self.versions.values(), default=0) or self.created, timezone.utc)
+
+    def to_json(self):
+        return encode({'value': self.value, 'versions': self.versions, 'etag': self.etag, 'created': self.created})
+
+    @classmethod
+    def from_json(cls, data):
+        fields = decode(data)
+        return cls(fields['value'], fields['versions'], fields['etag'], fields['created'])
+
+
+class ResponseCache:
+    """
+    TTL/LRU cache for the data behind hot pages and JSON APIs, invalidated by tag.
+
+    Each entry records the versions of its tags at the time it was computed; invalidate()
+    moves a tag's version on, so every entry built from it stops matching. Versions are read
+    before the value is computed, so a write that commits meanwhile still invalidates it.
+    Call invalidate() after the write commits.
+
+    Entries live in this process (LRU, at most max_entries) or, given a redis client, in
+    Redis so that all workers share entries and invalidations. Values must be JSON-able
+    (dates allowed) and are shared between requests: don't modify them.
+    """
+
+    def __init__(self, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_SIZE, client=None, enabled=True,
+                 prefix='cache:'):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.client = client
+        self.enabled = enabled
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires at, CacheEntry)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get_or_set(self, key, tags, compute):
+        """The entry for key, calling compute() for its value on a miss. tags name what it was built from."""
+        tags = sorted(set(tags) | {ALL})
+        if not self.enabled:
+            return CacheEntry(compute(), {})
+        try:
+            versions, entry = self._lookup(key, tags)
+        except Exception as e:  # a shared cache being down shouldn't take pages down with it
+            logger.warning(f"Response cache lookup failed for {key}: {e}")
+            return CacheEntry(compute(), {})
+        if entry is not None and entry.versions == versions:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = CacheEntry(compute(), versions)
+        try:
+            self._store(key, entry)
+        except Exception as e:
+            logger.warning(f"Response cache store failed for {key}: {e}")
+        return entry
+
+    def invalidate(self, *tags):
+        """Drop every entry built from any of tags."""
+        version = time.time()
+        if self.client is not None:
+            try:
+                self.client.mset({self._tag_key(tag): repr(version) for tag in tags})
+            except Exception as e:
+                logger.error(f"Response cache invalidation of {', '.join(tags)} failed: {e}")
+            return
+        with self._lock:
+            for tag in tags:
+                # Strictly increasing even if the clock hasn't moved since the last invalidation
+                self._versions[tag] = max(version, self._versions.get(tag, 0) + 1e-6)
+
+    def clear(self):
+        self.invalidate(ALL)
+        with self._lock:
+            self._entries.clear()
+
+    def _tag_key(self, tag):
+        return f'{self.prefix}tag:{tag}'
+
+    def _lookup(self, key, tags):
+        """(current versions of tags, cached entry or None)."""
+        if self.client is not None:
+            values = self.client.mget([self.prefix + key] + [self._tag_key(tag) for tag in tags])
+            versions = {tag: float(value) if value else 0 for tag, value in zip(tags, values[1:])}
+            return versions, CacheEntry.from_json(values[0]) if values[0] else None
+        with self._lock:
+            versions = {tag: self._versions.get(tag, 0) for tag in tags}
+            item = self._entries.get(key)
+            if item is None:
+                return versions, None
+            if item[0] <= time.monotonic():
+                del self._entries[key]
+                return versions, None
+            self._entries.move_to_end(key)
+            return versions, item[1]
+
+    def _store(self, key, entry):
+        if self.client is not None:
+            self.client.set(self.prefix + key, entry.to_json(), ex=max(1, int(self.ttl)))
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def create_response_cache(backend='memory', redis_url=None, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_SIZE):
+    """A ResponseCache for RESPONSE_CACHE=memory, redis or off."""
+    if backend not in RESPONSE_CACHE_BACKENDS:
+        raise ValueError(f"Unknown RESPONSE_CACHE {backend!r}; expected one of {', '.join(RESPONSE_CACHE_BACKENDS)}")
+    client = None
+    if backend == 'redis':
+        if redis is None:
+            raise RuntimeError("RESPONSE_CACHE=redis requires the redis package (pip install redis)")
+        client = redis.Redis.from_url(redis_url or 'redis://localhost:6379/0')
+    logger.info(f"Response cache: {backend} (ttl {ttl}s)")
+    return ResponseCache(ttl=ttl, max_entries=max_entries, client=client, enabled=backend != 'off')
+
+
+def add_validators(response, etag, last_modified):
+    """ETag and Last-Modified on response; clients may keep it but must revalidate before reuse."""
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified):
+    """A 304 when the request's If-None-Match / If-Modified-Since still match, else None."""
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return add_validators(Response(status=304), etag, last_modified)
@@ -0,0 +1,184 @@
+import logging
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import Float, Integer, literal_column, text
+
+from pagination import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# One FTS5 document per reimbursement form (rowid = form id), rebuilt by triggers whenever
+# the form, its expense entries or its employee change.
+SEARCH_TABLE = 'form_search'
+SEARCH_COLUMNS = ('employee_id', 'name', 'designation', 'location', 'purposes', 'routes')
+# Forms whose expense entries are being written in bulk (see deferred_reindex): the entry
+# triggers skip them, and removing the row rebuilds the form's document once
+DEFERRED_TABLE = 'form_search_deferred'
+# bm25() weights in SEARCH_COLUMNS order: who the form is for ranks above what it's about
+SEARCH_WEIGHTS = (10.0, 10.0, 3.0, 4.0, 2.0, 2.0)
+
+
+def fts5_available(conn):
+    return bool(conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+
+def _insert_documents_sql(where):
+    """INSERT ... SELECT that indexes the forms matched by `where` (an SQL condition on f)."""
+    return f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)})
+        SELECT f.id,
+               coalesce(f.employee_id, ''),
+               trim(coalesce(e.name, '') || ' ' || coalesce(f.extracted_name, '')),
+               coalesce(f.designation, ''),
+               coalesce(f.location, ''),
+               coalesce((SELECT group_concat(x.purpose, ' ') FROM expense_entry x WHERE x.form_id = f.id), ''),
+               coalesce((SELECT group_concat(coalesce(x.from_location, '') || ' ' || coalesce(x.to_location, ''), ' ')
+                         FROM expense_entry x WHERE x.form_id = f.id), '')
+        FROM reimbursement_form f LEFT JOIN employee e ON e.employee_id = f.employee_id
+        WHERE {where};"""
+
+
+def _reindex_form_sql(form_id):
+    return f"DELETE FROM {SEARCH_TABLE} WHERE rowid = {form_id}; " + _insert_documents_sql(f"f.id = {form_id}")
+
+
+def _reindex_employee_sql(employee_id):
+    return (
+        f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN "
+        f"(SELECT id FROM reimbursement_form WHERE employee_id = {employee_id}); "
+        + _insert_documents_sql(f"f.employee_id = {employee_id}")
+    )
+
+
+def _not_deferred(form_id):
+    return f"NOT EXISTS (SELECT 1 FROM {DEFERRED_TABLE} WHERE form_id = {form_id})"
+
+
+# Triggers whose definition changed since they were first created; recreated by migrations
+ENTRY_TRIGGERS = ('form_search_entry_ai', 'form_search_entry_au', 'form_search_entry_ad')
+
+
+def _triggers():
+    """Trigger name -> body; each rewrites the documents of the forms its row belongs to."""
+    return {
+        'form_search_form_ai': f"AFTER INSERT ON reimbursement_form BEGIN {_reindex_form_sql('NEW.id')} END",
+        'form_search_form_au': f"AFTER UPDATE OF id, employee_id, extracted_name, designation, location "
+                               f"ON reimbursement_form BEGIN "
+                               f"DELETE FROM {SEARCH_TABLE} WHERE rowid = OLD.id; {_reindex_form_sql('NEW.id')} END",
+        'form_search_form_ad': f"AFTER DELETE ON reimbursement_form BEGIN "
+                               f"DELETE FROM {SEARCH_TABLE} WHERE rowid = OLD.id; END",
+        'form_search_entry_ai': f"AFTER INSERT ON expense_entry WHEN {_not_deferred('NEW.form_id')} "
+                                f"BEGIN {_reindex_form_sql('NEW.form_id')} END",
+        'form_search_entry_au': f"AFTER UPDATE OF form_id, purpose, from_location, to_location ON expense_entry "
+                                f"WHEN {_not_deferred('OLD.form_id')} OR {_not_deferred('NEW.form_id')} "
+                                f"BEGIN {_reindex_form_sql('OLD.form_id')} {_reindex_form_sql('NEW.form_id')} END",
+        'form_search_entry_ad': f"AFTER DELETE ON expense_entry WHEN {_not_deferred('OLD.form_id')} "
+                                f"BEGIN {_reindex_form_sql('OLD.form_id')} END",
+        'form_search_deferred_ad': f"AFTER DELETE ON {DEFERRED_TABLE} BEGIN {_reindex_form_sql('OLD.form_id')} END",
+        'form_search_employee_ai': f"AFTER INSERT ON employee BEGIN {_reindex_employee_sql('NEW.employee_id')} END",
+        'form_search_employee_au': f"AFTER UPDATE OF employee_id, name ON employee BEGIN "
+                                   f"{_reindex_employee_sql('OLD.employee_id')} "
+                                   f"{_reindex_employee_sql('NEW.employee_id')} END",
+        'form_search_employee_ad': f"AFTER DELETE ON employee BEGIN {_reindex_employee_sql('OLD.employee_id')} END",
+    }
+
+
+def create_search_index(conn):
+    """Create the FTS5 table and its triggers if missing, and index every existing form."""
+    if not fts5_available(conn):
+        logger.warning("SQLite was built without FTS5; full-text search is disabled")
+        return False
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': SEARCH_TABLE}
+    ).scalar()
+    if not exists:
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            f"{', '.join(SEARCH_COLUMNS)}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        ))
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFERRED_TABLE} (form_id INTEGER PRIMARY KEY)"))
+    for name, body in _triggers().items():
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+    if not exists:
+        conn.execute(text(_insert_documents_sql('1')))
+        logger.info(f"Built full-text index {SEARCH_TABLE}")
+    return True
+
+
+def recreate_entry_triggers(conn):
+    """Replace the expense entry triggers of an existing index with the current definitions."""
+    if not search_available(conn):
+        return
+    for name in ENTRY_TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    create_search_index(conn)
+
+
+@contextmanager
+def deferred_reindex(session, form_id, enabled=True):
+    """
+    Rebuild form_id's search document once, when the block ends, instead of once per expense
+    entry inserted, updated or deleted in it (each rebuild reads all of the form's entries, so
+    writing N entries row by row costs O(N^2)). Use inside the transaction doing the writes;
+    a no-op when enabled is false (no FTS5).
+    """
+    if not enabled:
+        yield
+        return
+    session.execute(text(f"INSERT OR IGNORE INTO {DEFERRED_TABLE} (form_id) VALUES (:form_id)"), {'form_id': form_id})
+    yield
+    session.execute(text(f"DELETE FROM {DEFERRED_TABLE} WHERE form_id = :form_id"), {'form_id': form_id})
+
+
+def search_available(session):
+    return bool(session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': SEARCH_TABLE}
+    ).scalar())
+
+
+def fts_query(q):
+    """
+    Turn free text into a safe FTS5 query: every word must match, as a prefix.
+
+    'Gift city cab' -> '"gift"* "city"* "cab"*'. Returns None when q has no searchable words.
+    """
+    words = re.findall(r'\w+', q or '', flags=re.UNICODE)
+    if not words:
+        return None
+    return ' '.join(f'"{word.lower()}"*' for word in words)
+
+
+def matching_form_ids(q):
+    """SQL selecting the ids of forms matching q, for use in an IN filter (q must come from fts_query())."""
+    return text(
+        f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :search_q"
+    ).bindparams(search_q=q).columns(rowid=Integer)
+
+
+def search_forms(session, q, limit, cursor=None):
+    """
+    Forms matching q, best first: a list of (form_id, score, snippet) and the next cursor.
+
+    Ranked by weighted bm25 (lower is better) with the form id as tie-breaker, and paged
+    with the same (value, id) keyset cursors as the form listings.
+    """
+    score = f"bm25({SEARCH_TABLE}, {', '.join(str(w) for w in SEARCH_WEIGHTS)})"
+    params = {'q': q, 'limit': limit + 1}
+    seek = ''
+    if cursor:
+        last_score, last_id = decode_cursor(cursor, 'rank', 'asc', literal_column('score', Float))
+        seek = f"AND ({score} > :last_score OR ({score} = :last_score AND rowid > :last_id))"
+        params.update(last_score=last_score, last_id=last_id)
+    rows = session.execute(text(
+        f"SELECT rowid AS form_id, {score} AS score, "
+        f"snippet({SEARCH_TABLE}, -1, '[', ']', '…', 12) AS snippet "
+        f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :q {seek} "
+        f"ORDER BY score, rowid LIMIT :limit"
+    ), params).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor('rank', 'asc', rows[-1].score, rows[-1].form_id)
+    return rows, next_cursor
@@ -0,0 +1,57 @@
+import logging
+import os
+
+from flask_session import Session
+
+try:
+    import redis
+except ImportError:  # only needed for SESSION_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# sqlite:     a `sessions` table in the app database (single node)
+# redis:      any Redis-protocol server at REDIS_URL (several workers or hosts)
+# cookie:     Flask's signed cookie; nothing stored server side
+# filesystem: the previous one-file-per-session store in flask_session/
+SESSION_BACKENDS = ('sqlite', 'redis', 'cookie', 'filesystem')
+DEFAULT_SESSION_BACKEND = 'sqlite'
+
+
+def configure_sessions(app, db, backend=DEFAULT_SESSION_BACKEND, redis_url=None):
+    """
+    Set up the session store for app. Returns the session interface in use.
+
+    Whatever the backend, a session is only written when it changed during the request
+    (SESSION_REFRESH_EACH_REQUEST is off), so read-only pages such as the dashboard and
+    /api/recent_forms never write. The session lifetime therefore runs from the last change
+    rather than the last request; sessions only carry the CSRF token and flash messages.
+    """
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown SESSION_BACKEND {backend!r}; expected one of {', '.join(SESSION_BACKENDS)}")
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+
+    if backend == 'cookie':
+        logger.info("Sessions: signed cookie")
+        return app.session_interface
+
+    if backend == 'sqlite':
+        app.config['SESSION_TYPE'] = 'sqlalchemy'
+        app.config['SESSION_SQLALCHEMY'] = db
+        app.config['SESSION_SQLALCHEMY_TABLE'] = 'sessions'
+        # Expired rows are deleted by `flask session_cleanup` (e.g. from cron) unless
+        # SESSION_CLEANUP_N_REQUESTS is set, in which case roughly every N requests.
+        cleanup = os.environ.get('SESSION_CLEANUP_N_REQUESTS')
+        app.config['SESSION_CLEANUP_N_REQUESTS'] = int(cleanup) if cleanup else None
+    elif backend == 'redis':
+        if redis is None:
+            raise RuntimeError("SESSION_BACKEND=redis requires the redis package (pip install redis)")
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.Redis.from_url(redis_url or 'redis://localhost:6379/0')
+    else:
+        app.config['SESSION_TYPE'] = 'filesystem'
+        os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
+
+    Session(app)
+    logger.info(f"Sessions: {backend} ({type(app.session_interface).__name__})")
+    return app.session_interface
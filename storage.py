@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import string
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:  # only needed for UPLOAD_BACKEND=s3
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+# local: files under UPLOAD_FOLDER (served as static files)
+# s3:    objects in an S3-compatible bucket (AWS, MinIO, ...), served through the app
+STORAGE_BACKENDS = ('local', 's3')
+DEFAULT_STORAGE_BACKEND = 'local'
+
+
+def atomic_write(path, data):
+    """Write bytes to path via a temp file + rename so readers never see a partial file."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def check_name(name):
+    """Upload names are plain file names; anything that could leave the upload store is rejected."""
+    if not name or name != os.path.basename(name) or '\\' in name or name.startswith('.'):
+        raise ValueError(f"Invalid upload name {name!r}")
+
+
+def upload_stem(name):
+    """The hash shared by an upload's files: '<hash>.jpg', 'combined_<hash>.jpg', 'combined_<hash>.thumb.webp'"""
+    stem = name.split('.', 1)[0]
+    return stem[len('combined_'):] if stem.startswith('combined_') else stem
+
+
+def shard_key(name):
+    """
+    'combined_ab12cd.jpg' -> 'ab/12/combined_ab12cd.jpg'. Names are content hashes (UUIDs for older
+    uploads), so two levels of 256 directories spread them evenly; an original, its combined image and
+    their renditions share a directory. Other names are sharded by a hash of their stem.
+    """
+    check_name(name)
+    stem = upload_stem(name).lower()
+    if len(stem) < 4 or any(c not in string.hexdigits for c in stem):
+        stem = hashlib.sha256(stem.encode()).hexdigest()
+    return f"{stem[:2]}/{stem[2:4]}/{name}"
+
+
+class LocalStorage:
+    """Uploads as files under root, sharded into subdirectories by shard_key()."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, *shard_key(name).split('/'))
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def get(self, name):
+        """The file's bytes, or None if it isn't stored."""
+        try:
+            with open(self.path(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, name, data):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, near=None):
+        """(name, modification time) of every stored file, or only those sharing a directory with `near`."""
+        if near is not None:
+            directories = [os.path.dirname(self.path(near))]
+        else:
+            directories = [os.path.join(self.root, a, b) for a in _subdirectories(self.root)
+                           for b in _subdirectories(os.path.join(self.root, a))]
+        for directory in directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        # Skip dotfiles and atomic_write() temp files still being written
+                        if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith('.tmp'):
+                            yield entry.name, entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+    def flat_files(self):
+        """Names of files stored directly in root, the layout before sharding (see migrate_flat())."""
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith('.tmp'):
+                    yield entry.name
+
+    def migrate_flat(self):
+        """Move files stored directly in root into their shards (`flask migrate-uploads`). Returns how many moved."""
+        moved = 0
+        for name in list(self.flat_files()):
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(os.path.join(self.root, name), path)
+            moved += 1
+        if moved:
+            logger.info(f"Moved {moved} upload(s) into sharded directories under {self.root}")
+        return moved
+
+
+def _subdirectories(path):
+    try:
+        with os.scandir(path) as entries:
+            return sorted(entry.name for entry in entries if entry.is_dir() and len(entry.name) == 2)
+    except FileNotFoundError:
+        return []
+
+
+class S3Storage:
+    """Uploads as objects in an S3-compatible bucket, keyed prefix + shard_key(name)."""
+
+    def __init__(self, bucket, prefix='uploads/', endpoint_url=None, region=None, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("UPLOAD_BACKEND=s3 requires the boto3 package (pip install boto3)")
+            # Self-hosted endpoints (MinIO etc.) rarely have per-bucket DNS names
+            config = Config(s3={'addressing_style': 'path'}) if endpoint_url else None
+            client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region, config=config)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def key(self, name):
+        return self.prefix + shard_key(name)
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def get(self, name):
+        """The object's bytes, or None if it isn't stored."""
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def put(self, name, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.key(name), Body=data,
+                               ContentType=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def list(self, near=None):
+        """(name, modification time) of every stored object, or only those sharing a shard with `near`."""
+        prefix = self.key(near).rsplit('/', 1)[0] + '/' if near is not None else self.prefix
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'].rsplit('/', 1)[-1], item['LastModified'].timestamp()
+
+
+def create_storage(backend=DEFAULT_STORAGE_BACKEND, folder='static/uploads', bucket=None, prefix='uploads/',
+                   endpoint_url=None, region=None):
+    """The upload store for UPLOAD_BACKEND=local or s3."""
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown UPLOAD_BACKEND {backend!r}; expected one of {', '.join(STORAGE_BACKENDS)}")
+    if backend == 's3':
+        if not bucket:
+            raise ValueError("UPLOAD_BACKEND=s3 requires S3_BUCKET")
+        logger.info(f"Upload storage: s3://{bucket}/{prefix}" + (f" at {endpoint_url}" if endpoint_url else ''))
+        return S3Storage(bucket, prefix, endpoint_url, region)
+    logger.info(f"Upload storage: {os.path.abspath(folder)}")
+    return LocalStorage(folder)
+
+
+class BackgroundWriter:
+    """
+    Writes uploads and derived images to an upload store off the request/processing path.
+
+    Callers keep working with the in-memory bytes/arrays; files show up in the store
+    shortly after. flush() waits for everything queued so far (tests, shutdown).
+    """
+
+    def __init__(self, store, max_workers=2):
+        self.store = store
+        self.max_workers = max_workers
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='storage-writer')
+            future = self._executor.submit(fn, *args)
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        if future.exception() is not None:
+            logger.error(f"Background write failed: {future.exception()}")
+
+    def write_bytes(self, name, data, overwrite=False):
+        """Queue raw bytes (e.g. an original upload) to be stored as name."""
+        def write():
+            if not overwrite and self.store.exists(name):
+                return
+            self.store.put(name, data)
+            logger.info(f"Stored {name} ({len(data)} bytes)")
+        return self._submit(write)
+
+    def write_image(self, name, image, params=None):
+        """Queue a BGR array to be encoded (format from the name's extension) and stored as name."""
+        def write():
+            ext = os.path.splitext(name)[1] or '.jpg'
+            ok, buf = cv2.imencode(ext, image, params or [])
+            if not ok:
+                raise ValueError(f"Could not encode image for {name}")
+            self.store.put(name, buf.tobytes())
+            logger.info(f"Stored {name}")
+        return self._submit(write)
+
+    def flush(self, timeout=None):
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.exception(timeout=timeout)
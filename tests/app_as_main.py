@@ -0,0 +1,36 @@
+"""
+Runs app.py as __main__, the way `python app.py` does, with Flask.run replaced by a probe that
+preprocesses an upload on the process pool and prints, as JSON, how many upload collector
+threads the server process and the pool's worker processes have.
+
+    python tests/app_as_main.py <image>
+"""
+import json
+import os
+import runpy
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def collector_threads(_=None):
+    return sum(thread.name == 'upload-gc' for thread in threading.enumerate())
+
+
+def probe(app, *args, **kwargs):
+    # While runpy executes app.py, __main__ is that module (workers re-import it as __mp_main__)
+    server = sys.modules['__main__']
+    with open(sys.argv[1], 'rb') as f:
+        _, tier = server.preprocess_upload(f.read())
+    workers = server._preprocess_executor.run(collector_threads, range(2 * app.config['PREPROCESS_WORKERS']))
+    server._preprocess_executor.shutdown()
+    print(json.dumps({'tier': tier, 'server': collector_threads(), 'workers': workers}))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, ROOT)
+    import flask
+    from app_as_main import collector_threads  # by module name, so workers can unpickle it
+    flask.Flask.run = probe
+    runpy.run_path(os.path.join(ROOT, 'app.py'), run_name='__main__')
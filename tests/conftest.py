@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def claimistry(tmp_path_factory):
+    """
+    The app module, imported once against a throwaway database and the fake OpenAI API. The working
+    directory moves to a temp directory first, since app.log and the upload folder are relative to it.
+    """
+    from benchmarks.fake_openai import start_server
+    server, base_url = start_server(latency=0.5)
+    workdir = tmp_path_factory.mktemp('claimistry')
+    os.chdir(workdir)
+    os.environ.update(DATABASE_PATH=str(workdir / 'app.db'), RESPONSE_CACHE='off', UPLOAD_GC_INTERVAL='0')
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+    os.environ['OPENAI_BASE_URL'] = base_url
+    import app
+    app.app.config['WTF_CSRF_ENABLED'] = False
+    yield app
+    app.job_queue.shutdown(wait=False)
+    server.shutdown()
@@ -0,0 +1,52 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from image_preprocess import _detection_proxy, _find_edges_and_contours, autocrop_array, detect_tables
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DETECT_SIDES = [None, 1000, 1200, 1600, 2000, 2400, 3000]
+
+
+def load(name, upscale=1):
+    image = cv2.imread(os.path.join(ROOT, 'test_images', name))
+    if upscale != 1:
+        image = cv2.resize(image, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+    return image
+
+
+@pytest.mark.parametrize('upscale', [1, 2.5])
+@pytest.mark.parametrize('detect_max_side', DETECT_SIDES)
+def test_stray_stroke_never_gives_partial_crop(detect_max_side, upscale):
+    # test5_handwritten.jpg: no clean table outlines, only pen strokes and table fragments
+    image = load('test5_handwritten.jpg', upscale)
+    tables, tier = detect_tables(image, detect_max_side)
+    assert tier in ('hough', 'page')
+    if tier == 'hough':
+        assert len(tables) == 2
+    else:
+        height, width = autocrop_array(image, detect_max_side).shape[:2]
+        assert height >= image.shape[0] and width >= image.shape[1]
+
+
+@pytest.mark.parametrize('name', ['test1.jpg', 'test2.jpg', 'test3.jpg', 'test4.jpg', 'test6_handwritten.jpg'])
+def test_clean_tables_use_quad_tier(name):
+    tables, tier = detect_tables(load(name))
+    assert tier == 'quad' and len(tables) == 2
+
+
+@pytest.mark.parametrize('name', ['test2.jpg', 'test3.jpg', 'test4.jpg'])
+def test_broken_border_uses_fitted_tier(name):
+    # A gap in the left border of both tables: no longer clean quadrilaterals, still both tables
+    image = load(name)
+    gray, scale = _detection_proxy(image)
+    _, contours = _find_edges_and_contours(gray)
+    for contour in contours:
+        x, y, w, h = (int(v / scale) for v in cv2.boundingRect(contour))
+        cv2.rectangle(image, (x - 15, y + h // 3), (x + 15, y + h // 3 + 40), (255, 255, 255), -1)
+    tables, tier = detect_tables(image)
+    assert tier == 'fitted' and len(tables) == 2
+    widths = [np.ptp(corners[:, 0]) for corners, _ in tables]
+    assert min(widths) > 0.6 * image.shape[1]
@@ -0,0 +1,34 @@
+import io
+import zipfile
+
+import openpyxl
+
+from excel_export import MONEY_FORMAT, cell, header_row, iter_workbook, new_workbook
+
+
+def test_workbook_streams_while_rows_are_generated():
+    wb = new_workbook()
+    ws = wb.create_sheet('Summary')
+    produced = []
+
+    def rows():
+        yield header_row(ws, ['Employee ID', 'Name', 'Amount'])
+        for i in range(20000):
+            produced.append(i)
+            yield [f'EMP{i:05d}', f'Employee {i}', cell(ws, i * 1.5, MONEY_FORMAT)]
+
+    chunks = []
+    rows_at_first_chunk = None
+    for chunk in iter_workbook(wb, rows(), chunk_size=16 * 1024):
+        if rows_at_first_chunk is None:
+            rows_at_first_chunk = len(produced)
+        chunks.append(chunk)
+    assert rows_at_first_chunk < 20000 // 2  # bytes went out long before the last row
+    data = b''.join(chunks)
+
+    assert zipfile.ZipFile(io.BytesIO(data)).testzip() is None
+    sheet = openpyxl.load_workbook(io.BytesIO(data)).active
+    assert sheet.title == 'Summary' and sheet.max_row == 20001
+    assert sheet['A1'].value == 'Employee ID' and sheet['A1'].font.b
+    assert sheet['C3'].value == 1.5 and sheet['C3'].number_format == MONEY_FORMAT
+    assert sheet.column_dimensions['B'].width > sheet.column_dimensions['C'].width
@@ -0,0 +1,88 @@
+import io
+import os
+import time
+
+import pytest
+
+from job_queue import COMPLETED, DONE, FAILED, RUNNING
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_images')
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+def sample(name):
+    with open(os.path.join(SAMPLES, name), 'rb') as f:
+        return f.read()
+
+
+def wait_for_job(client, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f'/api/jobs/{job_id}').get_json()
+        if status['pending'] == 0 and status['status'] in (COMPLETED, FAILED):
+            return status
+        time.sleep(0.1)
+    pytest.fail(f"Job {job_id} did not finish within {timeout}s")
+
+
+def upload(client, *files):
+    data = {'images': [(io.BytesIO(content), name) for name, content in files]}
+    return client.post('/run_job', data=data, headers=AJAX, content_type='multipart/form-data')
+
+
+def test_run_job_returns_before_extraction(claimistry):
+    """The upload answers 202 while the (slow) model calls still run in the background."""
+    client = claimistry.app.test_client()
+    first, second = sample('test1.jpg'), sample('test2.jpg')
+    started = time.monotonic()
+    response = upload(client, ('a.jpg', first), ('b.jpg', second), ('copy.jpg', first))
+    assert time.monotonic() - started < 0.5
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['success'] and body['job_id']
+    assert body['skipped'] == ['copy.jpg is a duplicate of another file in this upload.']
+
+    queued = client.get(body['status_url']).get_json()
+    assert queued['total'] == 2 and queued['pending'] == 2
+
+    status = wait_for_job(client, body['job_id'])
+    assert status['status'] == COMPLETED
+    assert (status['done'], status['failed']) == (2, 0)
+    assert [task['filename'] for task in status['tasks']] == ['a.jpg', 'b.jpg']
+    with claimistry.app.app_context():
+        for task in status['tasks']:
+            assert task['status'] == DONE and task['detection_tier'] == 'quad'
+            form = claimistry.db.session.get(claimistry.ReimbursementForm, task['form_id'])
+            assert form is not None and form.employee_id == 'EMP001'
+
+
+def test_unreadable_upload_fails_only_its_task(claimistry):
+    client = claimistry.app.test_client()
+    response = upload(client, ('c.jpg', sample('test3.jpg')), ('broken.jpg', b'not an image'))
+    assert response.status_code == 202
+
+    status = wait_for_job(client, response.get_json()['job_id'])
+    assert status['status'] == COMPLETED
+    tasks = {task['filename']: task for task in status['tasks']}
+    assert tasks['c.jpg']['status'] == DONE and tasks['c.jpg']['form_id']
+    assert tasks['broken.jpg']['status'] == FAILED
+    assert tasks['broken.jpg']['message'].startswith('Failed to preprocess image broken.jpg')
+
+
+def test_recover_requeues_unfinished_tasks(claimistry):
+    """Tasks left queued or running by a stopped server are processed from the stored original."""
+    app = claimistry
+    content = sample('test4.jpg')
+    name = f"{app.hashlib.sha256(content).hexdigest()}.jpg"
+    app.upload_store.put(name, content)
+    with app.app.app_context():
+        job = app.ProcessingJob(total_files=1, status=RUNNING)
+        job.tasks.append(app.ProcessingTask(original_filename='d.jpg', stored_filename=name, status=RUNNING))
+        app.db.session.add(job)
+        app.db.session.commit()
+        job_id = job.id
+        assert app.job_queue.recover() >= 1
+
+    status = wait_for_job(app.app.test_client(), job_id)
+    assert status['status'] == COMPLETED
+    assert status['tasks'][0]['status'] == DONE and status['tasks'][0]['form_id']
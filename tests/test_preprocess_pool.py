@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+from image_preprocess import create_preprocess_executor, preprocess_batch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, 'test_images', 'test1.jpg')
+
+
+def crash_worker(_):
+    os._exit(1)
+
+
+def test_crashed_worker_only_fails_its_entry():
+    with open(SAMPLE, 'rb') as f:
+        source = f.read()
+    pool = create_preprocess_executor(2)
+    try:
+        assert isinstance(pool.run(crash_worker, [None])[0], Exception)
+        results = preprocess_batch([source, source], executor=pool)
+        assert [r['error'] for r in results] == [None, None]
+    finally:
+        pool.shutdown()
+
+
+def test_workers_do_not_rerun_app_startup(tmp_path):
+    """python app.py with PREPROCESS_WORKERS > 0: workers re-import app.py, but skip its side effects."""
+    env = dict(os.environ, OPENAI_API_KEY='sk-test', PREPROCESS_WORKERS='2',
+               DATABASE_PATH=str(tmp_path / 'app.db'), UPLOAD_GC_INTERVAL='900')
+    env.pop('WERKZEUG_RUN_MAIN', None)
+    process = subprocess.run([sys.executable, os.path.join(ROOT, 'tests', 'app_as_main.py'), SAMPLE],
+                             cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert process.returncode == 0, process.stderr[-2000:]
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    assert result['tier'] == 'quad'
+    assert result['server'] == 1 and result['workers'] == [0, 0, 0, 0]
+    log = (tmp_path / 'app.log').read_text()
+    assert log.count('SQLite settings:') == 1 and log.count('Sessions:') == 1
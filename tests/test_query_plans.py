@@ -0,0 +1,105 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+from migrations import add_date_indexes
+from reports import month_range
+
+# Tables that grow with usage; a plain "SCAN <table>" on these is a regression
+HOT_TABLES = ('reimbursement_form', 'expense_entry', 'monthly_employee_rollup')
+# SQLite's name for the (year, month, group_key) unique constraint
+ROLLUP_INDEX = 'sqlite_autoindex_monthly_employee_rollup_1'
+TODAY = date.today()
+
+
+def test_month_range_is_half_open():
+    assert month_range(2025, 2) == (date(2025, 2, 1), date(2025, 3, 1))
+    assert month_range(2025, 12) == (date(2025, 12, 1), date(2026, 1, 1))
+
+
+def test_migration_adds_date_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE reimbursement_form (id INTEGER PRIMARY KEY, employee_id VARCHAR(50), '
+                          'to_date DATE, created_at DATETIME)'))
+        conn.execute(text('CREATE TABLE expense_entry (id INTEGER PRIMARY KEY, form_id INTEGER, date DATE)'))
+        add_date_indexes(conn)
+        add_date_indexes(conn)  # idempotent
+        indexes = {row[1] for table in ('reimbursement_form', 'expense_entry')
+                   for row in conn.execute(text(f'PRAGMA index_list({table})'))}
+    assert indexes == {'ix_reimbursement_form_to_date', 'ix_reimbursement_form_employee_id_to_date',
+                       'ix_reimbursement_form_created_at', 'ix_expense_entry_form_id_date'}
+
+
+@pytest.fixture(scope='module')
+def seeded(claimistry):
+    """The app with two years of forms, four entries each, and their rollups."""
+    random.seed(0)
+    with claimistry.app.app_context():
+        db = claimistry.db
+        employees = [claimistry.Employee(employee_id=f'EMP{i:04d}', name=f'Employee {i}', account_number=f'{i:012d}')
+                     for i in range(20)]
+        db.session.add_all(employees)
+        start = TODAY.replace(day=1) - timedelta(days=720)
+        for _ in range(300):
+            to_date = start + timedelta(days=random.randrange(720))
+            form = claimistry.ReimbursementForm(employee_id=random.choice(employees).employee_id,
+                                                from_date=to_date - timedelta(days=3), to_date=to_date,
+                                                location='Ahmedabad', total_amount=0)
+            db.session.add(form)
+            db.session.flush()
+            for d in range(4):
+                db.session.add(claimistry.ExpenseEntry(form_id=form.id, date=form.from_date + timedelta(days=d),
+                                                       mode_of_travel='Cab', distance_km=5, amount_rs=100))
+        db.session.commit()
+        claimistry.reports.rebuild_rollups()
+        db.session.commit()
+    return claimistry
+
+
+def page(url):
+    def run(claimistry):
+        assert claimistry.app.test_client().get(url).status_code == 200
+    return run
+
+
+def refresh_rollup(claimistry):
+    """What every form write does: recompute one employee's rollup row (rolled back afterwards)."""
+    reports = claimistry.reports
+    form = claimistry.db.session.get(claimistry.ReimbursementForm, 1)
+    reports.refresh_rollups([reports.rollup_key(form)])
+    claimistry.db.session.rollback()
+
+
+@pytest.mark.parametrize('action, index', [
+    (page('/'), ROLLUP_INDEX),
+    (page('/'), 'ix_reimbursement_form_created_at'),
+    (page('/api/forms'), 'ix_reimbursement_form_to_date'),
+    (page('/monthly_summary_selector'), 'ix_reimbursement_form_to_date'),
+    (page(f'/monthly_summary/{TODAY.year}/{TODAY.month}'), ROLLUP_INDEX),
+    (refresh_rollup, 'ix_reimbursement_form_employee_id_to_date'),
+    (refresh_rollup, 'ix_expense_entry_form_id_date'),
+    (page('/form_details/1'), 'ix_expense_entry_form_id_date'),
+], ids=['dashboard rollups', 'dashboard recent forms', 'forms list', 'month selector', 'monthly summary',
+        'rollup refresh forms', 'rollup refresh entries', 'form details'])
+def test_month_queries_use_indexes(seeded, action, index):
+    db = seeded.db
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    with seeded.app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            action(seeded)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        hot = [(s, p) for s, p in statements if any(table in s for table in HOT_TABLES)]
+        assert not any('strftime' in s for s, _ in hot), 'month filters must be date ranges, not strftime()'
+        with db.engine.connect() as conn:
+            plan = [row[-1] for s, p in hot for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {s}', p)]
+    assert any(index in line for line in plan), plan
+    assert not [line for line in plan if line in {f'SCAN {table}' for table in HOT_TABLES}], plan
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import bindparam, text
+
+from job_queue import QUEUED, RUNNING
+from storage import upload_stem
+
+logger = logging.getLogger(__name__)
+
+# How many forms use each stored image (reimbursement_form.image_filename), kept current by
+# triggers so that every write path counts, bulk inserts and deletes included. released_at
+# is when the count last dropped to zero.
+REF_TABLE = 'upload_ref'
+DEFAULT_GC_GRACE = 3600  # seconds an unreferenced image is kept before its files are deleted
+DEFAULT_GC_INTERVAL = 900  # seconds between background collections (0 = no background thread)
+
+
+def _acquire_sql(name):
+    return (f"INSERT INTO {REF_TABLE} (name, refcount) SELECT {name}, 1 WHERE {name} IS NOT NULL "
+            f"ON CONFLICT(name) DO UPDATE SET refcount = refcount + 1, released_at = NULL;")
+
+
+def _release_sql(name):
+    return (f"UPDATE {REF_TABLE} SET refcount = refcount - 1, "
+            f"released_at = CASE WHEN refcount <= 1 THEN CURRENT_TIMESTAMP END WHERE name = {name};")
+
+
+def _triggers():
+    return {
+        'upload_ref_form_ai': f"AFTER INSERT ON reimbursement_form BEGIN {_acquire_sql('NEW.image_filename')} END",
+        'upload_ref_form_au': f"AFTER UPDATE OF image_filename ON reimbursement_form "
+                              f"WHEN OLD.image_filename IS NOT NEW.image_filename BEGIN "
+                              f"{_release_sql('OLD.image_filename')} {_acquire_sql('NEW.image_filename')} END",
+        'upload_ref_form_ad': f"AFTER DELETE ON reimbursement_form BEGIN {_release_sql('OLD.image_filename')} END",
+    }
+
+
+def create_upload_refs(conn):
+    """Create the reference count table and its triggers if missing, counting the images of existing forms."""
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': REF_TABLE}
+    ).scalar()
+    if not exists:
+        conn.execute(text(
+            f"CREATE TABLE {REF_TABLE} (name VARCHAR(200) PRIMARY KEY, refcount INTEGER NOT NULL DEFAULT 0, "
+            f"released_at DATETIME)"
+        ))
+        conn.execute(text(f"CREATE INDEX ix_{REF_TABLE}_released_at ON {REF_TABLE} (released_at) WHERE refcount <= 0"))
+        conn.execute(text(
+            f"INSERT INTO {REF_TABLE} (name, refcount) SELECT image_filename, count(*) FROM reimbursement_form "
+            f"WHERE image_filename IS NOT NULL GROUP BY image_filename"
+        ))
+        logger.info(f"Counted image references in {REF_TABLE}")
+    for name, body in _triggers().items():
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+
+
+class UploadCollector:
+    """
+    Deletes stored images that no form uses any more.
+
+    collect() removes images whose reference count has been zero for at least `grace` seconds,
+    together with the files that share their stem (see storage.upload_stem): the original upload,
+    the combined image and its renditions. The grace period covers uploads still being processed
+    and lets a resubmitted form pick its image up again; images of queued or running tasks are
+    never touched. sweep() also lists the whole store to find files no form ever referenced
+    (e.g. originals of uploads that failed). With an interval, start() runs collect() on a daemon
+    thread every `interval` seconds.
+    """
+
+    def __init__(self, app, db, store, grace=DEFAULT_GC_GRACE, interval=DEFAULT_GC_INTERVAL):
+        self.app = app
+        self.db = db
+        self.store = store
+        self.grace = grace
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='upload-gc', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    self.collect()
+            except Exception as e:
+                logger.error(f"Upload garbage collection failed: {e}")
+
+    def collect(self):
+        """Delete the files of images unreferenced for longer than the grace period. Returns the number deleted."""
+        names = self.db.session.execute(text(
+            f"SELECT name FROM {REF_TABLE} WHERE refcount <= 0 AND released_at <= datetime('now', :age)"
+        ), {'age': f'-{int(self.grace)} seconds'}).scalars().all()
+        busy = self._busy_stems()
+        return sum(self._delete_group(name) for name in names if upload_stem(name) not in busy)
+
+    def sweep(self):
+        """collect(), then delete every group of files no form references that is older than the grace period."""
+        deleted = self.collect()
+        groups = defaultdict(list)
+        newest = defaultdict(float)
+        for name, modified in self.store.list():
+            stem = upload_stem(name)
+            groups[stem].append(name)
+            newest[stem] = max(newest[stem], modified)
+        referenced = {upload_stem(name) for name in self.db.session.execute(text(
+            f"SELECT name FROM {REF_TABLE} WHERE refcount > 0")).scalars()}
+        busy = self._busy_stems()
+        cutoff = time.time() - self.grace
+        for stem, names in groups.items():
+            if stem not in referenced and stem not in busy and newest[stem] <= cutoff:
+                deleted += self._delete_group(names[0])
+        return deleted
+
+    def _busy_stems(self):
+        return {upload_stem(name) for name in self.db.session.execute(text(
+            "SELECT stored_filename FROM processing_task WHERE status IN (:queued, :running)"
+        ), {'queued': QUEUED, 'running': RUNNING}).scalars()}
+
+    def _delete_group(self, name):
+        """Delete name and the files sharing its stem, unless a form uses one of them. Returns the number deleted."""
+        stem = upload_stem(name)
+        files = [other for other, _ in self.store.list(near=name) if upload_stem(other) == stem]
+        names = sorted(set(files) | {name})
+        session = self.db.session
+        # Forget the group's references first; the DELETE takes the write lock, so no form can
+        # claim one of its images between the check below and the commit
+        session.execute(text(f"DELETE FROM {REF_TABLE} WHERE refcount <= 0 AND name IN :names")
+                        .bindparams(bindparam('names', expanding=True)), {'names': names})
+        in_use = session.execute(text(f"SELECT count(*) FROM {REF_TABLE} WHERE refcount > 0 AND name IN :names")
+                                 .bindparams(bindparam('names', expanding=True)), {'names': names}).scalar()
+        if in_use:
+            session.rollback()
+            return 0
+        # A resubmitted upload then preprocesses its image again instead of linking to a deleted file
+        session.execute(text("UPDATE extraction_cache SET processed_filename = NULL WHERE processed_filename IN :names")
+                        .bindparams(bindparam('names', expanding=True)), {'names': names})
+        session.commit()
+        for other in files:
+            self.store.delete(other)
+        if files:
+            logger.info(f"Deleted {len(files)} unreferenced upload file(s) for {stem}")
+        return len(files)